@@ -2,4 +2,19 @@
 
 Presents a friendly interface to CURL."""
 
+import logging
+
+# Leave configuring logging to the application.
+try:
+    logging.getLogger(__name__).addHandler(logging.NullHandler())
+except AttributeError:
+    class _NullHandler(logging.Handler):
+        def emit(self, record):
+            pass
+    logging.getLogger(__name__).addHandler(_NullHandler())
+
 from friendly_curl import *
+from cache import *
+from response import *
+from metrics import MetricsRegistry
+from tracing import *
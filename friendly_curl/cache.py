@@ -0,0 +1,1385 @@
+"""Cache storage for :meth:`friendly_curl.FriendlyCURL.get_url`."""
+
+from __future__ import with_statement
+
+__all__ = ['BaseCache', 'DiskCache', 'MemoryCache', 'TieredCache',
+           'CacheEntry', 'CacheWriter', 'MappedBody', 'ZlibCodec',
+           'register_codec', 'cache_key',
+           'normalize_url', 'variant_key', 'parse_vary', 'parse_cache_control',
+           'freshness_lifetime', 'expiry_time', 'revalidated_response']
+
+import collections
+import contextlib
+import email.utils
+import fnmatch
+import hashlib
+import mmap
+import optparse
+import os
+import os.path
+import pickle
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import zlib
+try:
+    import threading as _threading
+except ImportError:
+    import dummy_threading as _threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from cStringIO import StringIO
+import urllib
+import urlparse
+from httplib2 import iri2uri
+
+# Ports dropped from URLs by normalize_url.
+DEFAULT_PORTS = {'http': '80', 'https': '443'}
+
+def normalize_url(url, ignore_params=()):
+    """Put ``url`` in a canonical form, so that equivalent URLs are cached
+    together. IRIs are converted to URIs, the scheme and host are lower-cased,
+    default ports and the fragment are dropped and the query parameters are
+    sorted by name. Parameters given more than once keep their order, since
+    servers often treat it as meaningful.
+
+    :param ignore_params: Names of query parameters to drop, such as\
+    tracking tokens. May contain shell-style wildcards, such as ``utm_*``.
+    :type ignore_params: sequence of str"""
+    if isinstance(url, unicode):
+        url = str(iri2uri(url))
+    scheme, netloc, path, query, fragment = urlparse.urlsplit(url)
+    scheme = scheme.lower()
+    userinfo, at, host = netloc.rpartition('@')
+    host = host.lower()
+    if host.endswith(':' + DEFAULT_PORTS.get(scheme, '')):
+        host = host.rpartition(':')[0]
+    params = []
+    for param in query.split('&'):
+        name = urllib.unquote_plus(param.partition('=')[0])
+        if param and not [pattern for pattern in ignore_params
+                          if fnmatch.fnmatchcase(name, pattern)]:
+            params.append((name, param))
+    # A stable sort, so only the names are compared.
+    params.sort(key=lambda param: param[0])
+    return urlparse.urlunsplit((scheme, userinfo + at + host, path or '/',
+                                '&'.join(param for name, param in params),
+                                ''))
+
+def cache_key(url, ignore_params=()):
+    """Get the cache key for ``url``: the hex SHA-256 digest of the URL after
+    :func:`normalize_url`."""
+    return hashlib.sha256(normalize_url(url, ignore_params)).hexdigest()
+
+def variant_key(key, vary, headers):
+    """Get the key to cache the variant of the response stored under ``key``
+    selected by request ``headers``.
+
+    :param vary: The lower-cased names of the request headers the response\
+    varies on, from its Vary header.
+    :type vary: list of str
+    :param headers: The request headers.
+    :type headers: dict"""
+    values = dict((name.lower(), ' '.join(str(value).split()))
+                  for name, value in headers.iteritems())
+    selecting = '\n'.join('%s: %s' % (name, values.get(name, ''))
+                          for name in vary)
+    return hashlib.sha256(key + '\n' + selecting).hexdigest()
+
+def parse_vary(value):
+    """Get the sorted, lower-cased header names in a Vary header."""
+    return sorted(set(name.strip().lower() for name in (value or '').split(',')
+                      if name.strip()))
+
+# Statuses that may be given a heuristic freshness lifetime (RFC 7231, 6.1).
+HEURISTICALLY_CACHEABLE = frozenset([200, 203, 204, 206, 300, 301, 404, 405,
+                                     410, 414, 501])
+
+def parse_cache_control(value):
+    """Parse a Cache-Control header into a dictionary mapping lower-cased
+    directives to their arguments, or ``None`` for those without one."""
+    directives = {}
+    if not value:
+        return directives
+    for part in value.split(','):
+        name, sep, argument = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = argument.strip('"') if sep else None
+    return directives
+
+def _parse_seconds(value):
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return None
+
+def _parse_date(value):
+    """Parse an HTTP date into seconds since the epoch, or ``None``."""
+    if not value:
+        return None
+    parsed = email.utils.parsedate_tz(value)
+    if parsed is None:
+        return None
+    return email.utils.mktime_tz(parsed)
+
+def freshness_lifetime(response, shared=False, heuristic=None):
+    """Get how many seconds ``response`` stays fresh for after it was
+    generated, from its Cache-Control max-age (or s-maxage, for a ``shared``
+    cache) or Expires header.
+
+    :param response: A response dictionary from :meth:`FriendlyCURL.get_url`.
+    :type response: dict
+    :param shared: Whether the cache is shared between users.
+    :type shared: bool
+    :param heuristic: For responses without an explicit lifetime but with\
+    Last-Modified, the fraction of the time since they were last modified to\
+    consider them fresh for. ``None`` turns this off.
+    :type heuristic: float"""
+    directives = parse_cache_control(response.get('cache-control'))
+    if 'no-store' in directives or 'no-cache' in directives:
+        return 0
+    if shared and _parse_seconds(directives.get('s-maxage')) is not None:
+        return _parse_seconds(directives['s-maxage'])
+    if _parse_seconds(directives.get('max-age')) is not None:
+        return _parse_seconds(directives['max-age'])
+    if 'expires' in response:
+        expires = _parse_date(response['expires'])
+        date = _parse_date(response.get('date'))
+        if expires is None:
+            # Invalid dates, such as "0", mean already expired.
+            return 0
+        if date is None:
+            date = time.time()
+        return max(0, expires - date)
+    if heuristic and response.get('status') in HEURISTICALLY_CACHEABLE:
+        last_modified = _parse_date(response.get('last-modified'))
+        date = _parse_date(response.get('date')) or time.time()
+        if last_modified is not None and last_modified < date:
+            return int((date - last_modified) * heuristic)
+    return 0
+
+def expiry_time(response, response_time, shared=False, heuristic=None):
+    """Get the time, in seconds since the epoch, when ``response`` stops
+    being fresh, allowing for its age when it was received at
+    ``response_time``. See :func:`freshness_lifetime` for the other
+    parameters."""
+    date = _parse_date(response.get('date'))
+    apparent_age = 0
+    if date is not None:
+        apparent_age = max(0, response_time - date)
+    initial_age = max(apparent_age, _parse_seconds(response.get('age')) or 0)
+    return (response_time - initial_age +
+            freshness_lifetime(response, shared, heuristic))
+
+def revalidated_response(stored, not_modified):
+    """Get the response to store and return after a 304 Not Modified, which
+    is ``stored`` with its headers replaced by those sent with the 304. The
+    status and Content-Length are kept from ``stored``, since the 304 refers
+    to its body.
+
+    :param stored: The cached response dictionary.
+    :type stored: dict
+    :param not_modified: The response dictionary of the 304.
+    :type not_modified: dict"""
+    response = stored.copy()
+    for name, value in not_modified.iteritems():
+        if name not in ('status', 'content-length'):
+            response[name] = value
+    return response
+
+class CacheEntry(object):
+    """A cached response, as returned by :meth:`BaseCache.get`.
+
+    :ivar key: The entry's cache key.
+    :ivar url: The URL the response was retrieved from.
+    :ivar response: The response dictionary returned by\
+    :meth:`FriendlyCURL.get_url` when the response was cached.
+    :ivar size: The length of the body, in bytes.
+    :ivar stored: When the entry was stored, in seconds since the epoch.
+    :ivar expires: When the entry stops being fresh, in seconds since the\
+    epoch, or ``None`` if it must always be revalidated.
+    :ivar body_path: The file the body is stored in, if it is on disk.
+    :ivar body: The body, if it is held in memory.
+    :ivar codec: The codec the file at ``body_path`` is compressed with, or\
+    ``None``. See :class:`ZlibCodec`."""
+
+    def __init__(self, key, url, response, size, stored, body_path=None,
+                 body=None, expires=None, codec=None):
+        self.key = key
+        self.url = url
+        self.response = response
+        self.size = size
+        self.stored = stored
+        self.body_path = body_path
+        self.body = body
+        self.expires = expires
+        self.codec = codec
+
+    def is_fresh(self, now=None):
+        """Whether the entry can be used without revalidating it."""
+        if self.expires is None:
+            return False
+        if now is None:
+            now = time.time()
+        return now < self.expires
+
+    def open(self):
+        """Open the cached body for reading. Compressed bodies are
+        decompressed as they are read."""
+        if self.body is not None:
+            return StringIO(self.body)
+        if self.codec is not None:
+            return _DecompressingBody(open(self.body_path, 'rb'),
+                                      self.codec.decompressor())
+        return open(self.body_path, 'rb')
+
+    def open_mapped(self):
+        """Open the cached body for reading without copying it. Bodies on
+        disk are memory-mapped with :class:`MappedBody`; those held in memory
+        are read from where they are. Compressed bodies can't be mapped, so
+        they are decompressed into memory instead."""
+        if self.body is not None:
+            return StringIO(self.body)
+        if self.codec is not None:
+            with contextlib.closing(self.open()) as body:
+                return StringIO(body.read())
+        return MappedBody(self.body_path)
+
+class MappedBody(object):
+    """A read-only file-like object over a memory-mapped file, so that the
+    data is served from the operating system's page cache and only copied
+    when it is read. The file can be replaced or removed while it is mapped.
+
+    :param path: The file to map.
+    :type path: str"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as body_file:
+            size = os.fstat(body_file.fileno()).st_size
+            if size:
+                self._map = mmap.mmap(body_file.fileno(), size,
+                                      access=mmap.ACCESS_READ)
+            else:
+                # Empty files can't be mapped.
+                self._map = StringIO('')
+        self.size = size
+        self.closed = False
+
+    def read(self, amt=-1):
+        """Read up to ``amt`` bytes, or the rest of the file if ``amt`` is
+        negative."""
+        if amt is None or amt < 0:
+            amt = self.size - self._map.tell()
+        return self._map.read(amt)
+
+    def readline(self):
+        return self._map.readline()
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+    def seek(self, offset, whence=0):
+        self._map.seek(offset, whence)
+
+    def tell(self):
+        return self._map.tell()
+
+    def getvalue(self):
+        """Get the whole file, like ``StringIO.getvalue()``."""
+        if not self.size:
+            return ''
+        return self._map[:]
+
+    def getbuffer(self):
+        """Get a ``buffer`` over the mapping, to hand the data to code that
+        accepts the buffer protocol without copying it."""
+        return buffer(self._map)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        return self._map[index]
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class ZlibCodec(object):
+    """Compresses cached bodies with zlib. Pass one to :class:`DiskCache` to
+    store bodies compressed.
+
+    Other codecs can be used by passing an object with the same attributes:
+    a unique ``name``, to record which codec a body was compressed with, and
+    ``compressor()`` and ``decompressor()`` methods returning objects that
+    work like those of ``zlib.compressobj()`` and ``zlib.decompressobj()``.
+    Codecs must be registered with :func:`register_codec` before bodies
+    compressed with them can be read, which :class:`DiskCache` does for the
+    one it is given.
+
+    :param level: The compression level, from 1 (fastest) to 9 (smallest).
+    :type level: int"""
+
+    name = 'zlib'
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compressor(self):
+        return zlib.compressobj(self.level)
+
+    def decompressor(self):
+        return zlib.decompressobj()
+
+# Codecs bodies can be read with, by name.
+CODECS = {}
+
+def register_codec(codec):
+    """Make bodies compressed with ``codec`` readable. See
+    :class:`ZlibCodec`."""
+    CODECS[codec.name] = codec
+
+register_codec(ZlibCodec())
+
+# Bodies starting with these are stored as they are, rather than compressed
+# again: gzip, as sent by servers with Content-Encoding: gzip.
+_COMPRESSED_MAGIC = ('\x1f\x8b',)
+
+class _DecompressingBody(object):
+    """A read-only file-like object decompressing ``body_file`` with
+    ``decompressor`` as it is read."""
+
+    def __init__(self, body_file, decompressor):
+        self._file = body_file
+        self._decompressor = decompressor
+        # Decompressed data not read yet: chunks as they came out of the
+        # decompressor, less the first _offset bytes of the first.
+        self._chunks = collections.deque()
+        self._offset = 0
+        self._buffered = 0
+        self._eof = False
+        self.closed = False
+
+    def _fill(self, amt):
+        """Decompress until at least ``amt`` bytes are buffered, or all of
+        them if ``amt`` is negative."""
+        while not self._eof and (amt < 0 or self._buffered < amt):
+            data = self._file.read(64 * 1024)
+            if data:
+                data = self._decompressor.decompress(data)
+            else:
+                data = self._decompressor.flush()
+                self._eof = True
+            if data:
+                self._chunks.append(data)
+                self._buffered += len(data)
+
+    def read(self, amt=-1):
+        """Read up to ``amt`` bytes, or the rest of the body if ``amt`` is
+        negative."""
+        if amt is None:
+            amt = -1
+        self._fill(amt)
+        if amt < 0 or amt > self._buffered:
+            amt = self._buffered
+        pieces = []
+        wanted = amt
+        while wanted:
+            chunk = self._chunks[0]
+            end = self._offset + wanted
+            if end >= len(chunk):
+                pieces.append(chunk[self._offset:] if self._offset else chunk)
+                wanted -= len(chunk) - self._offset
+                self._chunks.popleft()
+                self._offset = 0
+            else:
+                pieces.append(chunk[self._offset:end])
+                self._offset = end
+                wanted = 0
+        self._buffered -= amt
+        return ''.join(pieces)
+
+    def readline(self):
+        # How far into the buffered data there's certainly no newline.
+        searched = 0
+        while True:
+            position = 0
+            for index, chunk in enumerate(self._chunks):
+                start = self._offset if index == 0 else 0
+                size = len(chunk) - start
+                if position + size > searched:
+                    found = chunk.find('\n', start + max(searched - position,
+                                                         0))
+                    if found >= 0:
+                        return self.read(position + found - start + 1)
+                position += size
+            searched = position
+            if self._eof:
+                return self.read()
+            self._fill(self._buffered + 1)
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class CacheWriter(object):
+    """Stores a response in a cache while its body is written, returned by
+    :meth:`BaseCache.writer`. Call :meth:`commit` once the body is complete
+    to store it, or :meth:`abort` to throw it away.
+
+    This implementation holds the body in memory and passes it to
+    :meth:`BaseCache.put`; caches that can do better override
+    :meth:`BaseCache.writer`."""
+
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        self._body = StringIO()
+
+    def write(self, data):
+        self._body.write(data)
+
+    def commit(self, url, response, expires=None, key=None):
+        """Store the response with the body written so far. See\
+        :meth:`BaseCache.put` for the parameters.
+
+        :param key: The key to store it under, if not the one the writer was\
+        created for."""
+        self._body.seek(0)
+        self.cache.put(key or self.key, url, response, self._body, expires)
+        self._body.close()
+
+    def abort(self):
+        """Discard the body written so far without storing anything."""
+        self._body.close()
+
+def _put_with_writer(cache, key, url, response, body, expires):
+    """Implement :meth:`BaseCache.put` with :meth:`BaseCache.writer`."""
+    writer = cache.writer(key)
+    try:
+        shutil.copyfileobj(body, writer)
+    except:
+        writer.abort()
+        raise
+    writer.commit(url, response, expires)
+
+def _makedirs(path):
+    """Create the directory ``path`` unless it exists, even if another
+    process is creating it at the same time."""
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+
+@contextlib.contextmanager
+def _no_lock():
+    yield False
+
+class BaseCache(object):
+    """The interface :meth:`FriendlyCURL.get_url` expects of a cache.
+    Subclass this to store responses somewhere other than a
+    :class:`DiskCache`. Subclasses should call :meth:`_count` from
+    :meth:`get` to keep hit and miss counts.
+
+    :param shared: Whether the cache is shared between users, so that\
+    s-maxage applies. See :func:`freshness_lifetime`.
+    :type shared: bool
+    :param heuristic_freshness: The fraction of the time since it was last\
+    modified to consider a response without an explicit lifetime fresh for.\
+    See :func:`freshness_lifetime`.
+    :type heuristic_freshness: float
+    :param stale_while_revalidate: How many seconds after they expire to\
+    serve responses while they are refreshed in the background, for those\
+    that don't say. See :meth:`serves_stale`.
+    :type stale_while_revalidate: int
+    :param stale_if_error: How many seconds after they expire to serve\
+    responses if the server can't be reached or has an error, for those\
+    that don't say. See :meth:`serves_stale`.
+    :type stale_if_error: int
+    :param ignore_params: Query parameters to leave out of cache keys. See\
+    :func:`normalize_url`.
+    :type ignore_params: sequence of str"""
+
+    def __init__(self, shared=False, heuristic_freshness=None,
+                 stale_while_revalidate=None, stale_if_error=None,
+                 ignore_params=()):
+        self.shared = shared
+        self.ignore_params = tuple(ignore_params)
+        self.heuristic_freshness = heuristic_freshness
+        self.stale_while_revalidate = stale_while_revalidate
+        self.stale_if_error = stale_if_error
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = _threading.Lock()
+
+    def _count(self, entry):
+        """Count a lookup as a hit or miss depending on whether ``entry`` is
+        ``None``, and return ``entry``."""
+        with self._stats_lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return entry
+
+    def stats(self):
+        """Get a dictionary of the number of lookups that were ``hits`` and
+        ``misses``."""
+        with self._stats_lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+    def key_for(self, url):
+        """Get the key a response for ``url`` is cached under. Defaults to
+        :func:`cache_key`."""
+        return cache_key(url, self.ignore_params)
+
+    def request_key(self, key, headers):
+        """Get the key of the variant of the response stored under ``key``
+        selected by request ``headers``, if the last response stored there
+        had a Vary header. Otherwise gives ``key``."""
+        vary = self.get_vary(key)
+        if not vary:
+            return key
+        return variant_key(key, vary, headers)
+
+    def lookup(self, key, headers):
+        """Get the key of the variant selected by request ``headers``, as
+        :meth:`request_key` does, along with the entry stored under it as
+        :meth:`get` gives it. Caches override this to do both at once."""
+        request_key = self.request_key(key, headers)
+        return request_key, self.get(request_key)
+
+    def response_key(self, key, headers, response):
+        """Record the Vary header of ``response``, to be stored for ``key``,
+        and get the key to store it under. See :meth:`request_key`."""
+        vary = parse_vary(response.get('vary'))
+        if vary != (self.get_vary(key) or []):
+            self.set_vary(key, vary)
+        if not vary:
+            return key
+        return variant_key(key, vary, headers)
+
+    def get_vary(self, key):
+        """Get the header names recorded by :meth:`set_vary` for ``key``, or
+        ``None``."""
+        raise NotImplementedError()
+
+    def set_vary(self, key, vary):
+        """Record that responses for ``key`` vary on the request headers
+        named in ``vary``, or forget about it if it is empty."""
+        raise NotImplementedError()
+
+    def entry_id(self, key):
+        """Get a value identifying the entry stored under ``key`` across all
+        cache objects that store to the same place, so that
+        :meth:`FriendlyCURL.get_url` can coalesce requests for it. Defaults
+        to one unique to this object."""
+        return (id(self), key)
+
+    def lock(self, key):
+        """Get a context manager holding a lock on ``key`` across processes
+        while :meth:`FriendlyCURL.get_url` fetches it, which gives whether it
+        had to wait for another process. Defaults to not locking."""
+        return _no_lock()
+
+    def storable(self, response):
+        """Whether ``response`` may be stored at all. A 304 only updates
+        the entry it revalidates, so is never stored in its own right."""
+        if response.get('status') == 304:
+            return False
+        directives = parse_cache_control(response.get('cache-control'))
+        if 'no-store' in directives or '*' in parse_vary(response.get('vary')):
+            return False
+        return not (self.shared and 'private' in directives)
+
+    def expires_for(self, response, response_time):
+        """Get the expiry time to store ``response`` with, given that it was
+        received at ``response_time``. See :func:`expiry_time`."""
+        return expiry_time(response, response_time, self.shared,
+                           self.heuristic_freshness)
+
+    def serves_stale(self, entry, directive, now=None):
+        """Whether ``entry``, which is no longer fresh, may still be used
+        under ``directive``: ``'stale-while-revalidate'`` or
+        ``'stale-if-error'`` (RFC 5861). The window comes from the directive
+        in the response's Cache-Control, or else this cache's policy.
+        Responses marked must-revalidate are never used stale."""
+        if entry.expires is None:
+            return False
+        directives = parse_cache_control(entry.response.get('cache-control'))
+        if 'must-revalidate' in directives or 'no-cache' in directives or \
+           (self.shared and 'proxy-revalidate' in directives):
+            return False
+        window = _parse_seconds(directives.get(directive))
+        if window is None:
+            window = getattr(self, directive.replace('-', '_'))
+        if window is None:
+            return False
+        if now is None:
+            now = time.time()
+        return now < entry.expires + window
+
+    def get(self, key):
+        """Get the :class:`CacheEntry` stored under ``key``, or ``None``."""
+        raise NotImplementedError()
+
+    def put(self, key, url, response, body, expires=None):
+        """Store a response under ``key``, replacing any already there.
+
+        :param url: The URL the response was retrieved from.
+        :param response: The response dictionary.
+        :type response: dict
+        :param body: The body of the response.
+        :type body: ``.read()``-able file-like object
+        :param expires: When the response stops being fresh. See\
+        :meth:`expires_for`."""
+        raise NotImplementedError()
+
+    def writer(self, key):
+        """Start storing a response under ``key`` whose body is written as it
+        arrives, so that it needn't be buffered first. See\
+        :class:`CacheWriter`."""
+        return CacheWriter(self, key)
+
+    def update(self, key, response, expires=None):
+        """Replace the response dictionary and expiry time of the entry
+        stored under ``key``, keeping its body. Does nothing if there is no
+        such entry. See :meth:`put` for the parameters."""
+        raise NotImplementedError()
+
+    def delete(self, key):
+        """Remove the entry stored under ``key``, if there is one."""
+        raise NotImplementedError()
+
+    def keys(self):
+        """Get a list of the keys of all cached entries."""
+        raise NotImplementedError()
+
+    def size(self):
+        """Get the total size of all cached bodies, in bytes."""
+        raise NotImplementedError()
+
+    def __len__(self):
+        return len(self.keys())
+
+class DiskCache(BaseCache):
+    """Stores responses in a directory. An SQLite index, ``index.sqlite``,
+    maps each key to the pickled response dictionary and the SHA-256 digest
+    of its body. Bodies are kept under ``bodies/`` in one file per digest, so
+    identical bodies stored under different keys take up disk space once; the
+    index counts the entries referring to each and a body is removed along
+    with the last of them. Looking an entry up takes a single indexed read.
+
+    A :class:`DiskCache` may be shared between threads, and several processes
+    on the same machine may use the same directory, including processes
+    forked after it was created. Bodies are written to temporary files and
+    renamed into place, and each entry is published to the index in a single
+    transaction, so readers never see a partly written entry. The index is
+    kept in SQLite's write-ahead log mode so that reads don't wait for
+    writes.
+
+    When limits are given, the least recently used entries are evicted as
+    new ones are stored to keep within them. The index keeps running totals
+    of entries and bytes, so checking the limits doesn't scan it. It records
+    when each entry was last used, to within :attr:`ACCESS_RESOLUTION`
+    seconds so that most reads don't need to write to it. Bodies already
+    opened by readers stay readable after their entry is evicted.
+
+    :param cache_dir: The directory to store the cache in. It is created if\
+    it doesn't exist.
+    :type cache_dir: str
+    :param max_bytes: The most bytes of bodies to keep, or ``None``. Bodies\
+    shared by several entries count once.
+    :type max_bytes: int
+    :param max_entries: The most entries to keep, or ``None``.
+    :type max_entries: int
+    :param lock_files: Whether to lock entries with files under ``locks/``\
+    while they are fetched, so that processes sharing the directory don't\
+    fetch the same response at once. Keys are spread over at most 4096 lock\
+    files, so unrelated entries occasionally wait on each other. Requires\
+    ``fcntl``.
+    :type lock_files: bool
+    :param compression: A codec to compress bodies with as they are stored,\
+    such as :class:`ZlibCodec`, or ``None`` to store them as they are. Bodies\
+    that are already gzipped are never compressed again. Compression doesn't\
+    change which bodies can be read, so it can be turned on or off for an\
+    existing directory.
+    :param kwargs: Options for :class:`BaseCache`."""
+
+    # Bump when the index's layout changes; older indexes are discarded.
+    SCHEMA_VERSION = 7
+
+    #: How stale an entry's last use time may get before a read updates it.
+    ACCESS_RESOLUTION = 1.0
+
+    def __init__(self, cache_dir, max_bytes=None, max_entries=None,
+                 lock_files=False, compression=None, **kwargs):
+        BaseCache.__init__(self, **kwargs)
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.lock_files = lock_files and fcntl is not None
+        self.compression = compression
+        if compression is not None:
+            register_codec(compression)
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.lock_dir = os.path.join(self.cache_dir, 'locks')
+        self.body_dir = os.path.join(self.cache_dir, 'bodies')
+        self.index_path = os.path.join(self.cache_dir, 'index.sqlite')
+        self._local = _threading.local()
+        _makedirs(self.body_dir)
+        self._create_index()
+
+    def _connection(self):
+        """Get this thread's connection to the index. Connections aren't
+        used across a fork, so each process gets its own."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.index_path, timeout=60)
+            connection.text_factory = str
+            # Safe with the write-ahead log; only a power failure can lose
+            # the last few transactions.
+            connection.execute('PRAGMA synchronous = NORMAL')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _create_index(self):
+        connection = self._connection()
+        # Persistent, so this only has to be done once for each directory.
+        connection.execute('PRAGMA journal_mode = WAL')
+        with connection:
+            version = connection.execute('PRAGMA user_version').fetchone()[0]
+            if version != self.SCHEMA_VERSION:
+                connection.execute('DROP TABLE IF EXISTS entries')
+                connection.execute('DROP TABLE IF EXISTS vary')
+                connection.execute('DROP TABLE IF EXISTS bodies')
+                connection.execute('DROP TABLE IF EXISTS stats')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                'key TEXT PRIMARY KEY, url TEXT, response BLOB, digest TEXT, '
+                'size INTEGER, stored REAL, expires REAL, accessed REAL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS entries_accessed '
+                               'ON entries (accessed)')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS bodies ('
+                'digest TEXT PRIMARY KEY, size INTEGER, codec TEXT, '
+                'refs INTEGER)')
+            connection.execute('CREATE TABLE IF NOT EXISTS vary ('
+                               'key TEXT PRIMARY KEY, headers TEXT)')
+            # Running totals, so that checking the limits needs no scans.
+            connection.execute('CREATE TABLE IF NOT EXISTS stats ('
+                               'id INTEGER PRIMARY KEY, entries INTEGER, '
+                               'bytes INTEGER)')
+            connection.execute(
+                'INSERT OR IGNORE INTO stats (id, entries, bytes) VALUES '
+                '(0, (SELECT COUNT(*) FROM entries), '
+                '(SELECT COALESCE(SUM(size), 0) FROM bodies))')
+            connection.execute('PRAGMA user_version = %d' %
+                               self.SCHEMA_VERSION)
+
+    def _body_path(self, digest):
+        return os.path.join(self.body_dir, digest[:2], digest)
+
+    def entry_id(self, key):
+        return (self.cache_dir, key)
+
+    def lock(self, key):
+        if not self.lock_files:
+            return BaseCache.lock(self, key)
+        return self._lock_file(key)
+
+    @contextlib.contextmanager
+    def _lock_file(self, key):
+        _makedirs(self.lock_dir)
+        # A fixed set of files, named by the first digits of a hash of the
+        # key, rather than one for every key ever locked.
+        bucket = hashlib.sha256(key).hexdigest()[:3]
+        with open(os.path.join(self.lock_dir, bucket), 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                waited = False
+            except IOError:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                waited = True
+            try:
+                yield waited
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get(self, key):
+        connection = self._connection()
+        row = connection.execute(
+            'SELECT url, response, bodies.digest, entries.size, stored, '
+            'expires, codec, accessed FROM entries JOIN bodies USING (digest) '
+            'WHERE key = ?', (key,)).fetchone()
+        return self._entry(connection, key, row)
+
+    def lookup(self, key, headers):
+        # The Vary header names come with the entry stored under the key
+        # itself, so a response without one takes a single read.
+        connection = self._connection()
+        row = connection.execute(
+            'SELECT vary.headers, url, response, bodies.digest, '
+            'entries.size, stored, expires, codec, accessed '
+            'FROM (SELECT ? AS key) AS wanted LEFT JOIN vary USING (key) '
+            'LEFT JOIN entries USING (key) LEFT JOIN bodies USING (digest)',
+            (key,)).fetchone()
+        if row[0] is not None:
+            request_key = variant_key(key, row[0].split(', '), headers)
+            return request_key, self.get(request_key)
+        return key, self._entry(connection, key, row[1:])
+
+    def _entry(self, connection, key, row):
+        """Get the :class:`CacheEntry` for an index ``row`` read by
+        :meth:`get`, or ``None`` if there isn't a usable one."""
+        if row is None or row[2] is None or \
+           (row[6] is not None and row[6] not in CODECS):
+            return self._count(None)
+        url, response, digest, size, stored, expires, codec, accessed = row
+        now = time.time()
+        if now - accessed >= self.ACCESS_RESOLUTION:
+            with connection:
+                connection.execute(
+                    'UPDATE entries SET accessed = ? WHERE key = ?',
+                    (now, key))
+        return self._count(CacheEntry(key, url, pickle.loads(str(response)),
+                                      size, stored, self._body_path(digest),
+                                      expires=expires,
+                                      codec=CODECS.get(codec)))
+
+    def put(self, key, url, response, body, expires=None):
+        _put_with_writer(self, key, url, response, body, expires)
+
+    def writer(self, key):
+        return _DiskCacheWriter(self, key)
+
+    def _index(self, key, url, response, temp_path, digest, size, stored_size,
+               codec, expires):
+        """Add an entry to the index, moving its body from ``temp_path`` into
+        place unless a body with the same digest is already stored.
+
+        :param size: The length of the body.
+        :param stored_size: The size of the file at ``temp_path``.
+        :param codec: The name of the codec the file is compressed with."""
+        connection = self._connection()
+        with connection:
+            # Taking a reference first locks the index, so the body can't be
+            # removed by another thread or process before it is used.
+            if connection.execute('INSERT OR IGNORE INTO bodies (digest, '
+                                  'size, codec, refs) VALUES (?, ?, ?, 0)',
+                                  (digest, stored_size, codec)).rowcount:
+                connection.execute('UPDATE stats SET bytes = bytes + ?',
+                                   (stored_size,))
+            connection.execute('UPDATE bodies SET refs = refs + 1 '
+                               'WHERE digest = ?', (digest,))
+            refs, old_size = connection.execute(
+                'SELECT refs, size FROM bodies WHERE digest = ?',
+                (digest,)).fetchone()
+            body_path = self._body_path(digest)
+            # Only a body another entry already uses is known to match its
+            # row; a file without one may have been left behind by an older
+            # index or a rolled back transaction, stored with another codec.
+            if refs > 1 and os.path.exists(body_path):
+                os.unlink(temp_path)
+            else:
+                _makedirs(os.path.dirname(body_path))
+                os.rename(temp_path, body_path)
+                connection.execute('UPDATE bodies SET size = ?, codec = ? '
+                                   'WHERE digest = ?',
+                                   (stored_size, codec, digest))
+                connection.execute('UPDATE stats SET bytes = bytes + ?',
+                                   (stored_size - old_size,))
+            self._release(connection, key)
+            connection.execute(
+                'INSERT INTO entries '
+                '(key, url, response, digest, size, stored, expires, accessed) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, url, sqlite3.Binary(pickle.dumps(response,
+                                                       pickle.HIGHEST_PROTOCOL)),
+                 digest, size, time.time(), expires, time.time()))
+            connection.execute('UPDATE stats SET entries = entries + 1')
+        if self.max_bytes is not None or self.max_entries is not None:
+            self.trim()
+
+    def get_vary(self, key):
+        row = self._connection().execute(
+            'SELECT headers FROM vary WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        return row[0].split(', ')
+
+    def set_vary(self, key, vary):
+        connection = self._connection()
+        with connection:
+            if vary:
+                connection.execute(
+                    'INSERT OR REPLACE INTO vary (key, headers) VALUES (?, ?)',
+                    (key, ', '.join(vary)))
+            else:
+                connection.execute('DELETE FROM vary WHERE key = ?', (key,))
+
+    def update(self, key, response, expires=None):
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                'UPDATE entries SET response = ?, stored = ?, expires = ? '
+                'WHERE key = ?',
+                (sqlite3.Binary(pickle.dumps(response,
+                                             pickle.HIGHEST_PROTOCOL)),
+                 time.time(), expires, key))
+
+    def delete(self, key):
+        connection = self._connection()
+        with connection:
+            self._release(connection, key)
+
+    def _release(self, connection, key):
+        """Remove the entry for ``key`` from the index, if there is one, and
+        its body if no other entry refers to it. Must be called in a
+        transaction."""
+        row = connection.execute('SELECT digest FROM entries WHERE key = ?',
+                                 (key,)).fetchone()
+        if row is None:
+            return
+        digest = row[0]
+        if not connection.execute('DELETE FROM entries WHERE key = ? AND '
+                                  'digest = ?', (key, digest)).rowcount:
+            # Someone else got there first.
+            return
+        connection.execute('UPDATE stats SET entries = entries - 1')
+        connection.execute('UPDATE bodies SET refs = refs - 1 '
+                           'WHERE digest = ?', (digest,))
+        row = connection.execute('SELECT refs, size FROM bodies '
+                                 'WHERE digest = ?', (digest,)).fetchone()
+        if row is not None:
+            if row[0] > 0:
+                return
+            connection.execute('DELETE FROM bodies WHERE digest = ?',
+                               (digest,))
+            connection.execute('UPDATE stats SET bytes = bytes - ?',
+                               (row[1],))
+        # Removed while the index is locked, so that nothing can take a new
+        # reference to it in the meantime.
+        try:
+            os.unlink(self._body_path(digest))
+        except OSError:
+            pass
+
+    def keys(self):
+        return [row[0] for row in
+                self._connection().execute('SELECT key FROM entries')]
+
+    def size(self):
+        return self._connection().execute(
+            'SELECT bytes FROM stats').fetchone()[0]
+
+    def __len__(self):
+        return self._connection().execute(
+            'SELECT entries FROM stats').fetchone()[0]
+
+    def trim(self, max_bytes=None, max_entries=None):
+        """Evict the least recently used entries until the cache is within
+        ``max_bytes`` and ``max_entries``, which default to the limits it was
+        created with.
+
+        :returns: The number of entries evicted."""
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+        if max_entries is None:
+            max_entries = self.max_entries
+        connection = self._connection()
+        count, size = connection.execute(
+            'SELECT entries, bytes FROM stats').fetchone()
+        def over():
+            return (max_bytes is not None and size > max_bytes) or \
+                   (max_entries is not None and count > max_entries)
+        if not over():
+            return 0
+        evict = []
+        # A body's space is only freed once every entry using it is evicted.
+        refs = {}
+        for key, digest, body_size, body_refs in connection.execute(
+            'SELECT key, digest, bodies.size, refs FROM entries '
+            'JOIN bodies USING (digest) ORDER BY accessed'):
+            evict.append(key)
+            count -= 1
+            refs[digest] = refs.get(digest, body_refs) - 1
+            if not refs[digest]:
+                size -= body_size
+            if not over():
+                break
+        for key in evict:
+            self.delete(key)
+        return len(evict)
+
+    def collect_garbage(self, max_age=3600):
+        """Remove files under ``bodies/`` that don't belong to an entry, such
+        as those left by a process that died while storing a response. Files
+        younger than ``max_age`` seconds are kept, since they may be bodies
+        still being written.
+
+        :returns: The number of files removed."""
+        digests = set(row[0] for row in
+                      self._connection().execute('SELECT digest FROM bodies'))
+        cutoff = time.time() - max_age
+        removed = 0
+        for dir_path, dir_names, file_names in os.walk(self.body_dir):
+            for file_name in file_names:
+                path = os.path.join(dir_path, file_name)
+                try:
+                    if file_name in digests or \
+                       os.path.getmtime(path) > cutoff:
+                        continue
+                    os.unlink(path)
+                except OSError:
+                    continue
+                removed += 1
+        return removed
+
+class _DiskCacheWriter(CacheWriter):
+    """Writes the body straight to a new file under ``bodies/``, hashing and
+    compressing it as it goes, which is renamed into place on commit. The
+    rename means a file that may be mapped by a :class:`MappedBody` is never
+    truncated."""
+
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        self._digest = hashlib.sha256()
+        self._size = 0
+        # Chosen once the start of the body shows whether it's compressed.
+        self._codec = self._compressor = None
+        self._pending = '' if cache.compression is not None else None
+        _makedirs(cache.body_dir)
+        fd, self.temp_path = tempfile.mkstemp(dir=cache.body_dir)
+        self._body = os.fdopen(fd, 'wb')
+
+    def write(self, data):
+        self._digest.update(data)
+        self._size += len(data)
+        if self._pending is not None:
+            self._pending += data
+            if len(self._pending) < 2:
+                return
+            data = self._start_compression()
+        self._write_body(data)
+
+    def _write_body(self, data):
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+        self._body.write(data)
+
+    def _start_compression(self):
+        """Decide whether to compress the body, and return what was held
+        back while deciding."""
+        data, self._pending = self._pending, None
+        if not data.startswith(_COMPRESSED_MAGIC):
+            self._codec = self.cache.compression
+            self._compressor = self._codec.compressor()
+        return data
+
+    def commit(self, url, response, expires=None, key=None):
+        try:
+            if self._pending is not None:
+                self._write_body(self._start_compression())
+            if self._compressor is not None:
+                self._body.write(self._compressor.flush())
+            stored_size = self._body.tell()
+            self._body.close()
+            self.cache._index(key or self.key, url, response, self.temp_path,
+                              self._digest.hexdigest(), self._size,
+                              stored_size,
+                              self._codec and self._codec.name, expires)
+        except:
+            self.abort()
+            raise
+
+    def abort(self):
+        self._body.close()
+        try:
+            os.unlink(self.temp_path)
+        except OSError:
+            pass
+
+class MemoryCache(BaseCache):
+    """Holds responses in memory, discarding the least recently used once
+    there are more than ``max_entries`` or their bodies total more than
+    ``max_bytes``. Bodies larger than ``max_bytes`` aren't stored. A
+    :class:`MemoryCache` may be shared between threads.
+
+    :param max_bytes: The most body data to hold, in bytes.
+    :type max_bytes: int
+    :param max_entries: The most entries to hold.
+    :type max_entries: int
+    :param kwargs: Options for :class:`BaseCache`."""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_entries=10000,
+                 **kwargs):
+        BaseCache.__init__(self, **kwargs)
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._vary = collections.OrderedDict()
+        self._size = 0
+        self._lock = _threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                # Move it to the most recently used end.
+                self._entries[key] = entry
+        if entry is None:
+            return self._count(None)
+        # Callers may modify the response, so don't hand out ours.
+        return self._count(CacheEntry(entry.key, entry.url,
+                                      entry.response.copy(), entry.size,
+                                      entry.stored, body=entry.body,
+                                      expires=entry.expires))
+
+    def put(self, key, url, response, body, expires=None):
+        self.put_entry(CacheEntry(key, url, response.copy(), None, time.time(),
+                                  body=body.read(), expires=expires))
+
+    def put_entry(self, entry):
+        """Store a :class:`CacheEntry` whose body is held in memory."""
+        entry.size = len(entry.body)
+        with self._lock:
+            old = self._entries.pop(entry.key, None)
+            if old is not None:
+                self._size -= old.size
+            if entry.size > self.max_bytes:
+                return
+            self._entries[entry.key] = entry
+            self._size += entry.size
+            while len(self._entries) > self.max_entries or \
+                  self._size > self.max_bytes:
+                key, evicted = self._entries.popitem(last=False)
+                self._size -= evicted.size
+
+    def get_vary(self, key):
+        with self._lock:
+            return self._vary.get(key)
+
+    def set_vary(self, key, vary):
+        with self._lock:
+            self._vary.pop(key, None)
+            if vary:
+                self._vary[key] = list(vary)
+                if len(self._vary) > self.max_entries:
+                    self._vary.popitem(last=False)
+
+    def update(self, key, response, expires=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                # Replace rather than modify, entries may have been handed out.
+                self._entries[key] = CacheEntry(key, entry.url, response.copy(),
+                                                entry.size, time.time(),
+                                                body=entry.body,
+                                                expires=expires)
+
+    def delete(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._size -= entry.size
+
+    def keys(self):
+        with self._lock:
+            return self._entries.keys()
+
+    def size(self):
+        with self._lock:
+            return self._size
+
+class _TieredCacheWriter(CacheWriter):
+    """Writes through to the backing cache's writer, keeping a copy of the
+    body for the memory cache until it turns out to be too large."""
+
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        self._backing = cache.backing.writer(key)
+        self._chunks = []
+        self._size = 0
+
+    def write(self, data):
+        self._backing.write(data)
+        if self._chunks is not None:
+            self._size += len(data)
+            if self._size > self.cache.memory.max_bytes:
+                self._chunks = None
+            else:
+                self._chunks.append(data)
+
+    def commit(self, url, response, expires=None, key=None):
+        key = key or self.key
+        memory = self.cache.memory
+        memory.delete(key)
+        self._backing.commit(url, response, expires, key)
+        if self._chunks is not None:
+            memory.put_entry(CacheEntry(key, url, response.copy(), None,
+                                        time.time(), body=''.join(self._chunks),
+                                        expires=expires))
+
+    def abort(self):
+        self._backing.abort()
+
+class TieredCache(BaseCache):
+    """Puts a :class:`MemoryCache` in front of another cache, usually a
+    :class:`DiskCache`, so that frequently used responses are served without
+    touching the slower cache. Entries found in the slower cache are copied
+    into memory when they fit.
+
+    :param memory: The fast cache.
+    :type memory: :class:`MemoryCache`
+    :param backing: The slow cache, which holds every entry.
+    :type backing: :class:`BaseCache`
+    :param kwargs: Options for :class:`BaseCache`."""
+
+    def __init__(self, memory, backing, **kwargs):
+        BaseCache.__init__(self, **kwargs)
+        self.memory = memory
+        self.backing = backing
+
+    def key_for(self, url):
+        return self.backing.key_for(url)
+
+    def entry_id(self, key):
+        return self.backing.entry_id(key)
+
+    def get_vary(self, key):
+        vary = self.memory.get_vary(key)
+        if vary is None:
+            vary = self.backing.get_vary(key)
+            if vary:
+                self.memory.set_vary(key, vary)
+        return vary
+
+    def set_vary(self, key, vary):
+        self.memory.set_vary(key, vary)
+        self.backing.set_vary(key, vary)
+
+    def lookup(self, key, headers):
+        # A response in memory is served without asking the backing cache
+        # even for its Vary header.
+        request_key, entry = self.memory.lookup(key, headers)
+        if entry is None:
+            request_key, entry = self.backing.lookup(key, headers)
+            if entry is not None:
+                if request_key != key:
+                    self.memory.set_vary(key, self.backing.get_vary(key))
+                self._promote(entry)
+        return request_key, self._count(entry)
+
+    def lock(self, key):
+        return self.backing.lock(key)
+
+    def get(self, key):
+        entry = self.memory.get(key)
+        if entry is None:
+            entry = self.backing.get(key)
+            if entry is not None:
+                self._promote(entry)
+        return self._count(entry)
+
+    def _promote(self, entry):
+        """Copy an entry from the backing cache into memory, if it fits."""
+        if entry.size > self.memory.max_bytes:
+            return
+        try:
+            with contextlib.closing(entry.open()) as body:
+                data = body.read()
+        except (IOError, OSError):
+            return
+        self.memory.put_entry(CacheEntry(entry.key, entry.url,
+                                         entry.response.copy(), None,
+                                         entry.stored, body=data,
+                                         expires=entry.expires))
+
+    def put(self, key, url, response, body, expires=None):
+        _put_with_writer(self, key, url, response, body, expires)
+
+    def writer(self, key):
+        return _TieredCacheWriter(self, key)
+
+    def update(self, key, response, expires=None):
+        self.memory.update(key, response, expires)
+        self.backing.update(key, response, expires)
+
+    def delete(self, key):
+        self.memory.delete(key)
+        self.backing.delete(key)
+
+    def keys(self):
+        return self.backing.keys()
+
+    def size(self):
+        return self.backing.size()
+
+    def __len__(self):
+        return len(self.backing)
+
+    def stats(self):
+        """Get the counts for this cache, as for :meth:`BaseCache.stats`,
+        along with those of each tier under ``memory`` and ``backing``."""
+        stats = BaseCache.stats(self)
+        stats['memory'] = self.memory.stats()
+        stats['backing'] = self.backing.stats()
+        return stats
+
+def main(argv=None):
+    """Report the size of a :class:`DiskCache` directory, and optionally trim
+    it, from the command line. Installed as ``friendly-curl-cache``."""
+    parser = optparse.OptionParser(
+        usage='%prog [options] CACHE_DIR',
+        description='Report the size of a friendly_curl cache directory, '
+        'evicting the least recently used entries beyond the given limits.')
+    parser.add_option('--max-bytes', type='int',
+                      help='evict entries until bodies total at most this')
+    parser.add_option('--max-entries', type='int',
+                      help='evict entries until at most this many remain')
+    parser.add_option('--collect-garbage', action='store_true', default=False,
+                      help='remove body files with no entry in the index')
+    options, args = parser.parse_args(argv)
+    if len(args) != 1:
+        parser.error('expected one cache directory')
+    if not os.path.isdir(args[0]):
+        parser.error('%s is not a directory' % args[0])
+    cache = DiskCache(args[0])
+    if options.max_bytes is not None or options.max_entries is not None:
+        evicted = cache.trim(options.max_bytes, options.max_entries)
+        print 'Evicted %d entries.' % evicted
+    if options.collect_garbage:
+        print 'Removed %d unused files.' % cache.collect_garbage()
+    print '%d entries, %d bytes.' % (len(cache), cache.size())
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
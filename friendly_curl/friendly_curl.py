@@ -1,15 +1,20 @@
 from __future__ import with_statement
 
-__all__ = ['FriendlyCURL', 'threadCURLSingleton', 'url_parameters',
+__all__ = ['FriendlyCURL', 'threadCURLSingleton', 'url_parameters', 'curl_share',
+           'StreamingResponse', 'RequestHook',
+           'CurlHandlePool', 'PoolTimeout', 'AsyncFriendlyCURL', 'SelectLoop',
            'CurlHTTPConnection', 'CurlHTTPSConnection', 'CurlHTTPResponse',]
 
+import collections
 import contextlib
+import heapq
 import logging
 import os
 import os.path
-import pickle
-import tempfile
+import select
+import time
 import shutil
+import zlib
 try:
     import threading as _threading
 except ImportError:
@@ -25,9 +30,11 @@ import mimetools
 import httplib
 from httplib2 import iri2uri
 
+from cache import DiskCache, revalidated_response, _DecompressingBody
+from response import HeaderParser, Response, Timings
+import metrics
+
 log = logging.getLogger(__name__)
-log.setLevel(logging.DEBUG)
-log.addHandler(logging.StreamHandler())
 
 DEFAULT_URI_ENCODING = 'utf'
 
@@ -44,6 +51,8 @@ def url_parameters(base_url, **kwargs):
     return base_url
 
 def debugfunction(curl_info, data):
+    """Log libcurl's debug output; a ``pycurl.DEBUGFUNCTION`` used for requests
+    made with ``debug=True``."""
     if curl_info == pycurl.INFOTYPE_TEXT:
         log.debug("Info: %r", data)
     elif curl_info == pycurl.INFOTYPE_HEADER_IN:
@@ -58,17 +67,334 @@ def debugfunction(curl_info, data):
         pass
     return 0
 
+_share = None
+_share_lock = _threading.Lock()
+
+def curl_share(connections=False):
+    """Creates or returns the process-wide ``pycurl.CurlShare`` used when
+    ``share=True`` is passed to :class:`FriendlyCURL`, or
+    :attr:`CurlHTTPConnection.share` is set to ``True``.
+    
+    The share holds the DNS cache and SSL session IDs. pycurl installs its
+    own lock callbacks, so the share can be used by handles in any thread.
+    
+    :param connections: Instead, create a new share that also holds the\
+    connection cache, so that handles reuse each other's connections.\
+    libcurl doesn't support sharing connections between handles used at the\
+    same time in different threads, so only use it from a single thread.\
+    Raises ``ValueError`` if pycurl or libcurl can't share connections.
+    :type connections: bool"""
+    global _share
+    if connections:
+        if not hasattr(pycurl, 'LOCK_DATA_CONNECT'):
+            raise ValueError("This pycurl can't share connections.")
+        share = _new_share()
+        share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_CONNECT)
+        return share
+    with _share_lock:
+        if _share is None:
+            _share = _new_share()
+    return _share
+
+def _new_share():
+    """Create a ``pycurl.CurlShare`` holding DNS and SSL session caches."""
+    share = pycurl.CurlShare()
+    share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_DNS)
+    share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_SSL_SESSION)
+    return share
+
+def _resolve_share(share):
+    """Turns the value of a ``share`` option into a ``pycurl.CurlShare`` or
+    ``None``."""
+    if share is True:
+        return curl_share()
+    return share or None
+
+# Timings attributes and the getinfo options they come from.
+_TIMING_INFO = [('namelookup', 'NAMELOOKUP_TIME'),
+                ('connect', 'CONNECT_TIME'),
+                ('appconnect', 'APPCONNECT_TIME'),
+                ('pretransfer', 'PRETRANSFER_TIME'),
+                ('starttransfer', 'STARTTRANSFER_TIME'),
+                ('total', 'TOTAL_TIME'),
+                ('redirect', 'REDIRECT_TIME'),
+                ('num_connects', 'NUM_CONNECTS'),
+                ('size_download', 'SIZE_DOWNLOAD'),
+                ('size_upload', 'SIZE_UPLOAD'),
+                ('speed_download', 'SPEED_DOWNLOAD'),
+                ('effective_url', 'EFFECTIVE_URL')]
+
+def _timings(handle):
+    """Get the :class:`~friendly_curl.response.Timings` of the transfer
+    ``handle`` last made."""
+    return Timings(**dict((name, handle.getinfo(getattr(pycurl, info)))
+                          for name, info in _TIMING_INFO
+                          if hasattr(pycurl, info)))
+
+class RequestHook(object):
+    """Base class for hooks run around each request a :class:`FriendlyCURL`
+    makes, given in its ``hooks``. Override either method. Responses served
+    from a cache without a request don't run hooks.
+    
+    Exceptions raised by :meth:`after_request` are logged rather than
+    passed on, so that a broken hook can't lose a response."""
+    
+    def before_request(self, fcurl, url, headers):
+        """Called before a request is made. Headers may be added to\
+        ``headers`` to send them with it.
+        
+        :param fcurl: The :class:`FriendlyCURL` making the request.
+        :param url: The URL requested.
+        :type url: str
+        :param headers: The request headers.
+        :type headers: dict"""
+    
+    def after_request(self, fcurl, url, result):
+        """Called when a request finishes.
+        
+        :param url: The last URL requested, after any redirects.
+        :type url: str
+        :param result: The :class:`~friendly_curl.response.Response`, the\
+        :class:`StreamingResponse` for :meth:`FriendlyCURL.stream_url` and\
+        :class:`CurlHTTPConnection`, or the ``pycurl.error`` the request\
+        failed with. Either kind of response has ``timings``."""
+
+def _resolve_metrics(registry):
+    """Turns the value of a ``metrics`` option into a
+    :class:`~friendly_curl.metrics.MetricsRegistry` or ``None``."""
+    if registry is True:
+        return metrics.registry
+    return registry or None
+
+def _forbids_cached(headers):
+    """Whether request ``headers`` ask for a response from the server rather
+    than a fresh cached one."""
+    for name, value in headers.iteritems():
+        if name.lower() in ('cache-control', 'pragma') and \
+           'no-cache' in value.lower():
+            return True
+    return False
+
+def _open_cached_body(entry, mapped):
+    """Open the body of cache ``entry``, memory-mapped if ``mapped`` is true.
+    Returns ``None`` if it has been evicted since the entry was looked up."""
+    try:
+        if mapped:
+            return entry.open_mapped()
+        return entry.open()
+    except (IOError, OSError):
+        return None
+
+def _cached_body(cached_body, body_buffer, mapped):
+    """Get the body to return from :meth:`FriendlyCURL.get_url` given the
+    opened ``cached_body``, which is returned as it is if ``mapped`` is true
+    and otherwise copied into ``body_buffer``."""
+    if mapped:
+        return cached_body
+    if body_buffer is None:
+        body_buffer = StringIO()
+    with contextlib.closing(cached_body):
+        shutil.copyfileobj(cached_body, body_buffer)
+    body_buffer.seek(0)
+    return body_buffer
+
+# Server errors for which stale-if-error allows a stale response to be used.
+STALE_IF_ERROR_STATUSES = frozenset([500, 502, 503, 504])
+
+class _Flight(object):
+    """A fetch by :meth:`FriendlyCURL.get_url` that other requests for the
+    same cache entry wait on."""
+    
+    def __init__(self):
+        self.done = _threading.Event()
+        self.stored = False
+        self.error = None
+
+# In-flight fetches, by BaseCache.entry_id.
+_flights = {}
+_flights_lock = _threading.Lock()
+
+class _Tee(object):
+    """Writes to a cache writer and a body buffer at once. Seeking only moves
+    the body buffer."""
+    
+    def __init__(self, writer, body_buffer):
+        self.writer = writer
+        self.body_buffer = body_buffer
+    
+    def write(self, data):
+        self.writer.write(data)
+        self.body_buffer.write(data)
+    
+    def seek(self, offset, whence=0):
+        self.body_buffer.seek(offset, whence)
+
+def _has_header(headers, name):
+    """Whether request ``headers`` include ``name``, in any case."""
+    name = name.lower()
+    for header in headers:
+        if header.lower() == name:
+            return True
+    return False
+
+def _mark_decoded(headers):
+    """Update response ``headers`` for a body that has been decoded: the
+    Content-Encoding is moved to '-content-encoding', as httplib2 does, and
+    the Content-Length, which was that of the encoded body, dropped. Returns
+    ``headers``."""
+    if 'content-encoding' in headers:
+        headers['-content-encoding'] = headers.pop('content-encoding')
+        headers.pop('content-length', None)
+    return headers
+
+class _DeflateDecompressor(object):
+    """Decodes Content-Encoding: deflate, which some servers send without the
+    zlib header it should have."""
+    
+    def __init__(self):
+        self._decompressor = zlib.decompressobj()
+        self._first = True
+    
+    def decompress(self, data):
+        if self._first:
+            self._first = False
+            try:
+                return self._decompressor.decompress(data)
+            except zlib.error:
+                self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        return self._decompressor.decompress(data)
+    
+    def flush(self):
+        return self._decompressor.flush()
+
+def _decompressor(encoding):
+    """Get an object like a ``zlib.decompressobj()`` to decode bodies sent
+    with Content-Encoding ``encoding``, or ``None`` if it isn't gzip or
+    deflate."""
+    encoding = (encoding or '').strip().lower()
+    if encoding in ('gzip', 'x-gzip'):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if encoding == 'deflate':
+        return _DeflateDecompressor()
+    return None
+
+class _DecodingBuffer(object):
+    """Decodes a gzip or deflate body into ``body_buffer`` as it arrives,
+    for :meth:`FriendlyCURL.get_url` with ``cache_encoded``. The encoding is
+    looked up in the headers of the response being received when the first
+    of the body is written. Seeking finishes decoding."""
+    
+    def __init__(self, fcurl, body_buffer):
+        self.fcurl = fcurl
+        self.body_buffer = body_buffer
+        self._decompressor = None
+        self._started = False
+    
+    def write(self, data):
+        if not self._started:
+            self._started = True
+            self._decompressor = _decompressor(
+                self.fcurl._header.headers().get('content-encoding'))
+        if self._decompressor is not None:
+            data = self._decompressor.decompress(data)
+        self.body_buffer.write(data)
+    
+    def seek(self, offset, whence=0):
+        if self._decompressor is not None:
+            self.body_buffer.write(self._decompressor.flush())
+            self._decompressor = None
+        self.body_buffer.seek(offset, whence)
+
 class FriendlyCURL(object):
     """Friendly wrapper for a PyCURL Handle object. You probably don't want to
-    instantiate this yourself. Instead, use :func:`threadCURLSingleton`."""
+    instantiate this yourself. Instead, use :func:`threadCURLSingleton`.
     
-    def __init__(self):
+    By default every request is made on a fresh connection. Pass
+    ``keep_alive=True`` to keep connections open and reuse them for later
+    requests to the same host; the connection cache survives :meth:`reset`.
+    
+    :param keep_alive: Reuse connections between requests.
+    :type keep_alive: bool
+    :param max_idle_time: With ``keep_alive``, don't reuse a connection that\
+    has been idle for longer than this many seconds.
+    :type max_idle_time: int or float
+    :param max_connections: With ``keep_alive``, the maximum number of idle\
+    connections to keep open.
+    :type max_connections: int
+    :param max_host_connections: With ``keep_alive``, the maximum number of\
+    simultaneous connections to a single host made by :meth:`iter_fetch`.
+    :type max_host_connections: int
+    :param share: A ``pycurl.CurlShare`` to attach requests to, or ``True`` to\
+    use the process-wide one from :func:`curl_share`.
+    :type share: bool or ``pycurl.CurlShare``
+    :param cache: The cache used by :meth:`get_url`. The same cache may be\
+    given to objects in different threads.
+    :type cache: :class:`~friendly_curl.cache.BaseCache`
+    :param hooks: :class:`RequestHook` objects to run around every request.
+    :type hooks: list
+    :param metrics: A :class:`~friendly_curl.metrics.MetricsRegistry` to\
+    record requests and cache lookups in, or ``True`` to use the\
+    process-wide one.
+    :type metrics: bool or :class:`~friendly_curl.metrics.MetricsRegistry`
+    :param tracer: A :class:`~friendly_curl.tracing.Tracer` to record a sample\
+    of requests' wire events in.
+    :type tracer: :class:`~friendly_curl.tracing.Tracer`
+    :param compressed: Ask for compressed responses with every encoding\
+    libcurl supports (gzip and deflate, and brotli and zstd if it was built\
+    with them), which libcurl decodes as they arrive. Decoded responses have\
+    their Content-Encoding moved to '-content-encoding', as httplib2 does,\
+    and no Content-Length. Requests whose headers include Accept-Encoding\
+    are left alone, and their responses returned as they were sent.
+    :type compressed: bool
+    :param cache_encoded: With ``compressed``, have :meth:`get_url` store\
+    bodies in :attr:`cache` as they were sent, compressed, and decode them\
+    as they are fetched and as they are read back, rather than storing them\
+    decoded. Only gzip and deflate are asked for then.
+    :type cache_encoded: bool"""
+    
+    def __init__(self, keep_alive=False, max_idle_time=None,
+                 max_connections=None, max_host_connections=None,
+                 share=None, cache=None, hooks=None, metrics=None,
+                 tracer=None, compressed=False, cache_encoded=False):
         self.curl_handle = pycurl.Curl()
+        #: The :class:`RequestHook` objects run around every request.
+        self.hooks = list(hooks or ())
+        #: The :class:`~friendly_curl.metrics.MetricsRegistry` requests are
+        #: recorded in, or ``None``.
+        self.metrics = _resolve_metrics(metrics)
+        # The method of the current request, for metrics.
+        self._method = 'GET'
+        #: The :class:`~friendly_curl.tracing.Tracer` requests are sampled by,
+        #: or ``None``.
+        self.tracer = tracer
+        # The Trace of the current request, if it is being traced.
+        self._trace = None
+        self.compressed = compressed
+        self.cache_encoded = cache_encoded
+        # Whether libcurl is decoding the current response, and its
+        # HeaderParser.
+        self._decoding = False
+        self._header = None
+        self.share = _resolve_share(share)
+        #: The :class:`~friendly_curl.cache.BaseCache` used by :meth:`get_url`,
+        #: or ``None`` not to cache.
+        self.cache = cache
+        self.keep_alive = keep_alive
+        self.max_idle_time = max_idle_time
+        self.max_connections = max_connections
+        self.max_host_connections = max_host_connections
+        self._last_used = None
+        # Idle easy handles and multi handle used by iter_fetch.
+        self._fetch_pool = []
+        self._fetch_multi = None
+        # The StreamingResponse currently using the handle, if any.
+        self._stream = None
     
     def _common_perform(self, url, headers,
                         accept_self_signed_SSL=False,
                         follow_location=True,
-                        body_buffer=None, debug=False):
+                        body_buffer=None, debug=False, keep_history=False,
+                        trace=None):
         """Perform activities common to all FriendlyCURL operations. Several
         parameters are passed through and processed identically for all of the
         \*_url functions, and all produce the same return type.
@@ -85,105 +411,466 @@ class FriendlyCURL(object):
         :type follow_location: bool
         :param body_buffer: A buffer to write body content into.
         :type body_buffer: ``.write(str)``-able file-like object
-        :param debug: Turn on debug logging for this request.
+        :param debug: Log libcurl's debug output for this request, at DEBUG\
+        level. This is slow; see ``trace`` for a lighter alternative.
         :type debug: bool
-        :returns: A tuple containing a dictionary of response headers, including\
-        the HTTP status as an int in 'status' and a buffer containing the body\
-        of the response."""
+        :param keep_history: Whether to keep the headers of redirects that\
+        were followed, in the result's ``history``. Otherwise only those of\
+        the last response are returned.
+        :type keep_history: bool
+        :param trace: Whether to trace this request with :attr:`tracer`:\
+        ``True`` or ``False``, or the chance of doing so. Defaults to the\
+        tracer's sample rate.
+        :type trace: bool or float
+        :returns: A :class:`~friendly_curl.response.Response`, which unpacks\
+        like a tuple containing a case-insensitive\
+        :class:`~friendly_curl.response.Headers` dictionary of response\
+        headers, including the HTTP status as an int in 'status', and a\
+        buffer containing the body of the response."""
+        body, header = self._prepare_perform(url, headers,
+                                             accept_self_signed_SSL,
+                                             follow_location, body_buffer,
+                                             debug, keep_history, trace)
+        try:
+            self.curl_handle.perform()
+        except pycurl.error as e:
+            raise self._failed_perform(e)
+        return self._finish_perform(body, header)
+    
+    def _prepare_perform(self, url, headers,
+                         accept_self_signed_SSL=False,
+                         follow_location=True,
+                         body_buffer=None, debug=False, keep_history=False,
+                         trace=None):
+        """Set up the CURL handle for a request without performing it. Takes
+        the same parameters as :meth:`_common_perform`.
+        
+        :returns: A tuple of the body buffer and the\
+        :class:`~friendly_curl.response.HeaderParser`, to be passed to\
+        :meth:`_finish_perform` once the transfer is complete."""
+        if isinstance(url, unicode):
+            url = str(iri2uri(url))
+        self._before_request(url, headers, trace)
         self.curl_handle.setopt(
             pycurl.HTTPHEADER,
             ['%s: %s' % (header, str(value)) for header, value in headers.iteritems()])
-        if isinstance(url, unicode):
-            url = str(iri2uri(url))
         self.curl_handle.setopt(pycurl.URL, url)
         if body_buffer:
             body = body_buffer
         else:
             body = StringIO()
-        self.curl_handle.setopt(pycurl.FORBID_REUSE, 1)
+        if self.keep_alive:
+            self._setup_keep_alive()
+        else:
+            self.curl_handle.setopt(pycurl.FORBID_REUSE, 1)
+        if self.share is not None:
+            self.curl_handle.setopt(pycurl.SHARE, self.share)
         self.curl_handle.setopt(pycurl.WRITEFUNCTION, body.write)
-        header = StringIO()
-        self.curl_handle.setopt(pycurl.HEADERFUNCTION, header.write)
+        header = self._header = HeaderParser(keep_history)
+        self.curl_handle.setopt(pycurl.HEADERFUNCTION, header)
+        self._decoding = self.compressed and \
+                         not _has_header(headers, 'Accept-Encoding')
+        if self._decoding:
+            # libcurl asks for every encoding it can decode.
+            self.curl_handle.setopt(pycurl.ENCODING, '')
         if accept_self_signed_SSL == True:
             self.curl_handle.setopt(pycurl.SSL_VERIFYPEER, 0)
         if follow_location == True:
             self.curl_handle.setopt(pycurl.FOLLOWLOCATION, 1)
         if debug:
             self.curl_handle.setopt(pycurl.VERBOSE, 1)
-            self.curl_handle.setopt(pycurl.DEBUGFUNCTION, debugfunction)
-        self.curl_handle.perform()
+            trace = self._trace
+            if trace is None:
+                self.curl_handle.setopt(pycurl.DEBUGFUNCTION, debugfunction)
+            else:
+                def debug_and_trace(curl_info, data):
+                    trace(curl_info, data)
+                    return debugfunction(curl_info, data)
+                self.curl_handle.setopt(pycurl.DEBUGFUNCTION, debug_and_trace)
+        return body, header
+    
+    def _setup_keep_alive(self):
+        """Set the options for a request that may reuse, and leave open, a
+        connection. These are applied per request since :meth:`reset` clears
+        them."""
+        self.curl_handle.setopt(pycurl.TCP_KEEPALIVE, 1)
+        if self.max_connections:
+            self.curl_handle.setopt(pycurl.MAXCONNECTS, self.max_connections)
+        if self.max_idle_time is not None:
+            if hasattr(pycurl, 'MAXAGE_CONN'):
+                self.curl_handle.setopt(pycurl.MAXAGE_CONN,
+                                        int(self.max_idle_time))
+            elif self._last_used is not None and \
+                 time.time() - self._last_used > self.max_idle_time:
+                # Older libcurl can't expire idle connections itself.
+                self.curl_handle.setopt(pycurl.FRESH_CONNECT, 1)
+    
+    def _finish_perform(self, body, header):
+        """Build the :class:`~friendly_curl.response.Response` for a completed
+        transfer set up by :meth:`_prepare_perform`."""
+        self._last_used = time.time()
         body.seek(0)
-        headers = [hdr.split(': ') for hdr in header.getvalue().strip().split('\r\n') if
-                   hdr and not hdr.startswith('HTTP/')]
-        response = dict((header[0].lower(), header[1]) for header in headers)
-        response['status'] = self.curl_handle.getinfo(pycurl.HTTP_CODE)
-        return (response, body)
+        result = Response(self._parse_response(header), body, header.history,
+                          _timings(self.curl_handle))
+        self._after_request(result, result.headers['status'], result.timings)
+        return result
+    
+    def _failed_perform(self, error):
+        """Run the hooks for a transfer that failed with ``error``, which is
+        returned."""
+        self._last_used = time.time()
+        self._after_request(error, None, _timings(self.curl_handle))
+        return error
     
-    def get_url(self, url, headers = None, use_cache = True, **kwargs):
+    def _before_request(self, url, headers, trace=None):
+        """Run the hooks for a request about to be made, and start tracing it
+        if it is sampled."""
+        for hook in self.hooks:
+            hook.before_request(self, url, headers)
+        if self.tracer is not None:
+            self._trace = self.tracer.start(url, self._method, trace)
+            if self._trace is None:
+                self.curl_handle.setopt(pycurl.VERBOSE, 0)
+            else:
+                self.curl_handle.setopt(pycurl.VERBOSE, 1)
+                self.curl_handle.setopt(pycurl.DEBUGFUNCTION, self._trace)
+    
+    def _after_request(self, result, status, timings):
+        """Record a finished request in :attr:`metrics` and :attr:`tracer`,
+        and run the hooks. ``status`` is ``None`` if it failed."""
+        if self.metrics is not None:
+            self.metrics.record_request(self._method, status, timings)
+        if self._trace is not None:
+            self.tracer.finish(self._trace, status, timings,
+                               None if status else result)
+            self._trace = None
+        if not self.hooks:
+            return
+        url = timings.effective_url
+        for hook in self.hooks:
+            try:
+                hook.after_request(self, url, result)
+            except Exception:
+                log.exception('Request hook %r failed.', hook)
+    
+    def _parse_response(self, header):
+        """Get the :class:`~friendly_curl.response.Headers` from the header
+        parser of a transfer whose headers have all been received."""
+        headers = header.headers(self.curl_handle.getinfo(pycurl.HTTP_CODE))
+        if self._decoding:
+            _mark_decoded(headers)
+        return headers
+    
+    def get_url(self, url, headers = None, use_cache = True, mmap_cached = False,
+                **kwargs):
         """Perform a regular HTTP GET using pycurl. See :meth:`_common_perform`
         for details.
         
-        :param use_cache: Defaults to true, will use the cache if cache_dir is\
-        set. Pass false or unset cache_dir to ignore cache and not cache the\
-        result of the request."""
-        headers = headers or {}
+        :param use_cache: Defaults to true, will use the cache if :attr:`cache`\
+        (or cache_dir) is set. Pass false or unset it to ignore cache and not\
+        cache the result of the request. Cached responses that are still\
+        fresh according to their Cache-Control or Expires headers are returned\
+        without contacting the server, unless ``headers`` contain\
+        ``Cache-Control: no-cache``. Others are revalidated with\
+        If-None-Match and If-Modified-Since, and their stored headers updated\
+        from any 304 response.
+        
+        Concurrent calls from any thread for the same cache entry are\
+        coalesced: one fetches it while the rest wait and are served from the\
+        cache once it is stored, each with its own body. See\
+        :meth:`~friendly_curl.cache.BaseCache.lock` to do the same across\
+        processes.
+        
+        Stale responses are returned straight away while they are refreshed\
+        in the background if stale-while-revalidate allows, and instead of a\
+        failed request or server error if stale-if-error does. See\
+        :meth:`~friendly_curl.cache.BaseCache.serves_stale`.
+        
+        URLs are normalized before they are looked up, and responses with a\
+        Vary header are cached separately for each value of the request\
+        headers named in it. See\
+        :meth:`~friendly_curl.cache.BaseCache.lookup`.
+        :param mmap_cached: If true, bodies served from a cache on disk are\
+        returned as a read-only, memory-mapped :class:`MappedBody` rather than\
+        copied into a ``StringIO``. Ignored if ``body_buffer`` is given."""
+        # Validators and Accept-Encoding are added to a copy, so that they
+        # don't end up in later requests made with the caller's headers.
+        headers = dict(headers or {})
         self.curl_handle.setopt(pycurl.HTTPGET, 1)
-        cache_base_name = hash(url)
-        if not (use_cache and hasattr(self, '_cache_dir')):
+        self._method = 'GET'
+        if not (use_cache and self.cache is not None):
             try:
                 result = self._common_perform(url, headers, **kwargs)
             finally:
                 self.reset()
             return result
         
-        response_cache_filename = os.path.join(self.cache_dir,
-                                               '%s.response' % cache_base_name)
-        body_cache_filename = os.path.join(self.cache_dir,
-                                           '%s.body' % cache_base_name)
-        temp_buffer_fd, temp_buffer_path = tempfile.mkstemp()
+        cache_key, entry = self.cache.lookup(self.cache.key_for(url), headers)
+        body_buffer = kwargs.pop('body_buffer', None)
+        mapped = mmap_cached and body_buffer is None
+        entry, cached_body = self._open_entry(entry, mapped)
+        if entry is not None and not _forbids_cached(headers):
+            if entry.is_fresh():
+                # Still fresh, no need to ask the server.
+                self._count_cache('hit')
+                return self._cached_response(entry.response, cached_body,
+                                             body_buffer, mapped)
+            if self.cache.serves_stale(entry, 'stale-while-revalidate'):
+                # Serve it now, and refresh it for next time.
+                self._count_cache('stale')
+                self._refresh(url, headers, cache_key, kwargs)
+                return self._cached_response(entry.response, cached_body,
+                                             body_buffer, mapped)
+        return self._coalesced_fetch(url, headers, cache_key, entry,
+                                     cached_body, body_buffer, mapped, kwargs)
+    
+    def _coalesced_fetch(self, url, headers, cache_key, entry, cached_body,
+                         body_buffer, mapped, kwargs):
+        """Fetch ``url`` for :meth:`get_url` with :meth:`_fetch_cached`,
+        unless another request is already fetching it, in which case wait
+        and use its result."""
+        flight_key = self.cache.entry_id(cache_key)
+        with _flights_lock:
+            flight = _flights.get(flight_key)
+            leading = flight is None
+            if leading:
+                flight = _flights[flight_key] = _Flight()
+        if not leading:
+            if cached_body is not None:
+                cached_body.close()
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            if flight.stored:
+                entry, cached_body = self._cache_lookup(cache_key, mapped)
+                if entry is not None:
+                    self._count_cache('coalesced')
+                    return self._cached_response(entry.response, cached_body,
+                                                 body_buffer, mapped)
+            # Not cached after all, so fetch it separately.
+            return self._fetch_cached(url, headers, cache_key, None, None,
+                                      body_buffer, mapped, kwargs)[0]
         try:
-            if 'body_buffer' in kwargs:
-                body_buffer = kwargs['body_buffer']
-                del kwargs['body_buffer']
-            else:
-                body_buffer = StringIO()
-            with os.fdopen(temp_buffer_fd, 'w') as temp_buffer:
-                cached_response = {}
-                if os.path.exists(response_cache_filename):
-                    with open(response_cache_filename, 'r') as response_cache:
-                        cached_response = pickle.load(response_cache)
-                if 'etag' in cached_response:
-                    # Retrieved before, do a conditional get.
-                    headers['If-None-Match'] = cached_response['etag']
-                    response, body = self._common_perform(
-                        url, headers, body_buffer=temp_buffer, **kwargs)
-                    if response['status'] == 304:
-                        with open(body_cache_filename, 'r') as cached_body:
-                            shutil.copyfileobj(cached_body, body_buffer)
-                        body_buffer.seek(0)
-                        return cached_response, body_buffer
-                else:
-                    # Retrieve the resource for the first time.
-                    response, body = self._common_perform(
-                        url, headers, body_buffer=temp_buffer, **kwargs)
-            with contextlib.nested(open(temp_buffer_path, 'r'),
-                                   open(body_cache_filename, 'w'),
-                                   open(response_cache_filename, 'w')) as\
-                 (temp_buffer, body_cache, response_cache):
-                pickle.dump(response, response_cache)
-                shutil.copyfileobj(temp_buffer, body_cache)
-                temp_buffer.seek(0)
-                shutil.copyfileobj(temp_buffer, body_buffer)
-                body_buffer.seek(0)
-            return response, body_buffer
+            with self.cache.lock(cache_key) as waited:
+                if waited:
+                    # Another process may have fetched it in the meantime.
+                    current, current_body = self._cache_lookup(cache_key,
+                                                               mapped)
+                    if current is not None and \
+                       (entry is None or current.stored > entry.stored):
+                        if cached_body is not None:
+                            cached_body.close()
+                        flight.stored = True
+                        self._count_cache('coalesced')
+                        return self._cached_response(
+                            current.response, current_body, body_buffer,
+                            mapped)
+                    if current_body is not None:
+                        current_body.close()
+                result, flight.stored = self._fetch_cached(
+                    url, headers, cache_key, entry, cached_body, body_buffer,
+                    mapped, kwargs)
+                return result
+        except Exception as e:
+            flight.error = e
+            raise
         finally:
-            os.unlink(temp_buffer_path)
+            with _flights_lock:
+                del _flights[flight_key]
+            flight.done.set()
+    
+    def _cached_response(self, response, cached_body, body_buffer, mapped):
+        """Get the :class:`~friendly_curl.response.Response` to return for a
+        cached ``response`` whose body has been opened as ``cached_body``,
+        which is handled as by :func:`_cached_body`. Bodies stored compressed
+        because of ``cache_encoded`` are decoded as they are copied."""
+        if self.compressed and 'content-encoding' in response:
+            decompressor = _decompressor(response['content-encoding'])
+            if decompressor is not None:
+                cached_body = _DecompressingBody(cached_body, decompressor)
+                mapped = False
+                response = _mark_decoded(response.copy())
+        return Response(response,
+                        _cached_body(cached_body, body_buffer, mapped))
+    
+    def _count_cache(self, result):
+        """Record the outcome of a :meth:`get_url` cache lookup."""
+        if self.metrics is not None:
+            self.metrics.record_cache(result)
+    
+    def _refresh(self, url, headers, cache_key, kwargs):
+        """Fetch ``url`` into the cache in a background thread, unless it is
+        already being fetched."""
+        with _flights_lock:
+            if self.cache.entry_id(cache_key) in _flights:
+                return
+        worker = FriendlyCURL(self.keep_alive, self.max_idle_time,
+                              self.max_connections, share=self.share,
+                              cache=self.cache, hooks=self.hooks,
+                              metrics=self.metrics, tracer=self.tracer,
+                              compressed=self.compressed,
+                              cache_encoded=self.cache_encoded)
+        thread = _threading.Thread(target=worker._background_fetch,
+                                   args=(url, dict(headers), cache_key,
+                                         dict(kwargs)))
+        thread.daemon = True
+        thread.start()
+    
+    def _background_fetch(self, url, headers, cache_key, kwargs):
+        """Run by :meth:`_refresh` with a new object, which is closed
+        afterwards."""
+        try:
+            entry, cached_body = self._cache_lookup(cache_key, False)
+            self._coalesced_fetch(url, headers, cache_key, entry, cached_body,
+                                  None, False, kwargs)
+        except Exception:
+            log.exception('Refreshing %s in the background failed.', url)
+        finally:
+            self.close()
+    
+    def _cache_lookup(self, cache_key, mapped):
+        """Get the :class:`~friendly_curl.cache.CacheEntry` stored under
+        ``cache_key`` along with its opened body, or ``(None, None)``. The
+        body is opened straight away so that it can't be evicted from under
+        us."""
+        return self._open_entry(self.cache.get(cache_key), mapped)
+    
+    def _open_entry(self, entry, mapped):
+        """Open the body of ``entry`` for :meth:`_cache_lookup`."""
+        if entry is None:
+            return None, None
+        cached_body = _open_cached_body(entry, mapped)
+        if cached_body is None:
+            return None, None
+        return entry, cached_body
+    
+    def _fetch_cached(self, url, headers, cache_key, entry, cached_body,
+                      body_buffer, mapped, kwargs):
+        """Fetch ``url`` for :meth:`get_url`, revalidating ``entry`` if it is
+        given, and store the response in the cache.
+        
+        :returns: A tuple of the :class:`~friendly_curl.response.Response`\
+        and whether it is now in the cache."""
+        request_headers = dict(headers)
+        if entry is not None:
+            # Retrieved before, do a conditional get.
+            if 'etag' in entry.response:
+                headers['If-None-Match'] = entry.response['etag']
+            if 'last-modified' in entry.response:
+                headers['If-Modified-Since'] = entry.response['last-modified']
+        body = StringIO() if body_buffer is None else body_buffer
+        sink = body
+        if self.compressed and self.cache_encoded and \
+           not _has_header(headers, 'Accept-Encoding'):
+            # Cache the body as it is sent, and decode it for the caller.
+            headers['Accept-Encoding'] = 'gzip, deflate'
+            sink = _DecodingBuffer(self, body)
+        # The body goes straight into the cache as it arrives, as well as
+        # into the buffer returned.
+        writer = self.cache.writer(cache_key)
+        tee = _Tee(writer, sink)
+        # Decide once, so an error is never left without a stale response
+        # to serve if the window closes during the request.
+        stale_if_error = entry is not None and \
+                         self.cache.serves_stale(entry, 'stale-if-error')
+        try:
+            try:
+                result = self._common_perform(url, headers, body_buffer=tee,
+                                              **kwargs)
+                response = result.headers
+            except pycurl.error:
+                if not stale_if_error:
+                    raise
+                response = {'status': None}
+            finally:
+                self.reset()
+            response_time = time.time()
+            if stale_if_error and \
+               (response['status'] is None or
+                response['status'] in STALE_IF_ERROR_STATUSES):
+                # The server is having trouble; fall back on what we have.
+                self._count_cache('stale')
+                writer.abort()
+                if body_buffer is not None:
+                    body_buffer.seek(0)
+                    body_buffer.truncate()
+                body, cached_body = cached_body, None
+                return (self._cached_response(entry.response, body,
+                                              body_buffer, mapped),
+                        True)
+            if entry is not None and response['status'] == 304:
+                self._count_cache('revalidated')
+                writer.abort()
+                response = revalidated_response(entry.response, response)
+                self.cache.update(cache_key, response,
+                                  self.cache.expires_for(response,
+                                                         response_time))
+                body, cached_body = cached_body, None
+                cached = self._cached_response(response, body, body_buffer,
+                                               mapped)
+                result.headers, result.body = cached.headers, cached.body
+                return result, True
+            self._count_cache('miss')
+            if self.cache.storable(response):
+                store_key = self.cache.response_key(self.cache.key_for(url),
+                                                    request_headers, response)
+                writer.commit(url, response,
+                              self.cache.expires_for(response, response_time),
+                              store_key)
+                if entry is not None and store_key != cache_key:
+                    # Its Vary header changed, so it is stored elsewhere now.
+                    self.cache.delete(cache_key)
+                result.body = body
+                if sink is not body:
+                    result.headers = _mark_decoded(response.copy())
+                return result, store_key == cache_key
+            writer.abort()
+            if entry is not None:
+                self.cache.delete(cache_key)
+            result.body = body
+            if sink is not body:
+                result.headers = _mark_decoded(response.copy())
+            return result, False
+        except:
+            writer.abort()
+            raise
+        finally:
+            if cached_body is not None:
+                cached_body.close()
+    
+    def stream_url(self, url, headers = None, max_buffer = 1048576, **kwargs):
+        """Perform an HTTP GET using pycurl, returning as soon as the response
+        headers have arrived. The body is then read from the returned
+        :class:`StreamingResponse` as it is received, so it never has to be
+        held in memory all at once. The cache is not used. See
+        :meth:`_common_perform` for other parameters.
+        
+        This object can't be used for other requests until the stream has been
+        read to the end or closed.
+        
+        :param max_buffer: How many bytes of body to buffer before pausing the\
+        transfer until some have been read.
+        :type max_buffer: int
+        :returns: A :class:`StreamingResponse`."""
+        headers = headers or {}
+        self.curl_handle.setopt(pycurl.HTTPGET, 1)
+        self._method = 'GET'
+        stream = StreamingResponse(self, max_buffer)
+        try:
+            body, header = self._prepare_perform(url, headers,
+                                                 body_buffer=stream, **kwargs)
+            stream._start(header, kwargs.get('follow_location', True))
+        except:
+            stream.close()
+            raise
+        return stream
     
     def head_url(self, url, headers = None, **kwargs):
         """Performs an HTTP HEAD using pycurl. See :meth:_common_perform`
         for details."""
         headers = headers or {}
         self.curl_handle.setopt(pycurl.NOBODY, 1)
+        self._method = 'HEAD'
         try:
             result = self._common_perform(url, headers, **kwargs)
         finally:
@@ -208,6 +895,7 @@ class FriendlyCURL(object):
         :param content_type: The type of the data being POSTed."""
         headers = headers or {}
         self.curl_handle.setopt(pycurl.POST, 1)
+        self._method = 'POST'
         if data:
             upload_file = StringIO(data)
             upload_file_length = len(data)
@@ -229,6 +917,7 @@ class FriendlyCURL(object):
         :meth:`_common_perform` for further details."""
         headers = headers or {}
         self.curl_handle.setopt(pycurl.UPLOAD, 1)
+        self._method = 'PUT'
         if data:
             upload_file = StringIO(data)
             upload_file_length = len(data)
@@ -249,44 +938,927 @@ class FriendlyCURL(object):
         further details."""
         headers = headers or {}
         self.curl_handle.setopt(pycurl.CUSTOMREQUEST, 'DELETE')
+        self._method = 'DELETE'
         try:
             result = self._common_perform(url, headers, **kwargs)
         finally:
             self.reset()
         return result
-    
+
+    def fetch_many(self, requests, max_concurrency=10, **kwargs):
+        """Perform many requests concurrently using a ``pycurl.CurlMulti``.
+        See :meth:`iter_fetch` for the format of ``requests``.
+
+        :returns: A list containing a ``(response, body)``\
+        :class:`~friendly_curl.response.Response` for each request, in the\
+        same order as ``requests``. If a request failed, its place holds the\
+        ``pycurl.error`` raised for it instead."""
+        requests = list(requests)
+        results = [None] * len(requests)
+        for index, result in self.iter_fetch(requests, max_concurrency,
+                                             **kwargs):
+            results[index] = result
+        return results
+
+    def iter_fetch(self, requests, max_concurrency=10, **kwargs):
+        """Perform many requests concurrently using a ``pycurl.CurlMulti``,
+        yielding results as they complete. Up to ``max_concurrency`` transfers
+        run at once; the easy handles used for them are kept between calls.
+
+        :param requests: The requests to perform. Each is either a URL or a\
+        dictionary with a ``url`` and optionally ``method`` (defaults to\
+        ``GET``), ``headers``, ``data``, ``content_type`` and any keyword\
+        argument accepted by :meth:`_common_perform`.
+        :type requests: iterable of str, unicode or dict
+        :param max_concurrency: The maximum number of simultaneous transfers.
+        :type max_concurrency: int
+        :param kwargs: Default keyword arguments for :meth:`_common_perform`,\
+        overridden by those given in an individual request.
+        :returns: A generator of ``(index, result)`` tuples, where ``index``\
+        is the position of the request in ``requests`` and ``result`` is\
+        either a ``(response, body)`` tuple or the ``pycurl.error`` raised\
+        for that request.
+        :raises ValueError: If ``max_concurrency`` is less than 1."""
+        if max_concurrency < 1:
+            raise ValueError('max_concurrency must be at least 1, not %r.' %
+                             (max_concurrency,))
+        # Checked here rather than in the generator, so that it is raised
+        # straight away.
+        return self._iter_fetch(requests, max_concurrency, kwargs)
+
+    def _iter_fetch(self, requests, max_concurrency, kwargs):
+        """The generator returned by :meth:`iter_fetch`."""
+        pending = enumerate(requests)
+        multi = self._fetch_multi or self._new_multi()
+        self._fetch_multi = None
+        # Maps pycurl handles to (index, worker, body, header).
+        active = {}
+        free = []
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(active) < max_concurrency:
+                    try:
+                        index, request = pending.next()
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    if free:
+                        worker = free.pop()
+                    elif self._fetch_pool:
+                        worker = self._fetch_pool.pop()
+                    else:
+                        worker = FriendlyCURL(self.keep_alive,
+                                              self.max_idle_time,
+                                              self.max_connections,
+                                              share=self.share,
+                                              hooks=self.hooks,
+                                              metrics=self.metrics,
+                                              tracer=self.tracer,
+                                              compressed=self.compressed)
+                    try:
+                        body, header = worker._prepare_request(request, kwargs)
+                    except:
+                        worker.reset()
+                        free.append(worker)
+                        raise
+                    active[worker.curl_handle] = (index, worker, body, header)
+                    multi.add_handle(worker.curl_handle)
+                if not active:
+                    break
+                while True:
+                    ret, num_handles = multi.perform()
+                    if ret != pycurl.E_CALL_MULTI_PERFORM:
+                        break
+                finished = []
+                while True:
+                    queued, succeeded, failed = multi.info_read()
+                    for handle in succeeded:
+                        finished.append((handle, None))
+                    for handle, errno, errmsg in failed:
+                        finished.append((handle, PyCURLError(errno, errmsg)))
+                    if not queued:
+                        break
+                for handle, error in finished:
+                    index, worker, body, header = active.pop(handle)
+                    multi.remove_handle(handle)
+                    if error is None:
+                        result = worker._finish_perform(body, header)
+                    else:
+                        result = worker._failed_perform(error)
+                    worker.reset()
+                    free.append(worker)
+                    yield index, result
+                if active and not finished:
+                    multi.select(1.0)
+        finally:
+            for handle, (index, worker, body, header) in active.items():
+                multi.remove_handle(handle)
+                worker.reset()
+                free.append(worker)
+            if self.keep_alive:
+                # The multi handle holds the connection cache, keep it.
+                self._fetch_multi = multi
+            else:
+                multi.close()
+            self._fetch_pool.extend(free)
+
+    def _new_multi(self):
+        """Create the ``pycurl.CurlMulti`` used by :meth:`iter_fetch`."""
+        multi = pycurl.CurlMulti()
+        if self.keep_alive:
+            if self.max_connections:
+                multi.setopt(pycurl.M_MAXCONNECTS, self.max_connections)
+            if self.max_host_connections:
+                multi.setopt(pycurl.M_MAX_HOST_CONNECTIONS,
+                             self.max_host_connections)
+        return multi
+
+    def _prepare_request(self, request, defaults):
+        """Set up the CURL handle for one of the requests passed to
+        :meth:`iter_fetch`. Returns the same value as
+        :meth:`_prepare_perform`."""
+        if isinstance(request, basestring):
+            options = dict(defaults, url=request)
+        else:
+            options = dict(defaults, **request)
+        url = options.pop('url')
+        method = options.pop('method', 'GET').upper()
+        self._method = method
+        headers = dict(options.pop('headers', None) or {})
+        data = options.pop('data', None)
+        content_type = options.pop('content_type',
+                                   'application/x-www-form-urlencoded')
+        if method == 'GET':
+            self.curl_handle.setopt(pycurl.HTTPGET, 1)
+        elif method == 'HEAD':
+            self.curl_handle.setopt(pycurl.NOBODY, 1)
+        elif method in ('POST', 'PUT'):
+            if method == 'POST':
+                self.curl_handle.setopt(pycurl.POST, 1)
+            else:
+                self.curl_handle.setopt(pycurl.UPLOAD, 1)
+                headers['Transfer-Encoding'] = ''
+            data = data or ''
+            self.curl_handle.setopt(pycurl.READFUNCTION, StringIO(data).read)
+            headers.setdefault('Content-Type', content_type)
+            headers['Content-Length'] = len(data)
+        elif data is not None:
+            raise Exception("data not supported with method %s." % method)
+        else:
+            self.curl_handle.setopt(pycurl.CUSTOMREQUEST, method)
+        return self._prepare_perform(url, headers, **options)
+
     def reset(self):
         """Resets the CURL handle to its base state. Automatically called after
         a HEAD, POST, PUT, or DELETE.
         
-        Will use the pycurl handle's ``reset()`` method if available. Otherwise
-        discards and replaces the pycurl handle."""
+        Will use the pycurl handle's ``reset()`` method if available, which
+        keeps any connections left open by ``keep_alive``. Otherwise discards
+        and replaces the pycurl handle.
+        
+        A :class:`StreamingResponse` still being read from this object is
+        closed first."""
+        if self._stream is not None:
+            self._stream.close()
         if hasattr(self.curl_handle, 'reset'):
             self.curl_handle.reset()
         else:
             self.curl_handle = pycurl.Curl()
     
+    def close(self):
+        """Close the CURL handle, along with any connections it has kept open.
+        The object can't be used afterwards."""
+        if self._stream is not None:
+            self._stream.close()
+        for worker in self._fetch_pool:
+            worker.close()
+        self._fetch_pool = []
+        if self._fetch_multi is not None:
+            self._fetch_multi.close()
+            self._fetch_multi = None
+        self.curl_handle.close()
+    
     def cache_dir():
         def fget(self):
-            return self._cache_dir
+            return self.cache.cache_dir
         def fset(self, value):
-            self._cache_dir = os.path.abspath(value)
+            self.cache = DiskCache(value)
         def fdel(self):
-            del self._cache_dir
-        doc = """Sets the directory to be used to store cache files. Whatever
+            self.cache = None
+        doc = """Sets the directory to be used to store cache files, by setting
+        :attr:`cache` to a :class:`~friendly_curl.cache.DiskCache`. Whatever
         value is provided will be run through os.path.abspath."""
         return locals()
     cache_dir = property(**cache_dir())
             
 local = _threading.local()
     
-def threadCURLSingleton():
+def threadCURLSingleton(**kwargs):
     """Creates or returns a single :class:`FriendlyCURL` object per thread. You
-    will usually want to call this to obtain a :class:`FriendlyCURL` object."""
+    will usually want to call this to obtain a :class:`FriendlyCURL` object.
+    
+    Any keyword arguments are passed to :class:`FriendlyCURL` when the
+    thread's object is first created, and are ignored afterwards."""
     if not hasattr(local, 'fcurl'):
-        local.fcurl = FriendlyCURL()
+        local.fcurl = FriendlyCURL(**kwargs)
     return local.fcurl
 
+class StreamingResponse(object):
+    """The body of an HTTP response, read as it arrives. Returned by
+    :meth:`FriendlyCURL.stream_url`. The response headers are available as
+    :attr:`response` straight away; iterating over this object yields chunks
+    of the body.
+    
+    The transfer is driven from whichever thread reads from it. Once more than
+    ``max_buffer`` bytes are waiting to be read, the transfer is paused until
+    the reader catches up. ``on_close`` is called with no arguments once the
+    transfer is finished with."""
+    
+    def __init__(self, fcurl, max_buffer, on_close=None):
+        self.fcurl = fcurl
+        self.max_buffer = max_buffer
+        self.on_close = on_close
+        #: A dictionary of response headers, including the HTTP status as an
+        #: int in 'status', as returned by :meth:`FriendlyCURL.get_url`.
+        self.response = None
+        #: The :class:`~friendly_curl.response.Timings` of the transfer, once
+        #: it has finished.
+        self.timings = None
+        self._multi = pycurl.CurlMulti()
+        self._header = None
+        self._chunks = collections.deque()
+        self._buffered = 0
+        self._body_started = False
+        self._paused = False
+        # Set to accept one chunk past max_buffer, for reads larger than it.
+        self._force = False
+        self._done = False
+        self._closed = False
+        self._error = None
+    
+    def write(self, data):
+        """``WRITEFUNCTION`` callback; buffer data from the transfer."""
+        if self._buffered >= self.max_buffer and not self._force:
+            # libcurl will hand us this data again once unpaused.
+            self._paused = True
+            return pycurl.WRITEFUNC_PAUSE
+        self._force = False
+        self._body_started = True
+        self._chunks.append(data)
+        self._buffered += len(data)
+    
+    def read(self, amt=-1):
+        """Read up to ``amt`` bytes of the body, or all of it if ``amt`` is
+        negative. Returns an empty string at the end of the body. Raises\
+        ``ValueError`` if more is needed once the response has been closed."""
+        while (amt < 0 or self._buffered < amt) and self._fill():
+            pass
+        if amt < 0 or amt >= self._buffered:
+            data = ''.join(self._chunks)
+            self._chunks.clear()
+        else:
+            parts = []
+            needed = amt
+            while needed:
+                chunk = self._chunks.popleft()
+                if len(chunk) > needed:
+                    self._chunks.appendleft(chunk[needed:])
+                    chunk = chunk[:needed]
+                parts.append(chunk)
+                needed -= len(chunk)
+            data = ''.join(parts)
+        self._buffered -= len(data)
+        return data
+    
+    def iter_content(self, chunk_size=None):
+        """Iterate over the body in strings of ``chunk_size`` bytes (the last
+        may be shorter), or in whatever pieces libcurl delivers if
+        ``chunk_size`` is ``None``."""
+        while True:
+            if chunk_size is None:
+                if not self._chunks and not self._fill():
+                    return
+                data = self._chunks.popleft()
+                self._buffered -= len(data)
+            else:
+                data = self.read(chunk_size)
+                if not data:
+                    return
+            yield data
+    
+    def iter_lines(self, chunk_size=None):
+        """Iterate over the lines of the body, without their line endings."""
+        pending = ''
+        for data in self.iter_content(chunk_size):
+            lines = (pending + data).split('\n')
+            pending = lines.pop()
+            for line in lines:
+                if line.endswith('\r'):
+                    line = line[:-1]
+                yield line
+        if pending:
+            yield pending
+    
+    def __iter__(self):
+        return self.iter_content()
+    
+    def close(self):
+        """Stop the transfer, if it isn't already complete, and release the
+        :class:`FriendlyCURL` object for other requests."""
+        if self._closed:
+            return
+        self._closed = True
+        self.fcurl._stream = None
+        self._multi.remove_handle(self.fcurl.curl_handle)
+        self._multi.close()
+        self.fcurl.reset()
+        if self.on_close is not None:
+            self.on_close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    def _start(self, header, follow_location=False):
+        """Start the transfer and wait for the headers of the final response,
+        which is a redirect only if ``follow_location`` is false."""
+        self._header = header
+        self.fcurl._stream = self
+        self._multi.add_handle(self.fcurl.curl_handle)
+        self._step()
+        while not (self._headers_received(follow_location) or self._done):
+            self._multi.select(1.0)
+            self._step()
+        self.response = self.fcurl._parse_response(header)
+        if self._done:
+            self.close()
+        if self._error is not None and not self._body_started:
+            raise self._error
+    
+    def _headers_received(self, follow_location):
+        """Whether the headers of the final response have all arrived:
+        interim 1xx responses and redirects libcurl will follow don't count."""
+        header = self._header
+        if self._body_started:
+            return True
+        if not header.complete or header.status is None or \
+           100 <= header.status < 200:
+            return False
+        if follow_location and 300 <= header.status < 400 and \
+           'location' in header.headers():
+            return False
+        return True
+    
+    def _fill(self):
+        """Wait for more of the body. Returns False if there is no more."""
+        if self._error is not None:
+            raise self._error
+        if self._done:
+            return False
+        if self._closed:
+            raise ValueError('The response was closed before its body was '
+                             'read.')
+        count = len(self._chunks)
+        self._force = True
+        if self._paused:
+            self._paused = False
+            self.fcurl.curl_handle.pause(pycurl.PAUSE_CONT)
+        self._step()
+        while len(self._chunks) == count and not self._done:
+            self._multi.select(1.0)
+            self._step()
+        self._force = False
+        if self._done:
+            self.close()
+        if self._error is not None:
+            raise self._error
+        return len(self._chunks) > count
+    
+    def _step(self):
+        """Do whatever work on the transfer can be done without waiting."""
+        while True:
+            ret, num_handles = self._multi.perform()
+            if ret != pycurl.E_CALL_MULTI_PERFORM:
+                break
+        queued, succeeded, failed = self._multi.info_read()
+        for handle, errno, errmsg in failed:
+            self._error = PyCURLError(errno, errmsg)
+        if succeeded or failed:
+            self._done = True
+            self.fcurl._last_used = time.time()
+            self.timings = _timings(self.fcurl.curl_handle)
+            if self._error is None:
+                self.fcurl._after_request(
+                    self, self.fcurl.curl_handle.getinfo(pycurl.HTTP_CODE),
+                    self.timings)
+            else:
+                self.fcurl._after_request(self._error, None, self.timings)
+
+class PoolTimeout(Exception):
+    """Raised by :meth:`CurlHandlePool.checkout` when no handle became
+    available in time."""
+
+class CurlHandlePool(object):
+    """A bounded pool of :class:`FriendlyCURL` objects, for servers whose
+    threads come and go too often for :func:`threadCURLSingleton`. Handles
+    are reused most-recently-returned first, so the ones with warm
+    connections stay in use and the rest can age out.
+    
+    Use it as::
+    
+        pool = CurlHandlePool(max_size=20, max_idle_time=60)
+        with pool.handle() as fcurl:
+            response, body = fcurl.get_url(url)
+    
+    :param max_size: The most handles that may exist at once.
+    :type max_size: int
+    :param max_idle_time: Close handles that have been idle in the pool for\
+    longer than this many seconds. ``None`` keeps them forever.
+    :type max_idle_time: int or float
+    :param kwargs: Keyword arguments for :class:`FriendlyCURL` when creating\
+    handles."""
+    
+    def __init__(self, max_size=10, max_idle_time=None, **kwargs):
+        self.max_size = max_size
+        self.max_idle_time = max_idle_time
+        self._kwargs = kwargs
+        # (time checked in, handle), most recently checked in last.
+        self._idle = []
+        self._in_use = 0
+        self._created = 0
+        self._evicted = 0
+        self._condition = _threading.Condition()
+    
+    def checkout(self, timeout=None):
+        """Take a handle from the pool, creating one if none are idle and the
+        pool isn't full. Otherwise wait for one to be checked in.
+        
+        :param timeout: How long to wait, in seconds. ``None`` waits forever.
+        :type timeout: int or float
+        :raises: :class:`PoolTimeout` if no handle became available in time."""
+        if timeout is not None:
+            deadline = time.time() + timeout
+        with self._condition:
+            expired = self._expire_idle()
+            while not self._idle and self._in_use >= self.max_size:
+                if timeout is None:
+                    self._condition.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        self._close_all(expired)
+                        raise PoolTimeout("No handle available after %s "
+                                          "seconds." % timeout)
+                    self._condition.wait(remaining)
+            self._in_use += 1
+            if self._idle:
+                fcurl = self._idle.pop()[1]
+            else:
+                fcurl = None
+                self._created += 1
+        self._close_all(expired)
+        if fcurl is None:
+            try:
+                fcurl = FriendlyCURL(**self._kwargs)
+            except:
+                with self._condition:
+                    self._in_use -= 1
+                    self._created -= 1
+                    self._condition.notify()
+                raise
+        return fcurl
+    
+    def checkin(self, fcurl):
+        """Return a handle taken with :meth:`checkout` to the pool."""
+        fcurl.reset()
+        with self._condition:
+            self._in_use -= 1
+            self._idle.append((time.time(), fcurl))
+            expired = self._expire_idle()
+            self._condition.notify()
+        self._close_all(expired)
+    
+    @contextlib.contextmanager
+    def handle(self, timeout=None):
+        """A context manager that checks a handle out for the duration of the
+        ``with`` block. See :meth:`checkout`."""
+        fcurl = self.checkout(timeout)
+        try:
+            yield fcurl
+        finally:
+            self.checkin(fcurl)
+    
+    def evict_idle(self):
+        """Close any handles that have been idle for longer than
+        ``max_idle_time``. This also happens on every checkout and checkin."""
+        with self._condition:
+            expired = self._expire_idle()
+        self._close_all(expired)
+    
+    def stats(self):
+        """Get a dictionary of the number of handles ``in_use`` and ``idle``
+        now, and the number ever ``created`` and ``evicted``."""
+        with self._condition:
+            return {'in_use': self._in_use,
+                    'idle': len(self._idle),
+                    'created': self._created,
+                    'evicted': self._evicted}
+    
+    def close(self):
+        """Close all idle handles. Handles checked out now are still returned
+        to the pool when checked in."""
+        with self._condition:
+            idle = [fcurl for (checked_in, fcurl) in self._idle]
+            self._evicted += len(idle)
+            self._idle = []
+        self._close_all(idle)
+    
+    def _expire_idle(self):
+        """Remove idle handles past ``max_idle_time`` from the pool, returning
+        them to be closed. The caller must hold the pool's lock."""
+        if self.max_idle_time is None or not self._idle:
+            return []
+        cutoff = time.time() - self.max_idle_time
+        expired = []
+        while self._idle and self._idle[0][0] < cutoff:
+            expired.append(self._idle.pop(0)[1])
+        self._evicted += len(expired)
+        return expired
+    
+    def _close_all(self, handles):
+        for fcurl in handles:
+            fcurl.close()
+
+class _Future(object):
+    """A minimal future, used by :class:`SelectLoop`."""
+    
+    def __init__(self):
+        self._done = False
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+    
+    def done(self):
+        return self._done
+    
+    def result(self):
+        if not self._done:
+            raise Exception("Result is not ready.")
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+    
+    def exception(self):
+        return self._exception
+    
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+    
+    def set_exception(self, exception):
+        self._exception = exception
+        self._finish()
+    
+    def add_done_callback(self, callback):
+        if self._done:
+            callback(self)
+        else:
+            self._callbacks.append(callback)
+    
+    def _finish(self):
+        self._done = True
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+class _TimerHandle(object):
+    """Returned by :meth:`SelectLoop.call_later`."""
+    
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+    
+    def cancel(self):
+        self.cancelled = True
+
+class SelectLoop(object):
+    """A minimal event loop. It provides the part of the ``asyncio`` event
+    loop interface that :class:`AsyncFriendlyCURL` uses, for where no
+    ``asyncio``-compatible loop is available.
+    
+    Sockets are watched with ``select.epoll`` or ``select.poll``, which can
+    watch any number of them. Only where neither exists does it fall back on
+    ``select.select``, which can't watch file descriptors above
+    ``FD_SETSIZE``, usually 1023."""
+    
+    def __init__(self):
+        self._readers = {}
+        self._writers = {}
+        # Heap of (when, sequence, handle).
+        self._timers = []
+        self._sequence = 0
+        # The events each file descriptor is registered with the poller for.
+        self._registered = {}
+        if hasattr(select, 'epoll'):
+            self._poller = select.epoll()
+            self._in, self._out = select.EPOLLIN, select.EPOLLOUT
+            self._errors = select.EPOLLERR | select.EPOLLHUP
+            self._milliseconds = False
+        elif hasattr(select, 'poll'):
+            self._poller = select.poll()
+            self._in, self._out = select.POLLIN, select.POLLOUT
+            self._errors = select.POLLERR | select.POLLHUP
+            # poll takes its timeout in milliseconds, epoll in seconds.
+            self._milliseconds = True
+        else:
+            self._poller = None
+    
+    def add_reader(self, fd, callback, *args):
+        self._readers[fd] = (callback, args)
+        self._update(fd)
+    
+    def remove_reader(self, fd):
+        removed = self._readers.pop(fd, None) is not None
+        self._update(fd)
+        return removed
+    
+    def add_writer(self, fd, callback, *args):
+        self._writers[fd] = (callback, args)
+        self._update(fd)
+    
+    def remove_writer(self, fd):
+        removed = self._writers.pop(fd, None) is not None
+        self._update(fd)
+        return removed
+    
+    def _update(self, fd):
+        """Register ``fd`` with the poller for the events now wanted."""
+        if self._poller is None:
+            return
+        events = 0
+        if fd in self._readers:
+            events |= self._in
+        if fd in self._writers:
+            events |= self._out
+        current = self._registered.get(fd)
+        if events == current:
+            return
+        if current is not None:
+            del self._registered[fd]
+            try:
+                self._poller.unregister(fd)
+            except (IOError, OSError, KeyError, ValueError):
+                # Already closed, which unregisters it.
+                pass
+        if events:
+            self._poller.register(fd, events)
+            self._registered[fd] = events
+    
+    def call_later(self, delay, callback, *args):
+        handle = _TimerHandle(time.time() + delay, callback, args)
+        self._sequence += 1
+        heapq.heappush(self._timers, (handle.when, self._sequence, handle))
+        return handle
+    
+    def create_future(self):
+        return _Future()
+    
+    def run_until_complete(self, future):
+        """Run the loop until ``future`` is done, returning its result."""
+        while not future.done():
+            self._run_once()
+        return future.result()
+    
+    def close(self):
+        """Release the poller's file descriptor, if it has one."""
+        if self._poller is not None and hasattr(self._poller, 'close'):
+            self._poller.close()
+    
+    def _poll(self, timeout):
+        """Wait up to ``timeout`` seconds, or forever if it is ``None``, for
+        watched file descriptors to become ready. Returns the lists of those
+        readable and writable."""
+        if self._poller is None:
+            readable, writable, errored = select.select(
+                self._readers.keys(), self._writers.keys(), [], timeout)
+            return readable, writable
+        if self._milliseconds:
+            events = self._poller.poll(None if timeout is None
+                                       else timeout * 1000)
+        else:
+            events = self._poller.poll(-1 if timeout is None else timeout)
+        readable = []
+        writable = []
+        for fd, event in events:
+            if event & (self._in | self._errors):
+                readable.append(fd)
+            if event & (self._out | self._errors):
+                writable.append(fd)
+        return readable, writable
+    
+    def _run_once(self):
+        while self._timers and self._timers[0][2].cancelled:
+            heapq.heappop(self._timers)
+        if self._timers:
+            timeout = max(0, self._timers[0][0] - time.time())
+        elif self._readers or self._writers:
+            timeout = None
+        else:
+            raise Exception("Nothing for the loop to wait for.")
+        if self._readers or self._writers:
+            readable, writable = self._poll(timeout)
+            for fd in readable:
+                if fd in self._readers:
+                    callback, args = self._readers[fd]
+                    callback(*args)
+            for fd in writable:
+                if fd in self._writers:
+                    callback, args = self._writers[fd]
+                    callback(*args)
+        else:
+            time.sleep(timeout)
+        now = time.time()
+        while self._timers and self._timers[0][0] <= now:
+            handle = heapq.heappop(self._timers)[2]
+            if not handle.cancelled:
+                handle.callback(*handle.args)
+
+class AsyncFriendlyCURL(object):
+    """Performs requests without blocking, on an event loop. Transfers are
+    driven by a ``pycurl.CurlMulti`` using ``socket_action``, so any number
+    can be in flight from a single thread.
+    
+    Each of the \*_url methods returns a future whose result is the same
+    ``(response, body)`` tuple returned by the :class:`FriendlyCURL` method
+    of the same name, or whose exception is the ``pycurl.error`` raised by
+    the transfer.
+    
+    :param loop: The event loop to use. Any loop providing ``add_reader``,\
+    ``remove_reader``, ``add_writer``, ``remove_writer``, ``call_later`` and\
+    ``create_future``, such as an ``asyncio`` loop, will do. Defaults to a new\
+    :class:`SelectLoop`.
+    :param max_concurrency: The maximum number of simultaneous transfers.\
+    Further requests wait until one finishes. ``None`` means no limit.
+    :type max_concurrency: int
+    :param kwargs: Keyword arguments for the :class:`FriendlyCURL` objects\
+    whose handles perform the transfers."""
+    
+    def __init__(self, loop=None, max_concurrency=None, **kwargs):
+        if loop is None:
+            loop = SelectLoop()
+        self.loop = loop
+        self.max_concurrency = max_concurrency
+        self._kwargs = kwargs
+        self._idle = [FriendlyCURL(**kwargs)]
+        self._multi = self._idle[0]._new_multi()
+        self._multi.setopt(pycurl.M_SOCKETFUNCTION, self._on_socket)
+        self._multi.setopt(pycurl.M_TIMERFUNCTION, self._on_timer)
+        # Maps pycurl handles to (worker, body, header, future).
+        self._active = {}
+        # (request, defaults, future) waiting for max_concurrency.
+        self._waiting = collections.deque()
+        self._timer = None
+    
+    def get_url(self, url, headers=None, **kwargs):
+        """Perform an HTTP GET. See :meth:`FriendlyCURL.get_url`. The cache is
+        not used."""
+        return self._request({'url': url, 'headers': headers}, kwargs)
+    
+    def head_url(self, url, headers=None, **kwargs):
+        """Perform an HTTP HEAD. See :meth:`FriendlyCURL.head_url`."""
+        return self._request({'url': url, 'method': 'HEAD',
+                              'headers': headers}, kwargs)
+    
+    def post_url(self, url, data=None,
+                 content_type='application/x-www-form-urlencoded',
+                 headers=None, **kwargs):
+        """Perform an HTTP POST. See :meth:`FriendlyCURL.post_url`; only
+        ``data`` is supported for the body."""
+        return self._request({'url': url, 'method': 'POST', 'data': data,
+                              'content_type': content_type,
+                              'headers': headers}, kwargs)
+    
+    def put_url(self, url, data=None,
+                content_type='application/x-www-form-urlencoded',
+                headers=None, **kwargs):
+        """Perform an HTTP PUT. See :meth:`FriendlyCURL.put_url`; only
+        ``data`` is supported for the body."""
+        return self._request({'url': url, 'method': 'PUT', 'data': data,
+                              'content_type': content_type,
+                              'headers': headers}, kwargs)
+    
+    def delete_url(self, url, headers=None, **kwargs):
+        """Perform an HTTP DELETE. See :meth:`FriendlyCURL.delete_url`."""
+        return self._request({'url': url, 'method': 'DELETE',
+                              'headers': headers}, kwargs)
+    
+    def close(self):
+        """Close the multi handle and all easy handles. Requests still in
+        flight are abandoned."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        for handle, (worker, body, header, future) in self._active.items():
+            self._multi.remove_handle(handle)
+            worker.close()
+        self._active = {}
+        for worker in self._idle:
+            worker.close()
+        self._idle = []
+        self._multi.close()
+    
+    def _request(self, request, defaults):
+        future = self.loop.create_future()
+        if self.max_concurrency is not None and \
+           len(self._active) >= self.max_concurrency:
+            self._waiting.append((request, defaults, future))
+        else:
+            self._start(request, defaults, future)
+        return future
+    
+    def _start(self, request, defaults, future):
+        if self._idle:
+            worker = self._idle.pop()
+        else:
+            worker = FriendlyCURL(**self._kwargs)
+        try:
+            body, header = worker._prepare_request(request, defaults)
+        except Exception as e:
+            worker.reset()
+            self._idle.append(worker)
+            future.set_exception(e)
+            return
+        self._active[worker.curl_handle] = (worker, body, header, future)
+        # Adding the handle makes libcurl set a timer to start the transfer.
+        self._multi.add_handle(worker.curl_handle)
+    
+    def _on_socket(self, event, fd, multi, data):
+        """``M_SOCKETFUNCTION`` callback; watch ``fd`` as libcurl asks."""
+        if event == pycurl.POLL_REMOVE:
+            self.loop.remove_reader(fd)
+            self.loop.remove_writer(fd)
+            return
+        if event & pycurl.POLL_IN:
+            self.loop.add_reader(fd, self._on_ready, fd, pycurl.CSELECT_IN)
+        else:
+            self.loop.remove_reader(fd)
+        if event & pycurl.POLL_OUT:
+            self.loop.add_writer(fd, self._on_ready, fd, pycurl.CSELECT_OUT)
+        else:
+            self.loop.remove_writer(fd)
+    
+    def _on_timer(self, timeout_ms):
+        """``M_TIMERFUNCTION`` callback; libcurl wants to be called back
+        after ``timeout_ms``, or never if it is -1."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if timeout_ms >= 0:
+            self._timer = self.loop.call_later(timeout_ms / 1000.0,
+                                               self._on_timeout)
+    
+    def _on_timeout(self):
+        self._timer = None
+        self._socket_action(pycurl.SOCKET_TIMEOUT, 0)
+    
+    def _on_ready(self, fd, event):
+        self._socket_action(fd, event)
+    
+    def _socket_action(self, fd, event):
+        while True:
+            ret, running = self._multi.socket_action(fd, event)
+            if ret != pycurl.E_CALL_MULTI_PERFORM:
+                break
+        while True:
+            queued, succeeded, failed = self._multi.info_read()
+            for handle in succeeded:
+                self._finish(handle, None)
+            for handle, errno, errmsg in failed:
+                self._finish(handle, PyCURLError(errno, errmsg))
+            if not queued:
+                break
+    
+    def _finish(self, handle, error):
+        worker, body, header, future = self._active.pop(handle)
+        self._multi.remove_handle(handle)
+        if error is None:
+            result = worker._finish_perform(body, header)
+        else:
+            worker._failed_perform(error)
+        worker.reset()
+        self._idle.append(worker)
+        if self._waiting:
+            self._start(*self._waiting.popleft())
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+
 class CurlHTTPConnection(object):
     """A HTTPConncetion-style object that uses pycurl to actually do the work.
     
@@ -294,7 +1866,36 @@ class CurlHTTPConnection(object):
     and monkey-patch httplib2 as follows::
     
         httplib2.HTTPConnectionWithTimeout = CurlHTTPConnection
-        httplib2.HTTPSConnectionWithTimeout = CurlHTTPSConnection"""
+        httplib2.HTTPSConnectionWithTimeout = CurlHTTPSConnection
+    
+    Set :attr:`share` to ``True`` (or a ``pycurl.CurlShare``) to have every
+    connection share DNS and SSL session caches through :func:`curl_share`,
+    and :attr:`pool` to a :class:`CurlHandlePool` to take handles from it
+    rather than each connection using one of its own, created with
+    :attr:`fcurl_kwargs`. Since bodies are read as they arrive, a connection
+    never borrows :func:`threadCURLSingleton`, which the thread may use while
+    a body is still being read. Set :attr:`compressed` to have libcurl decode
+    compressed responses as they arrive, rather than httplib2 once the whole
+    body has been read."""
+    
+    #: The ``pycurl.CurlShare`` requests are attached to, ``True`` for the one
+    #: returned by :func:`curl_share`, or ``None`` not to share.
+    share = None
+    #: A :class:`CurlHandlePool` to check handles out of for each request, or
+    #: ``None`` for each connection to use its own.
+    pool = None
+    #: Keyword arguments for the :class:`FriendlyCURL` each connection
+    #: creates when :attr:`pool` is ``None``, such as ``hooks``, ``metrics``
+    #: or ``tracer``.
+    fcurl_kwargs = {}
+    #: How many bytes of a response body to buffer before pausing the
+    #: transfer until some have been read.
+    max_buffer = 1048576
+    #: Whether to ask for compressed responses with every encoding libcurl
+    #: supports, replacing httplib2's Accept-Encoding, and decode them as
+    #: they arrive. httplib2 is shown the decoded response without its
+    #: Content-Encoding or Content-Length headers.
+    compressed = False
     
     def __init__(self, host, port=None,
                  key_file=None, cert_file=None, strict=False,
@@ -307,14 +1908,24 @@ class CurlHTTPConnection(object):
         self.timeout = timeout
         self.proxy_info = proxy_info
         self.handle = None
+        self.fcurl = None
+        # The connection's own FriendlyCURL, when there's no pool.
+        self._own_fcurl = None
         self.scheme = 'http'
     
     def request(self, method, uri, body=None, headers=None):
         if not self.handle:
             self.connect()
         handle = self.fcurl.curl_handle
+        self.fcurl._method = method
         if headers is None:
             headers = {}
+        self.fcurl._decoding = self.compressed
+        if self.compressed:
+            headers = dict((header, value)
+                           for header, value in headers.iteritems()
+                           if header.lower() != 'accept-encoding')
+            handle.setopt(pycurl.ENCODING, '')
         if method == 'GET':
             handle.setopt(pycurl.HTTPGET, 1)
         elif method == 'HEAD':
@@ -352,12 +1963,16 @@ class CurlHTTPConnection(object):
         url = urlparse.urlunparse((self.scheme, netloc, uri, '', '', ''))
         self.url = str(iri2uri(url))
         handle.setopt(pycurl.URL, self.url)
+        self.fcurl._before_request(self.url, headers)
         if headers:
             handle.setopt(pycurl.HTTPHEADER, ['%s: %s' % (header, str(value)) for
                                                 header, value in
                                                 headers.iteritems()])
         handle.setopt(pycurl.SSL_VERIFYPEER, 0)
         handle.setopt(pycurl.NOSIGNAL, 1)
+        share = _resolve_share(self.share)
+        if share is not None:
+            handle.setopt(pycurl.SHARE, share)
         if self.key_file:
             handle.setopt(pycurl.SSLKEY, self.key_file)
         if self.cert_file:
@@ -367,25 +1982,65 @@ class CurlHTTPConnection(object):
         # Proxy not supported yet.
     
     def getresponse(self):
-        handle = self.fcurl.curl_handle
-        body = StringIO()
-        handle.setopt(pycurl.WRITEFUNCTION, body.write)
+        """Start the transfer and return a :class:`CurlHTTPResponse` once the
+        response headers have arrived. The body is transferred as it is read
+        from the response, which must be read to the end or closed before
+        another request is made on this connection."""
+        fcurl = self.fcurl
+        if self.pool is not None:
+            # The handle goes back to the pool when the body is finished.
+            self.fcurl = None
+            pool = self.pool
+            on_close = lambda: pool.checkin(fcurl)
+        else:
+            on_close = None
+        body = StreamingResponse(fcurl, self.max_buffer, on_close)
+        fcurl.curl_handle.setopt(pycurl.WRITEFUNCTION, body.write)
+        # The raw headers are kept for httplib's benefit.
         headers = StringIO()
-        handle.setopt(pycurl.HEADERFUNCTION, headers.write)
-        handle.perform()
-        self.fcurl.reset()
+        parser = HeaderParser()
+        decoding = fcurl._decoding
+        def header_function(line):
+            if not (decoding and line.split(':', 1)[0].strip().lower() in
+                    ('content-encoding', 'content-length')):
+                headers.write(line)
+            parser(line)
+        fcurl.curl_handle.setopt(pycurl.HEADERFUNCTION, header_function)
+        try:
+            body._start(parser)
+        except:
+            body.close()
+            raise
         return CurlHTTPResponse(body, headers)
     
     def set_debuglevel(self, level):
         pass
     
     def connect(self):
-        self.fcurl = threadCURLSingleton()
+        self._release()
+        if self.pool is not None:
+            self.fcurl = self.pool.checkout()
+        else:
+            if self._own_fcurl is None:
+                self._own_fcurl = FriendlyCURL(**self.fcurl_kwargs)
+            self.fcurl = self._own_fcurl
         self.fcurl.reset()
     
     def close(self):
-        """Also doesn't actually do anything."""
+        """Returns the handle to :attr:`pool` if one is in use, or closes the
+        connection's own handle. A new one is created if the connection is
+        used again."""
+        self._release()
         self.fcurl = None
+        if self._own_fcurl is not None:
+            self._own_fcurl.close()
+            self._own_fcurl = None
+    
+    def _release(self):
+        """Check the handle back in to :attr:`pool`, if it came from there."""
+        if self.pool is not None and self.fcurl is not None:
+            fcurl, self.fcurl = self.fcurl, None
+            self.pool.checkin(fcurl)
     
     def putrequest(self, request, selector, skip_host, skip_accept_encoding):
         raise NotImplementedError()
@@ -413,10 +2068,12 @@ class CurlHTTPSConnection(CurlHTTPConnection):
 
 class CurlHTTPResponse(httplib.HTTPResponse):
     """Used by :class:`CurlHTTPConnection` and :class:`CurlHTTPSConnection` to
-    return the HTTP response."""
+    return the HTTP response. ``body`` may be a :class:`StreamingResponse`,
+    in which case the body is read from the transfer as it arrives."""
     def __init__(self, body, headers):
         self.body = body
-        self.body.seek(0)
+        if hasattr(self.body, 'seek'):
+            self.body.seek(0)
         headers.seek(0)
         status_line = headers.readline()
         (http_version, sep, status_line) = status_line.partition(' ')
@@ -426,10 +2083,23 @@ class CurlHTTPResponse(httplib.HTTPResponse):
         self.reason = reason.strip()
         self.msg = mimetools.Message(headers)
     
+    @property
+    def timings(self):
+        """The :class:`~friendly_curl.response.Timings` of the transfer, once
+        the body has been read, or ``None``."""
+        return getattr(self.body, 'timings', None)
+    
     def read(self, amt=-1):
         """Read data from the body of the HTTP response."""
+        if amt is None:
+            amt = -1
         return self.body.read(amt)
     
+    def close(self):
+        """Discard the rest of the body, stopping the transfer if it hasn't
+        finished."""
+        self.body.close()
+    
     def getheader(self, name, default=None):
         """Get a header from the HTTP response.
         
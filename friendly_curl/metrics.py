@@ -0,0 +1,220 @@
+"""Process-wide request metrics for :class:`friendly_curl.FriendlyCURL`."""
+
+from __future__ import with_statement
+
+__all__ = ['MetricsRegistry', 'registry', 'DEFAULT_BUCKETS']
+
+import bisect
+import urlparse
+import weakref
+try:
+    import threading as _threading
+except ImportError:
+    import dummy_threading as _threading
+
+# Latency histogram bounds in seconds: powers of two from 1ms to about 65s.
+DEFAULT_BUCKETS = tuple(0.001 * 2 ** i for i in range(17))
+
+# The type and help text of each metric recorded by FriendlyCURL.
+METRICS = {
+    'friendly_curl_requests_total':
+        ('counter', 'Requests made, by host, method and status class.'),
+    'friendly_curl_request_seconds':
+        ('histogram', 'Total time taken by requests, by host and method.'),
+    'friendly_curl_connections_total':
+        ('counter', 'New connections made, by host. Requests that made none '
+                    'reused a connection.'),
+    'friendly_curl_received_bytes_total':
+        ('counter', 'Bytes of response bodies received, by host.'),
+    'friendly_curl_sent_bytes_total':
+        ('counter', 'Bytes of request bodies sent, by host.'),
+    'friendly_curl_cache_total':
+        ('counter', 'Results of get_url cache lookups: hit, miss, '
+                    'revalidated, stale or coalesced.'),
+}
+
+class _Shard(object):
+    """The metrics recorded by one thread."""
+
+    __slots__ = ('counters', 'histograms', 'thread')
+
+    def __init__(self, thread=None):
+        self.counters = {}
+        # Maps keys to [bucket counts, sum].
+        self.histograms = {}
+        self.thread = thread
+
+class MetricsRegistry(object):
+    """Counters and histograms, each identified by a name and a set of
+    labels. Each thread records into its own shard, so recording never
+    waits on a lock; :meth:`snapshot` adds the shards up.
+
+    Pass one to :class:`~friendly_curl.FriendlyCURL` as ``metrics``, or
+    ``True`` to use the process-wide :data:`registry`.
+
+    :param buckets: The upper bounds of the histogram buckets, in ascending\
+    order. Defaults to :data:`DEFAULT_BUCKETS`.
+    :type buckets: sequence of float"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._local = _threading.local()
+        self._lock = _threading.Lock()
+        self._shards = []
+        # Metrics from threads that have exited.
+        self._retired = _Shard()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = _Shard(
+                weakref.ref(_threading.current_thread()))
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def inc(self, name, labels=None, amount=1):
+        """Add ``amount`` to a counter.
+
+        :param labels: The counter's labels.
+        :type labels: dict"""
+        counters = self._shard().counters
+        key = _key(name, labels)
+        counters[key] = counters.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        """Record ``value`` in a histogram."""
+        histograms = self._shard().histograms
+        key = _key(name, labels)
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = [[0] * (len(self.buckets) + 1), 0]
+        histogram[0][bisect.bisect_left(self.buckets, value)] += 1
+        histogram[1] += value
+
+    def snapshot(self):
+        """Get the current value of every metric.
+
+        :returns: A dictionary mapping ``(name, labels)`` pairs, where\
+        ``labels`` is a sorted tuple of ``(label, value)`` pairs, to the\
+        counter's value, or for a histogram to a dictionary with the\
+        ``count``, ``sum`` and non-cumulative bucket ``counts``, the last\
+        of which counts values above the highest bound."""
+        with self._lock:
+            live = []
+            for shard in self._shards:
+                thread = shard.thread()
+                if thread is None or not thread.is_alive():
+                    _merge(self._retired, shard)
+                else:
+                    live.append(shard)
+            self._shards = live
+            total = _Shard()
+            for shard in [self._retired] + live:
+                _merge(total, shard)
+        result = dict(total.counters)
+        for key, (counts, value_sum) in total.histograms.iteritems():
+            result[key] = {'count': sum(counts), 'sum': value_sum,
+                           'counts': counts}
+        return result
+
+    def reset(self):
+        """Set every metric back to zero. Metrics being recorded by other
+        threads at the same moment may be lost."""
+        with self._lock:
+            self._retired = _Shard()
+            for shard in self._shards:
+                shard.counters = {}
+                shard.histograms = {}
+
+    def exposition(self):
+        """Get the metrics in the Prometheus text exposition format, to be
+        served to a scraper."""
+        by_name = {}
+        for (name, labels), value in self.snapshot().iteritems():
+            by_name.setdefault(name, []).append((labels, value))
+        lines = []
+        for name in sorted(by_name):
+            kind, help_text = METRICS.get(name, (None, None))
+            if kind is None:
+                kind = 'histogram' if isinstance(by_name[name][0][1], dict) \
+                       else 'counter'
+            if help_text:
+                lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for labels, value in sorted(by_name[name]):
+                if not isinstance(value, dict):
+                    lines.append('%s%s %s' % (name, _labels(labels), value))
+                    continue
+                cumulative = 0
+                bounds = ['%g' % bound for bound in self.buckets] + ['+Inf']
+                for bound, count in zip(bounds, value['counts']):
+                    cumulative += count
+                    lines.append('%s_bucket%s %d' % (
+                        name, _labels(labels + (('le', bound),)), cumulative))
+                lines.append('%s_sum%s %r' % (name, _labels(labels),
+                                              float(value['sum'])))
+                lines.append('%s_count%s %d' % (name, _labels(labels),
+                                                value['count']))
+        return '\n'.join(lines) + '\n'
+
+    def record_request(self, method, status, timings):
+        """Record a request made by :class:`~friendly_curl.FriendlyCURL`.
+
+        :param method: The request method.
+        :param status: The HTTP status, or ``None`` if the request failed.
+        :param timings: The request's\
+        :class:`~friendly_curl.response.Timings`."""
+        host = urlparse.urlsplit(timings.effective_url or '').netloc.lower()
+        if status:
+            status_class = '%dxx' % (status // 100)
+        else:
+            status_class = 'error'
+        self.inc('friendly_curl_requests_total',
+                 {'host': host, 'method': method, 'status': status_class})
+        if timings.total is not None:
+            self.observe('friendly_curl_request_seconds',
+                         {'host': host, 'method': method}, timings.total)
+        if timings.num_connects:
+            self.inc('friendly_curl_connections_total', {'host': host},
+                     timings.num_connects)
+        if timings.size_download:
+            self.inc('friendly_curl_received_bytes_total', {'host': host},
+                     int(timings.size_download))
+        if timings.size_upload:
+            self.inc('friendly_curl_sent_bytes_total', {'host': host},
+                     int(timings.size_upload))
+
+    def record_cache(self, result):
+        """Record the outcome of a cache lookup by
+        :meth:`~friendly_curl.FriendlyCURL.get_url`."""
+        self.inc('friendly_curl_cache_total', {'result': result})
+
+def _key(name, labels):
+    if not labels:
+        return name, ()
+    return name, tuple(sorted(labels.iteritems()))
+
+def _merge(total, shard):
+    """Add the metrics in ``shard`` to ``total``."""
+    for key, value in shard.counters.items():
+        total.counters[key] = total.counters.get(key, 0) + value
+    for key, (counts, value_sum) in shard.histograms.items():
+        histogram = total.histograms.get(key)
+        if histogram is None:
+            total.histograms[key] = [list(counts), value_sum]
+        else:
+            histogram[0] = [a + b for a, b in zip(histogram[0], counts)]
+            histogram[1] += value_sum
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', '\\\\')
+                     .replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels)
+
+#: The process-wide :class:`MetricsRegistry`, used by objects created with
+#: ``metrics=True``.
+registry = MetricsRegistry()
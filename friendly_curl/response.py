@@ -0,0 +1,294 @@
+"""Response headers and results returned by
+:class:`friendly_curl.FriendlyCURL`."""
+
+from __future__ import with_statement
+
+__all__ = ['Headers', 'HeaderParser', 'Response', 'Timings']
+
+import collections
+
+class Headers(object):
+    """A case-insensitive dictionary of response headers that keeps every
+    value of headers sent more than once, such as Set-Cookie. Looking one of
+    those up gives the last value, as with the plain dictionaries of earlier
+    versions; use :meth:`get_all` to get them all. The status is kept under
+    ``'status'``, like the response dictionaries of earlier versions.
+
+    Headers are stored as they were received and only indexed the first
+    time one is looked up, so responses whose headers are never read cost
+    little.
+
+    :param headers: The ``(name, value)`` pairs to start with, or a mapping.
+    :type headers: list or dict"""
+
+    __slots__ = ('_pairs', '_map')
+
+    def __init__(self, headers=()):
+        if isinstance(headers, Headers):
+            headers = headers.pairs()
+        elif hasattr(headers, 'keys'):
+            headers = [(name, headers[name]) for name in headers.keys()]
+        self._pairs = list(headers)
+        self._map = None
+
+    def _values(self):
+        """Get the dictionary of lower-cased names to lists of values,
+        building it if need be."""
+        if self._map is None:
+            values = {}
+            for name, value in self._pairs:
+                values.setdefault(name.lower(), []).append(value)
+            self._map = values
+            self._pairs = None
+        return self._map
+
+    def pairs(self):
+        """Get a list of ``(name, value)`` pairs, one for each value."""
+        if self._map is None:
+            return list(self._pairs)
+        return [(name, value) for name, values in self._map.iteritems()
+                for value in values]
+
+    def get_all(self, name, default=None):
+        """Get a list of all the values of header ``name``, or ``default`` if
+        it wasn't sent."""
+        values = self._values().get(name.lower())
+        if values is None:
+            return default
+        return list(values)
+
+    def add(self, name, value):
+        """Add a value for header ``name``, keeping any it already has."""
+        if self._map is None:
+            self._pairs.append((name, value))
+        else:
+            self._map.setdefault(name.lower(), []).append(value)
+
+    def __getitem__(self, name):
+        return self._values()[name.lower()][-1]
+
+    def __setitem__(self, name, value):
+        self._values()[name.lower()] = [value]
+
+    def __delitem__(self, name):
+        del self._values()[name.lower()]
+
+    def __contains__(self, name):
+        return name.lower() in self._values()
+
+    has_key = __contains__
+
+    def __iter__(self):
+        return iter(self._values())
+
+    def __len__(self):
+        return len(self._values())
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return self._values().keys()
+
+    def iterkeys(self):
+        return iter(self)
+
+    def values(self):
+        return [self[name] for name in self]
+
+    def itervalues(self):
+        return (self[name] for name in self)
+
+    def items(self):
+        return [(name, self[name]) for name in self]
+
+    def iteritems(self):
+        return ((name, self[name]) for name in self)
+
+    def pop(self, name, *default):
+        try:
+            value = self[name]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        del self[name]
+        return value
+
+    def setdefault(self, name, default=None):
+        if name not in self:
+            self[name] = default
+        return self[name]
+
+    def update(self, other=(), **kwargs):
+        if hasattr(other, 'keys'):
+            other = [(name, other[name]) for name in other.keys()]
+        for name, value in list(other) + kwargs.items():
+            self[name] = value
+
+    def copy(self):
+        return Headers(self)
+
+    def __eq__(self, other):
+        if not isinstance(other, (Headers, dict)):
+            return NotImplemented
+        return dict(self.iteritems()) == \
+               dict((name.lower(), value) for name, value in other.items())
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    __hash__ = None
+
+    def __getstate__(self):
+        return self.pairs()
+
+    def __setstate__(self, state):
+        self._pairs = state
+        self._map = None
+
+    def __repr__(self):
+        return 'Headers(%r)' % (self.pairs(),)
+
+collections.MutableMapping.register(Headers)
+
+class HeaderParser(object):
+    """Parses response headers a line at a time, as passed to a
+    ``pycurl.HEADERFUNCTION``. Each status line starts a new set of headers,
+    so when redirects are followed only those of the last response are
+    kept, unless ``keep_history`` is true.
+
+    :param keep_history: Whether to keep the headers of responses before the\
+    last, such as redirects and ``100 Continue``, in :attr:`history`.
+    :type keep_history: bool"""
+
+    __slots__ = ('history', 'complete', '_keep_history', '_pairs', '_status')
+
+    def __init__(self, keep_history=False):
+        #: :class:`Headers` of the responses before the last, oldest first.
+        self.history = []
+        #: Whether the blank line ending the last response's headers has been
+        #: received.
+        self.complete = False
+        self._keep_history = keep_history
+        self._pairs = []
+        self._status = None
+
+    @property
+    def status(self):
+        """The status of the last response so far, from its status line."""
+        return self._status
+
+    def __call__(self, line):
+        if line.startswith('HTTP/'):
+            if self._status is not None and self._keep_history:
+                self.history.append(self.headers())
+            fields = line.split(None, 2)
+            try:
+                self._status = int(fields[1])
+            except (IndexError, ValueError):
+                self._status = None
+            self._pairs = []
+            self.complete = False
+        elif not line.strip():
+            self.complete = True
+        elif line[:1] in (' ', '\t'):
+            # A continuation of the last header's value.
+            if self._pairs:
+                name, value = self._pairs[-1]
+                self._pairs[-1] = (name, '%s %s' % (value, line.strip()))
+        else:
+            name, colon, value = line.partition(':')
+            if colon:
+                self._pairs.append((name.strip(), value.strip()))
+
+    def headers(self, status=None):
+        """Get the :class:`Headers` of the last response so far.
+
+        :param status: The status to record, if not the one from the status\
+        line."""
+        if status is None:
+            status = self._status
+        return Headers([pair for pair in self._pairs
+                        if pair[0].lower() != 'status'] + [('status', status)])
+
+class Timings(object):
+    """Where the time went in a transfer, as reported by libcurl. Times are
+    in seconds from the start of the request until each stage finished.
+    Attributes libcurl is too old to report are ``None``.
+
+    :ivar namelookup: Resolving the host name.
+    :ivar connect: Connecting to the server.
+    :ivar appconnect: The TLS handshake; 0 for plain HTTP.
+    :ivar pretransfer: Getting ready to send the request.
+    :ivar starttransfer: Receiving the first byte of the response.
+    :ivar total: The whole transfer.
+    :ivar redirect: Following redirects, before the final request started.
+    :ivar num_connects: How many new connections were made; 0 means an\
+    existing connection was reused.
+    :ivar size_download: Bytes of body received.
+    :ivar size_upload: Bytes of body sent.
+    :ivar speed_download: The average download speed, in bytes per second.
+    :ivar effective_url: The last URL requested, after any redirects."""
+
+    __slots__ = ('namelookup', 'connect', 'appconnect', 'pretransfer',
+                 'starttransfer', 'total', 'redirect', 'num_connects',
+                 'size_download', 'size_upload', 'speed_download',
+                 'effective_url')
+
+    def __init__(self, **kwargs):
+        for name in self.__slots__:
+            setattr(self, name, kwargs.pop(name, None))
+        if kwargs:
+            raise TypeError('Unknown timings: %s' % ', '.join(kwargs))
+
+    def as_dict(self):
+        """Get the timings as a dictionary, for logging."""
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __repr__(self):
+        return 'Timings(%s)' % ', '.join('%s=%r' % (name, getattr(self, name))
+                                         for name in self.__slots__)
+
+class Response(object):
+    """The result of a request: its :class:`Headers` and body. It can still be
+    unpacked, or indexed, like the ``(response, body)`` tuple earlier versions
+    returned.
+
+    :ivar headers: The response :class:`Headers`, including the status.
+    :ivar body: The buffer the body was written to.
+    :ivar history: The :class:`Headers` of earlier responses, such as\
+    redirects, if they were asked for. See :class:`HeaderParser`.
+    :ivar timings: The :class:`Timings` of the transfer, or ``None`` if the\
+    response came from a cache."""
+
+    __slots__ = ('headers', 'body', 'history', 'timings')
+
+    def __init__(self, headers, body, history=(), timings=None):
+        self.headers = headers
+        self.body = body
+        self.history = list(history)
+        self.timings = timings
+
+    @property
+    def status(self):
+        """The HTTP status, as an int."""
+        return self.headers['status']
+
+    def __iter__(self):
+        return iter((self.headers, self.body))
+
+    def __len__(self):
+        return 2
+
+    def __getitem__(self, index):
+        return (self.headers, self.body)[index]
+
+    def __repr__(self):
+        return '<Response %s>' % (self.status,)
@@ -0,0 +1,614 @@
+"""Unit tests for friendly_curl's cache storage."""
+
+from cStringIO import StringIO
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from friendly_curl.cache import CacheEntry, DiskCache, MappedBody, \
+     MemoryCache, TieredCache, ZlibCodec, cache_key, freshness_lifetime, expiry_time, \
+     normalize_url, parse_cache_control, revalidated_response, variant_key, \
+     main
+
+class TestCacheKey(unittest.TestCase):
+    
+    def testNormalized(self):
+        self.assertEqual(cache_key('HTTP://Example.COM/Path?q=1'),
+                         cache_key('http://example.com/Path?q=1'))
+        self.assertNotEqual(cache_key('http://example.com/path'),
+                            cache_key('http://example.com/Path'))
+    
+    def testIRI(self):
+        self.assertEqual(cache_key(u'http://example.com/\xe4'),
+                         cache_key('http://example.com/%C3%A4'))
+    
+    def testNormalizeURL(self):
+        self.assertEqual(normalize_url('HTTP://User@Example.COM:80/p?b=2&a=1#x'),
+                         'http://User@example.com/p?a=1&b=2')
+        self.assertEqual(normalize_url('https://example.com:443'),
+                         'https://example.com/')
+        self.assertEqual(normalize_url('https://example.com:80/'),
+                         'https://example.com:80/')
+        self.assertEqual(normalize_url('http://example.com/?id=2&a=1&id=1'),
+                         'http://example.com/?a=1&id=2&id=1')
+        self.assertNotEqual(cache_key('http://example.com/?id=2&id=1'),
+                            cache_key('http://example.com/?id=1&id=2'))
+    
+    def testIgnoreParams(self):
+        self.assertEqual(normalize_url('http://example.com/?utm_source=x&q=1&'
+                                       'sid=2', ['utm_*', 'sid']),
+                         'http://example.com/?q=1')
+        self.assertEqual(cache_key('http://example.com/?q=1&utm_medium=y',
+                                   ['utm_*']),
+                         cache_key('http://example.com/?q=1'))
+    
+    def testVariantKey(self):
+        key = cache_key('http://example.com/')
+        self.assertEqual(variant_key(key, ['accept-encoding'],
+                                     {'Accept-Encoding': 'gzip'}),
+                         variant_key(key, ['accept-encoding'],
+                                     {'accept-encoding': ' gzip '}))
+        self.assertNotEqual(variant_key(key, ['accept-encoding'],
+                                        {'Accept-Encoding': 'gzip'}),
+                            variant_key(key, ['accept-encoding'], {}))
+
+class TestFreshness(unittest.TestCase):
+    
+    def testParseCacheControl(self):
+        self.assertEqual(parse_cache_control('max-age=60, No-Cache, '
+                                             'private="x"'),
+                         {'max-age': '60', 'no-cache': None, 'private': 'x'})
+        self.assertEqual(parse_cache_control(None), {})
+    
+    def testMaxAge(self):
+        response = {'status': 200, 'cache-control': 'max-age=60, s-maxage=5',
+                    'expires': 'Tue, 01 Dec 2009 18:59:28 GMT'}
+        self.assertEqual(freshness_lifetime(response), 60)
+        self.assertEqual(freshness_lifetime(response, shared=True), 5)
+        self.assertEqual(freshness_lifetime({'cache-control': 'max-age=x'}),
+                         0)
+    
+    def testExpires(self):
+        response = {'status': 200, 'date': 'Tue, 01 Dec 2009 18:59:28 GMT',
+                    'expires': 'Tue, 01 Dec 2009 19:59:28 GMT'}
+        self.assertEqual(freshness_lifetime(response), 3600)
+        self.assertEqual(freshness_lifetime({'expires': '0'}), 0)
+    
+    def testNoCache(self):
+        self.assertEqual(freshness_lifetime(
+            {'cache-control': 'no-cache, max-age=60'}), 0)
+    
+    def testHeuristic(self):
+        response = {'status': 200, 'date': 'Tue, 11 Dec 2009 00:00:00 GMT',
+                    'last-modified': 'Tue, 01 Dec 2009 00:00:00 GMT'}
+        self.assertEqual(freshness_lifetime(response), 0)
+        self.assertEqual(freshness_lifetime(response, heuristic=0.1), 86400)
+        response['status'] = 302
+        self.assertEqual(freshness_lifetime(response, heuristic=0.1), 0)
+    
+    def testExpiryTime(self):
+        """Test that the age of a response shortens its expiry"""
+        self.assertEqual(expiry_time({'cache-control': 'max-age=60',
+                                      'age': '10'}, 1000), 1050)
+        self.assertEqual(expiry_time({'cache-control': 'max-age=60'}, 1000),
+                         1060)
+
+    def testServesStale(self):
+        entry = CacheEntry('k', 'http://example.com/', {'cache-control':
+            'max-age=0, stale-while-revalidate=60'}, 0, 1000, expires=1000)
+        cache = MemoryCache()
+        self.assertTrue(cache.serves_stale(entry, 'stale-while-revalidate',
+                                           1059))
+        self.assertFalse(cache.serves_stale(entry, 'stale-while-revalidate',
+                                            1060))
+        self.assertFalse(cache.serves_stale(entry, 'stale-if-error', 1001))
+        cache = MemoryCache(stale_if_error=10)
+        self.assertTrue(cache.serves_stale(entry, 'stale-if-error', 1001))
+        entry.response['cache-control'] += ', must-revalidate'
+        self.assertFalse(cache.serves_stale(entry, 'stale-while-revalidate',
+                                            1001))
+    
+    def testRevalidatedResponse(self):
+        stored = {'status': 200, 'content-length': '4', 'etag': 'a',
+                  'content-type': 'text/plain'}
+        self.assertEqual(revalidated_response(stored, {
+            'status': 304, 'content-length': '0', 'etag': 'b'}),
+            {'status': 200, 'content-length': '4', 'etag': 'b',
+             'content-type': 'text/plain'})
+        self.assertEqual(stored['etag'], 'a')
+
+class TestDiskCache(unittest.TestCase):
+    
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = DiskCache(self.cache_dir)
+    
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+    
+    def testPutGet(self):
+        """Test storing and retrieving an entry"""
+        key = self.cache.key_for('http://example.com/')
+        self.assertEqual(self.cache.get(key), None)
+        self.cache.put(key, 'http://example.com/',
+                       {'status': 200, 'etag': 'abc'}, StringIO('body'))
+        entry = self.cache.get(key)
+        self.assertEqual(entry.url, 'http://example.com/')
+        self.assertEqual(entry.response, {'status': 200, 'etag': 'abc'})
+        self.assertEqual(entry.size, 4)
+        self.assertEqual(entry.open().read(), 'body')
+    
+    def testExpires(self):
+        """Test that the expiry time is kept with an entry"""
+        self.cache.put('k', 'http://example.com/', {}, StringIO(''), 1000.0)
+        self.assertEqual(self.cache.get('k').expires, 1000.0)
+        self.assertTrue(self.cache.get('k').is_fresh(999))
+        self.assertFalse(self.cache.get('k').is_fresh(1000))
+        self.cache.put('k', 'http://example.com/', {}, StringIO(''))
+        self.assertFalse(self.cache.get('k').is_fresh())
+    
+    def testWriter(self):
+        """Test storing a body as it is written"""
+        writer = self.cache.writer('k')
+        writer.write('bo')
+        writer.write('dy')
+        self.assertEqual(self.cache.get('k'), None)
+        writer.commit('http://example.com/', {'status': 200}, 1000.0)
+        entry = self.cache.get('k')
+        self.assertEqual(entry.open().read(), 'body')
+        self.assertEqual(entry.size, 4)
+        self.assertEqual(entry.expires, 1000.0)
+        writer = self.cache.writer('k')
+        writer.write('abandoned')
+        writer.abort()
+        self.assertEqual(self.cache.get('k').open().read(), 'body')
+        self.assertEqual(os.listdir(os.path.dirname(entry.body_path)),
+                         [os.path.basename(entry.body_path)])
+    
+    def testEvictLRU(self):
+        """Test that the least recently used entries are evicted on insert"""
+        cache = DiskCache(self.cache_dir, max_bytes=10, max_entries=3)
+        cache.ACCESS_RESOLUTION = 0
+        cache.put('a', 'http://example.com/a', {}, StringIO('1234'))
+        cache.put('b', 'http://example.com/b', {}, StringIO('5678'))
+        time.sleep(0.01)
+        cache.get('a')
+        cache.put('c', 'http://example.com/c', {}, StringIO('abcd'))
+        self.assertEqual(sorted(cache.keys()), ['a', 'c'])
+        self.assertEqual(cache.size(), 8)
+        for key in 'def':
+            cache.put(key, 'http://example.com/', {}, StringIO(''))
+        self.assertEqual(sorted(cache.keys()), ['d', 'e', 'f'])
+    
+    def testDeduplicate(self):
+        """Test that identical bodies are stored once"""
+        self.cache.put('a', 'http://example.com/a', {}, StringIO('body'))
+        self.cache.put('b', 'http://example.com/b', {}, StringIO('body'))
+        self.cache.put('c', 'http://example.com/c', {}, StringIO('other'))
+        path = self.cache.get('a').body_path
+        self.assertEqual(self.cache.get('b').body_path, path)
+        self.assertEqual(self.cache.size(), 9)
+        self.assertEqual(len(self.cache), 3)
+        self.cache.delete('a')
+        self.cache.delete('a')
+        self.assertEqual(self.cache.get('b').open().read(), 'body')
+        # Replacing the last reference removes the body.
+        self.cache.put('b', 'http://example.com/b', {}, StringIO('other'))
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(self.cache.size(), 5)
+        self.cache.put('a', 'http://example.com/a', {}, StringIO('body'))
+        self.assertEqual(self.cache.get('a').open().read(), 'body')
+    
+    def testEvictShared(self):
+        """Test that evicting an entry sharing its body frees nothing"""
+        cache = DiskCache(self.cache_dir, max_bytes=8)
+        cache.put('a', 'http://example.com/a', {}, StringIO('1234'))
+        cache.put('b', 'http://example.com/b', {}, StringIO('1234'))
+        time.sleep(0.01)
+        cache.put('c', 'http://example.com/c', {}, StringIO('5678'))
+        self.assertEqual(sorted(cache.keys()), ['a', 'b', 'c'])
+        cache.put('d', 'http://example.com/d', {}, StringIO('9'))
+        self.assertEqual(sorted(cache.keys()), ['c', 'd'])
+    
+    def testRunningTotals(self):
+        """Test that the index's totals match its entries and bodies"""
+        cache = DiskCache(self.cache_dir, max_entries=3,
+                          compression=ZlibCodec())
+        for i in range(6):
+            cache.put(str(i), 'http://example.com/%d' % i, {},
+                      StringIO('body %d' % (i % 2) * 100))
+        cache.put('0', 'http://example.com/0', {}, StringIO('other'))
+        cache.delete('5')
+        connection = cache._connection()
+        self.assertEqual(len(cache), connection.execute(
+            'SELECT COUNT(*) FROM entries').fetchone()[0])
+        self.assertEqual(cache.size(), connection.execute(
+            'SELECT SUM(size) FROM bodies').fetchone()[0])
+        self.assertEqual(len(DiskCache(self.cache_dir)), len(cache))
+    
+    def testCompression(self):
+        """Test storing bodies compressed"""
+        cache = DiskCache(self.cache_dir, compression=ZlibCodec(9))
+        body = 'A line of text.\n' * 1000
+        cache.put('a', 'http://example.com/a', {}, StringIO(body))
+        entry = cache.get('a')
+        self.assertEqual(entry.size, len(body))
+        self.assertTrue(os.path.getsize(entry.body_path) < len(body) / 10)
+        self.assertEqual(cache.size(), os.path.getsize(entry.body_path))
+        with entry.open() as body_file:
+            self.assertEqual(body_file.readline(), 'A line of text.\n')
+            self.assertEqual(body_file.read(5), 'A lin')
+            self.assertEqual(body_file.read(), body[21:])
+        self.assertEqual(entry.open_mapped().getvalue(), body)
+        # Readable without compression too.
+        self.assertEqual(self.cache.get('a').open().read(), body)
+        self.cache.put('b', 'http://example.com/b', {}, StringIO(body))
+        self.assertEqual(self.cache.get('b').body_path, entry.body_path)
+    
+    def testCompressedReads(self):
+        """Test reading a large compressed body in pieces"""
+        cache = DiskCache(self.cache_dir, compression=ZlibCodec())
+        body = ''.join('Line %d of a longer body.\n' % i for i in range(50000))
+        cache.put('a', 'http://example.com/a', {}, StringIO(body))
+        with cache.get('a').open() as body_file:
+            pieces = [body_file.readline(), body_file.read(3),
+                      body_file.read(100000), body_file.readline()]
+            while True:
+                piece = body_file.read(16 * 1024)
+                if not piece:
+                    break
+                pieces.append(piece)
+        self.assertEqual(pieces[0], 'Line 0 of a longer body.\n')
+        self.assertEqual(pieces[1], 'Lin')
+        self.assertTrue(pieces[3].endswith('\n'))
+        self.assertEqual(''.join(pieces), body)
+    
+    def testOrphanedBody(self):
+        """Test that a body file left without an index row isn't reused"""
+        body = 'A line of text.\n' * 1000
+        for first, second in ((None, ZlibCodec()), (ZlibCodec(), None)):
+            cache = DiskCache(self.cache_dir, compression=first)
+            cache.put('a', 'http://example.com/a', {}, StringIO(body))
+            path = cache.get('a').body_path
+            connection = cache._connection()
+            with connection:
+                connection.execute('DELETE FROM entries')
+                connection.execute('DELETE FROM bodies')
+                connection.execute('UPDATE stats SET entries = 0, bytes = 0')
+            self.assertTrue(os.path.exists(path))
+            cache = DiskCache(self.cache_dir, compression=second)
+            cache.put('a', 'http://example.com/a', {}, StringIO(body))
+            self.assertEqual(cache.get('a').open().read(), body)
+            cache.delete('a')
+    
+    def testStoreGzipped(self):
+        """Test that gzipped bodies aren't compressed again"""
+        cache = DiskCache(self.cache_dir, compression=ZlibCodec())
+        body = '\x1f\x8b\x08' + 'x' * 100
+        cache.put('a', 'http://example.com/a', {'content-encoding': 'gzip'},
+                  StringIO(body))
+        entry = cache.get('a')
+        self.assertEqual(entry.codec, None)
+        self.assertEqual(open(entry.body_path, 'rb').read(), body)
+        cache.put('b', 'http://example.com/b', {}, StringIO('x'))
+        self.assertEqual(cache.get('b').open().read(), 'x')
+    
+    def testAccessResolution(self):
+        """Test that reads only record use once it is out of date"""
+        self.cache.put('a', 'http://example.com/a', {}, StringIO('body'))
+        accessed = lambda: self.cache._connection().execute(
+            'SELECT accessed FROM entries').fetchone()[0]
+        stored = accessed()
+        self.cache.get('a')
+        self.assertEqual(accessed(), stored)
+        self.cache.ACCESS_RESOLUTION = 0
+        self.cache.get('a')
+        self.assertTrue(accessed() > stored)
+    
+    @unittest.skipIf(not hasattr(os, 'fork'), 'Requires os.fork')
+    def testFork(self):
+        """Test using a cache from a forked process"""
+        self.cache.put('a', 'http://example.com/a', {}, StringIO('parent'))
+        pid = os.fork()
+        if not pid:
+            status = 1
+            try:
+                if self.cache.get('a').open().read() == 'parent':
+                    self.cache.put('b', 'http://example.com/b', {},
+                                   StringIO('child'))
+                    status = 0
+            finally:
+                os._exit(status)
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
+        self.assertEqual(self.cache.get('b').open().read(), 'child')
+        self.assertEqual(self.cache.get('a').open().read(), 'parent')
+    
+    def testEvictWhileReading(self):
+        """Test that an open body can still be read after eviction"""
+        self.cache.put('a', 'http://example.com/a', {}, StringIO('body'))
+        body = self.cache.get('a').open()
+        self.assertEqual(self.cache.trim(max_entries=0), 1)
+        self.assertEqual(body.read(), 'body')
+        body.close()
+    
+    def testCollectGarbage(self):
+        """Test removing body files with no index entry"""
+        self.cache.put('a', 'http://example.com/a', {}, StringIO('body'))
+        stray = os.path.join(self.cache_dir, 'bodies', 'ab', 'abandoned')
+        os.makedirs(os.path.dirname(stray))
+        open(stray, 'w').close()
+        self.assertEqual(self.cache.collect_garbage(), 0)
+        self.assertEqual(self.cache.collect_garbage(max_age=-1), 1)
+        self.assertFalse(os.path.exists(stray))
+        self.assertEqual(self.cache.get('a').open().read(), 'body')
+    
+    def testLockFiles(self):
+        """Test that lock files make a second locker wait"""
+        cache = DiskCache(self.cache_dir, lock_files=True)
+        other = DiskCache(self.cache_dir, lock_files=True)
+        self.assertEqual(cache.entry_id('k'), other.entry_id('k'))
+        locked = threading.Event()
+        release = threading.Event()
+        def hold():
+            with cache.lock('k') as waited:
+                self.assertFalse(waited)
+                locked.set()
+                release.wait()
+        thread = threading.Thread(target=hold)
+        thread.start()
+        locked.wait()
+        threading.Timer(0.1, release.set).start()
+        with other.lock('k') as waited:
+            self.assertTrue(waited)
+        thread.join()
+        with self.cache.lock('k') as waited:
+            self.assertFalse(waited)
+        for i in range(10000):
+            with cache.lock('key %d' % i):
+                pass
+        self.assertTrue(len(os.listdir(cache.lock_dir)) <= 4096)
+    
+    def testMain(self):
+        """Test trimming a cache directory from the command line"""
+        for key in 'abc':
+            self.cache.put(key, 'http://example.com/', {},
+                           StringIO('body' + key))
+        stdout = sys.stdout
+        sys.stdout = output = StringIO()
+        try:
+            self.assertEqual(main(['--max-bytes', '10', self.cache_dir]), 0)
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(output.getvalue(),
+                         'Evicted 1 entries.\n2 entries, 10 bytes.\n')
+        self.assertEqual(len(self.cache), 2)
+    
+    def testUpdate(self):
+        """Test replacing an entry's response but not its body"""
+        self.cache.put('k', 'http://example.com/', {'etag': 'a'},
+                       StringIO('body'))
+        self.cache.update('k', {'etag': 'b'}, 1000.0)
+        self.cache.update('missing', {'etag': 'b'})
+        entry = self.cache.get('k')
+        self.assertEqual(entry.response, {'etag': 'b'})
+        self.assertEqual(entry.expires, 1000.0)
+        self.assertEqual(entry.open().read(), 'body')
+        self.assertEqual(self.cache.keys(), ['k'])
+    
+    def testVary(self):
+        """Test recording the headers responses vary on"""
+        self.assertEqual(self.cache.request_key('k', {'Accept': 'a/b'}), 'k')
+        key = self.cache.response_key('k', {'Accept': 'a/b'},
+                                      {'vary': 'Accept, accept'})
+        self.assertNotEqual(key, 'k')
+        self.assertEqual(self.cache.get_vary('k'), ['accept'])
+        self.assertEqual(self.cache.request_key('k', {'Accept': 'a/b'}), key)
+        self.assertEqual(self.cache.response_key('k', {}, {}), 'k')
+        self.assertEqual(self.cache.get_vary('k'), None)
+        self.assertFalse(self.cache.storable({'vary': '*'}))
+        self.assertFalse(self.cache.storable({'status': 304}))
+        self.assertEqual(self.cache.lookup('k', {'Accept': 'a/b'}),
+                         ('k', None))
+        self.cache.put('k', 'http://example.com/', {'status': 200},
+                       StringIO('plain'))
+        request_key, entry = self.cache.lookup('k', {'Accept': 'a/b'})
+        self.assertEqual(request_key, 'k')
+        self.assertEqual(entry.open().read(), 'plain')
+        self.cache.put(key, 'http://example.com/', {'status': 200},
+                       StringIO('varied'))
+        self.cache.set_vary('k', ['accept'])
+        request_key, entry = self.cache.lookup('k', {'Accept': 'a/b'})
+        self.assertEqual(request_key, key)
+        self.assertEqual(entry.open().read(), 'varied')
+        self.assertEqual(self.cache.lookup('k', {})[1], None)
+    
+    def testReplace(self):
+        """Test that storing under an existing key replaces the entry"""
+        self.cache.put('k', 'http://example.com/', {'status': 200},
+                       StringIO('old'))
+        self.cache.put('k', 'http://example.com/', {'status': 201},
+                       StringIO('newer'))
+        entry = self.cache.get('k')
+        self.assertEqual(entry.response['status'], 201)
+        self.assertEqual(entry.open().read(), 'newer')
+        self.assertEqual(len(self.cache), 1)
+    
+    def testEnumerate(self):
+        """Test listing, sizing and deleting entries"""
+        self.cache.put('a', 'http://example.com/a', {}, StringIO('12'))
+        self.cache.put('b', 'http://example.com/b', {}, StringIO('345'))
+        self.assertEqual(sorted(self.cache.keys()), ['a', 'b'])
+        self.assertEqual(self.cache.size(), 5)
+        self.cache.delete('a')
+        self.assertEqual(self.cache.keys(), ['b'])
+        self.assertEqual(self.cache.get('a'), None)
+    
+    def testReopen(self):
+        """Test that entries persist in the directory"""
+        self.cache.put('k', 'http://example.com/', {'status': 200},
+                       StringIO('body'))
+        entry = DiskCache(self.cache_dir).get('k')
+        self.assertEqual(entry.open().read(), 'body')
+
+class TestMappedBody(unittest.TestCase):
+    
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = DiskCache(self.cache_dir)
+    
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+    
+    def testRead(self):
+        """Test reading a memory-mapped body"""
+        self.cache.put('k', 'http://example.com/', {},
+                       StringIO('line 1\nline 2'))
+        with self.cache.get('k').open_mapped() as body:
+            self.assertTrue(isinstance(body, MappedBody))
+            self.assertEqual(len(body), 13)
+            self.assertEqual(body.read(4), 'line')
+            self.assertEqual(body.read(), ' 1\nline 2')
+            self.assertEqual(body.read(), '')
+            body.seek(0)
+            self.assertEqual(list(body), ['line 1\n', 'line 2'])
+            self.assertEqual(body.getvalue(), 'line 1\nline 2')
+            self.assertEqual(str(body.getbuffer()[5:8]), '1\nl')
+    
+    def testEmpty(self):
+        self.cache.put('k', 'http://example.com/', {}, StringIO(''))
+        body = self.cache.get('k').open_mapped()
+        self.assertEqual(body.read(), '')
+        self.assertEqual(body.getvalue(), '')
+        body.close()
+    
+    def testReplaced(self):
+        """Test that a mapped body survives the entry being replaced"""
+        self.cache.put('k', 'http://example.com/', {}, StringIO('old'))
+        body = self.cache.get('k').open_mapped()
+        self.cache.put('k', 'http://example.com/', {}, StringIO('new!'))
+        self.assertEqual(body.getvalue(), 'old')
+        body.close()
+        self.assertEqual(self.cache.get('k').open_mapped().getvalue(), 'new!')
+
+class TestMemoryCache(unittest.TestCase):
+    
+    def testLRUByCount(self):
+        """Test that the least recently used entry is evicted first"""
+        cache = MemoryCache(max_entries=2)
+        cache.put('a', 'http://example.com/a', {}, StringIO('a'))
+        cache.put('b', 'http://example.com/b', {}, StringIO('b'))
+        cache.get('a')
+        cache.put('c', 'http://example.com/c', {}, StringIO('c'))
+        self.assertEqual(sorted(cache.keys()), ['a', 'c'])
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 0})
+    
+    def testLRUBySize(self):
+        """Test that entries are evicted to stay within max_bytes"""
+        cache = MemoryCache(max_bytes=10)
+        cache.put('a', 'http://example.com/a', {}, StringIO('12345'))
+        cache.put('b', 'http://example.com/b', {}, StringIO('123456'))
+        self.assertEqual(cache.keys(), ['b'])
+        self.assertEqual(cache.size(), 6)
+        cache.put('c', 'http://example.com/c', {}, StringIO('x' * 11))
+        self.assertEqual(cache.keys(), ['b'])
+    
+    def testWriter(self):
+        """Test the default writer, which buffers the body for put"""
+        cache = MemoryCache()
+        writer = cache.writer('a')
+        writer.write('body')
+        writer.commit('http://example.com/a', {}, 1000.0)
+        self.assertEqual(cache.get('a').open().read(), 'body')
+        self.assertEqual(cache.get('a').expires, 1000.0)
+    
+    def testResponseCopied(self):
+        """Test that changing a returned response doesn't change the cache"""
+        cache = MemoryCache()
+        cache.put('a', 'http://example.com/a', {'status': 200}, StringIO(''))
+        cache.get('a').response['status'] = 304
+        self.assertEqual(cache.get('a').response['status'], 200)
+
+class TestTieredCache(unittest.TestCase):
+    
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.disk = DiskCache(self.cache_dir)
+    
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+    
+    def testMemoryHit(self):
+        """Test that stored entries are served from memory"""
+        cache = TieredCache(MemoryCache(), self.disk)
+        cache.put('a', 'http://example.com/a', {'status': 200},
+                  StringIO('body'))
+        self.assertEqual(cache.get('a').open().read(), 'body')
+        self.assertEqual(self.disk.stats(), {'hits': 0, 'misses': 0})
+        self.assertEqual(cache.stats()['memory'], {'hits': 1, 'misses': 0})
+    
+    def testPromotion(self):
+        """Test that entries found on disk are copied into memory"""
+        self.disk.put('a', 'http://example.com/a', {'status': 200},
+                      StringIO('body'))
+        cache = TieredCache(MemoryCache(), self.disk)
+        self.assertEqual(cache.get('a').open().read(), 'body')
+        self.assertEqual(cache.get('a').open().read(), 'body')
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['memory'], {'hits': 1, 'misses': 1})
+        self.assertEqual(stats['backing'], {'hits': 1, 'misses': 0})
+    
+    def testLookup(self):
+        """Test that lookups served from memory don't read the index"""
+        cache = TieredCache(MemoryCache(), self.disk)
+        cache.put('a', 'http://example.com/a', {'status': 200},
+                  StringIO('plain'))
+        key = cache.response_key('b', {'Accept': 'a/b'},
+                                 {'vary': 'Accept'})
+        self.disk.put(key, 'http://example.com/b', {'status': 200},
+                      StringIO('varied'))
+        cache.memory.set_vary('b', None)
+        # Found on disk, and copied into memory along with its Vary header.
+        self.assertEqual(cache.lookup('b', {'Accept': 'a/b'})[0], key)
+        connections = []
+        connection = self.disk._connection
+        def counting_connection():
+            connections.append(1)
+            return connection()
+        self.disk._connection = counting_connection
+        for i in range(5):
+            request_key, entry = cache.lookup('a', {})
+            self.assertEqual((request_key, entry.open().read()),
+                             ('a', 'plain'))
+            request_key, entry = cache.lookup('b', {'Accept': 'a/b'})
+            self.assertEqual((request_key, entry.open().read()),
+                             (key, 'varied'))
+        self.assertEqual(connections, [], 'Index read for memory hits.')
+        self.assertEqual(cache.stats()['hits'], 11)
+    
+    def testLargeBody(self):
+        """Test that bodies too large for memory only go to disk"""
+        cache = TieredCache(MemoryCache(max_bytes=3), self.disk)
+        cache.put('a', 'http://example.com/a', {}, StringIO('body'))
+        self.assertEqual(cache.memory.keys(), [])
+        self.assertEqual(cache.get('a').open().read(), 'body')
+    
+    def testWriter(self):
+        """Test that a writer stores in both tiers, or only on disk if the
+        body grows too large for memory"""
+        cache = TieredCache(MemoryCache(max_bytes=6), self.disk)
+        cache.put('a', 'http://example.com/a', {}, StringIO('old'))
+        writer = cache.writer('a')
+        writer.write('body')
+        writer.commit('http://example.com/a', {})
+        self.assertEqual(cache.memory.get('a').open().read(), 'body')
+        writer = cache.writer('a')
+        writer.write('body')
+        writer.write('body')
+        writer.commit('http://example.com/a', {})
+        self.assertEqual(cache.memory.keys(), [])
+        self.assertEqual(cache.get('a').open().read(), 'bodybody')
@@ -5,11 +5,16 @@ import unittest
 import BaseHTTPServer
 import threading
 import tempfile
+import time
+import zlib
 
 import pycurl
 
 from friendly_curl import CurlHTTPConnection
 from friendly_curl import CurlHTTPResponse
+from friendly_curl import CurlHandlePool
+from friendly_curl import RequestHook
+from friendly_curl import threadCURLSingleton
 
 try:
     import httplib2
@@ -400,6 +405,230 @@ class TestCurlHTTPConnection(unittest.TestCase):
                  'Incorrect path on server.')
             thread.join()
     
+    def testSharedGet(self):
+        """Test a basic get request attached to the process-wide share"""
+        con = CurlHTTPConnection('127.0.0.1', 6110)
+        con.share = True
+        class TestRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+            test_object = self
+            
+            def do_GET(self):
+                self.test_object.request_handler = self
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html')
+                self.end_headers()
+                self.wfile.write('This is a test line.\n')
+
+        started = threading.Event()
+        def test_thread():
+            server = BaseHTTPServer.HTTPServer(('', 6110), TestRequestHandler)
+            started.set()
+            server.handle_request()
+            server.server_close()
+        
+        thread = threading.Thread(target=test_thread)
+        thread.start()
+        started.wait()
+        
+        con.request('GET', '/index.html')
+        resp = con.getresponse()
+        self.assertEqual(resp.status, 200, 'Unexpected HTTP status.')
+        self.assertEqual(resp.read(), 'This is a test line.\n',
+                         'Incorrect content returned by server.')
+        thread.join()
+    
+    def testCompressedGet(self):
+        """Test a get request whose gzipped response is decoded by libcurl"""
+        con = CurlHTTPConnection('127.0.0.1', 6110)
+        con.compressed = True
+        class TestRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+            test_object = self
+            
+            def do_GET(self):
+                self.test_object.request_handler = self
+                compressor = zlib.compressobj(6, zlib.DEFLATED,
+                                              16 + zlib.MAX_WBITS)
+                body = compressor.compress('This is a test line.\n') + \
+                       compressor.flush()
+                self.send_response(200)
+                self.send_header('Content-Encoding', 'gzip')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        started = threading.Event()
+        def test_thread():
+            server = BaseHTTPServer.HTTPServer(('', 6110), TestRequestHandler)
+            started.set()
+            server.handle_request()
+            server.server_close()
+        
+        thread = threading.Thread(target=test_thread)
+        thread.start()
+        started.wait()
+        
+        # As sent by httplib2, which would otherwise decode the body itself.
+        con.request('GET', '/index.html', headers={'accept-encoding': 'gzip'})
+        resp = con.getresponse()
+        self.assertEqual(resp.status, 200, 'Unexpected HTTP status.')
+        self.assertEqual(resp.getheader('content-encoding'), None)
+        self.assertEqual(resp.read(), 'This is a test line.\n',
+                         'Incorrect content returned by server.')
+        self.assert_('deflate' in
+                     self.request_handler.headers['accept-encoding'],
+                     'libcurl did not ask for every encoding it supports.')
+        thread.join()
+    
+    def testInterleavedGet(self):
+        """Test using the thread's FriendlyCURL while a body is unread"""
+        con = CurlHTTPConnection('127.0.0.1', 6110)
+        class TestRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.end_headers()
+                if self.path == '/slow':
+                    self.wfile.flush()
+                    time.sleep(0.2)
+                self.wfile.write('Body of %s\n' % self.path)
+
+        started = threading.Event()
+        def test_thread():
+            server = BaseHTTPServer.HTTPServer(('', 6110), TestRequestHandler)
+            started.set()
+            for i in range(3):
+                server.handle_request()
+            server.server_close()
+        
+        thread = threading.Thread(target=test_thread)
+        thread.start()
+        started.wait()
+        
+        con.request('GET', '/first')
+        resp = con.getresponse()
+        other, content = threadCURLSingleton().get_url(
+            'http://127.0.0.1:6110/other')
+        self.assertEqual(content.getvalue(), 'Body of /other\n')
+        self.assertEqual(resp.read(), 'Body of /first\n',
+                         'Unread body was disturbed by another request.')
+        # Closing a response with its body unread makes reading it an error.
+        con.request('GET', '/slow')
+        resp = con.getresponse()
+        resp.close()
+        thread.join()
+        self.assertRaises(ValueError, resp.read)
+    
+    def testPooledGet(self):
+        """Test a basic get request using a handle from a CurlHandlePool"""
+        con = CurlHTTPConnection('127.0.0.1', 6110)
+        con.pool = CurlHandlePool(max_size=1)
+        class TestRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+            test_object = self
+            
+            def do_GET(self):
+                self.test_object.request_handler = self
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html')
+                self.end_headers()
+                self.wfile.write('This is a test line.\n')
+
+        started = threading.Event()
+        def test_thread():
+            server = BaseHTTPServer.HTTPServer(('', 6110), TestRequestHandler)
+            started.set()
+            server.handle_request()
+            server.server_close()
+        
+        thread = threading.Thread(target=test_thread)
+        thread.start()
+        started.wait()
+        
+        con.request('GET', '/index.html')
+        self.assertEqual(con.pool.stats()['in_use'], 1)
+        resp = con.getresponse()
+        self.assertEqual(resp.status, 200, 'Unexpected HTTP status.')
+        self.assertEqual(resp.read(), 'This is a test line.\n',
+                         'Incorrect content returned by server.')
+        self.assertEqual(con.pool.stats()['in_use'], 0,
+                         'Handle not returned to the pool.')
+        thread.join()
+    
+    def testOwnHandle(self):
+        """Test configuring and closing a connection's own handle"""
+        con = CurlHTTPConnection('127.0.0.1', 6110)
+        class TestRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+            test_object = self
+            
+            def do_GET(self):
+                self.test_object.request_handler = self
+                self.send_response(200)
+                self.end_headers()
+                self.wfile.write('This is a test line.\n')
+        
+        class HeaderHook(RequestHook):
+            def before_request(self, fcurl, url, headers):
+                headers['X-Hooked'] = 'yes'
+        con.fcurl_kwargs = {'hooks': [HeaderHook()]}
+        
+        started = threading.Event()
+        def test_thread():
+            server = BaseHTTPServer.HTTPServer(('', 6110), TestRequestHandler)
+            started.set()
+            server.handle_request()
+            server.server_close()
+        
+        thread = threading.Thread(target=test_thread)
+        thread.start()
+        started.wait()
+        
+        con.request('GET', '/index.html')
+        resp = con.getresponse()
+        self.assertEqual(resp.read(), 'This is a test line.\n')
+        thread.join()
+        self.assertEqual(self.request_handler.headers['x-hooked'], 'yes',
+                         'fcurl_kwargs not used.')
+        handle = con.fcurl.curl_handle
+        con.close()
+        self.assertRaises(pycurl.error, handle.setopt, pycurl.URL,
+                          'http://127.0.0.1:6110/')
+    
+    def testResponseBeforeBody(self):
+        """Test that getresponse returns before the body has arrived"""
+        con = CurlHTTPConnection('127.0.0.1', 6110)
+        proceed = threading.Event()
+        class TestRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+            test_object = self
+            
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html')
+                self.end_headers()
+                self.wfile.write('This is a test line.\n')
+                self.wfile.flush()
+                proceed.wait()
+                self.wfile.write('This is another test line.\n')
+
+        started = threading.Event()
+        def test_thread():
+            server = BaseHTTPServer.HTTPServer(('', 6110), TestRequestHandler)
+            started.set()
+            server.handle_request()
+            server.server_close()
+        
+        thread = threading.Thread(target=test_thread)
+        thread.start()
+        started.wait()
+        
+        con.request('GET', '/index.html')
+        resp = con.getresponse()
+        self.assertEqual(resp.status, 200, 'Unexpected HTTP status.')
+        self.assertEqual(resp.getheader('content-type'), 'text/html',
+                         'Unexpected Content-Type from server.')
+        self.assertEqual(resp.read(10), 'This is a ')
+        proceed.set()
+        self.assertEqual(resp.read(), 'test line.\nThis is another test line.\n',
+                         'Incorrect content returned by server.')
+        thread.join()
+    
     def testSuccessfulGetWithUnicodeUri(self):
         """Test a basic get request with a unicode object passed to con.request."""
         con = CurlHTTPConnection('127.0.0.1', 6110)
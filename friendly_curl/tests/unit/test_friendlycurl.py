@@ -4,12 +4,19 @@
 import BaseHTTPServer
 from cStringIO import StringIO
 import os
+import shutil
 import tempfile
 import threading
+import time
 import unittest
+import zlib
 
 import pycurl
 
+from friendly_curl.cache import DiskCache, MappedBody, MemoryCache, \
+     TieredCache
+from friendly_curl.metrics import MetricsRegistry
+from friendly_curl.tracing import Tracer
 import friendly_curl.friendly_curl as friendly_curl
 
 class TestUrlParameters(unittest.TestCase):
@@ -21,16 +28,10 @@ class TestUrlParameters(unittest.TestCase):
 class TestFriendlyCURL(unittest.TestCase):
     def setUp(self):
         self.fcurl = friendly_curl.FriendlyCURL()
+        self.cache_dir = tempfile.mkdtemp()
         
     def tearDown(self):
-        try:
-            os.unlink(os.path.join(self.fcurl.cache_dir, '%s.response' % hash('http://127.0.0.1:6110/index.html')))
-        except:
-            pass
-        try:
-            os.unlink(os.path.join(self.fcurl.cache_dir, '%s.body' % hash('http://127.0.0.1:6110/index.html')))
-        except:
-            pass
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
     
     def testSuccessfulGet(self):
         """Test a basic get request"""
@@ -65,6 +66,142 @@ class TestFriendlyCURL(unittest.TestCase):
                          'Incorrect path on server.')
         thread.join()
     
+    def testMetrics(self):
+        """Test that requests are counted in the metrics registry"""
+        class TestRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Cache-Control', 'max-age=60')
+                self.end_headers()
+                self.wfile.write('This is a test line.\n')
+        
+        started = threading.Event()
+        def test_thread():
+            server = BaseHTTPServer.HTTPServer(('', 6110), TestRequestHandler)
+            started.set()
+            server.handle_request()
+            server.server_close()
+        
+        thread = threading.Thread(target=test_thread)
+        thread.start()
+        started.wait()
+        
+        registry = MetricsRegistry()
+        fcurl = friendly_curl.FriendlyCURL(cache=MemoryCache(),
+                                           metrics=registry)
+        fcurl.get_url('http://127.0.0.1:6110/index.html')
+        fcurl.get_url('http://127.0.0.1:6110/index.html')
+        thread.join()
+        snapshot = registry.snapshot()
+        host = ('host', '127.0.0.1:6110')
+        self.assertEqual(snapshot[('friendly_curl_requests_total',
+                                   (host, ('method', 'GET'),
+                                    ('status', '2xx')))], 1)
+        self.assertEqual(snapshot[('friendly_curl_request_seconds',
+                                   (host, ('method', 'GET')))]['count'], 1)
+        self.assertEqual(snapshot[('friendly_curl_received_bytes_total',
+                                   (host,))], 21)
+        self.assertEqual(snapshot[('friendly_curl_cache_total',
+                                   (('result', 'miss'),))], 1)
+        self.assertEqual(snapshot[('friendly_curl_cache_total',
+                                   (('result', 'hit'),))], 1)
+    
+    def testTracing(self):
+        """Test that sampled requests are traced"""
+        class TestRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.end_headers()
+                self.wfile.write('This is a test line.\n')
+        
+        started = threading.Event()
+        def test_thread():
+            server = BaseHTTPServer.HTTPServer(('', 6110), TestRequestHandler)
+            started.set()
+            server.handle_request()
+            server.handle_request()
+            server.server_close()
+        
+        thread = threading.Thread(target=test_thread)
+        thread.start()
+        started.wait()
+        
+        tracer = Tracer(sample_rate=0)
+        fcurl = friendly_curl.FriendlyCURL(tracer=tracer)
+        fcurl.get_url('http://127.0.0.1:6110/skipped')
+        fcurl.get_url('http://127.0.0.1:6110/traced', trace=True)
+        thread.join()
+        traces = tracer.traces()
+        self.assertEqual(len(traces), 1, 'Unsampled request was traced.')
+        trace = traces[0]
+        self.assertEqual((trace.method, trace.url, trace.status),
+                         ('GET', 'http://127.0.0.1:6110/traced', 200))
+        kinds = [kind for seconds, kind, data in trace.events]
+        self.assert_('header_out' in kinds and 'header_in' in kinds, kinds)
+        self.assertEqual(trace.bytes_in, 21)
+        self.assertEqual(trace.timings.effective_url,
+                         'http://127.0.0.1:6110/traced')
+    
+    def testTimingsAndHooks(self):
+        """Test that requests run hooks and report their timings"""
+        class TestRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+            test_object = self
+            
+            def do_GET(self):
+                self.test_object.request_handler = self
+                self.send_response(200)
+                self.end_headers()
+                self.wfile.write('This is a test line.\n')
+        
+        calls = []
+        class RecordingHook(friendly_curl.RequestHook):
+            def before_request(self, fcurl, url, headers):
+                calls.append(('before', url))
+                headers['X-Traced'] = 'yes'
+            
+            def after_request(self, fcurl, url, result):
+                calls.append(('after', url, result))
+        
+        class BrokenHook(friendly_curl.RequestHook):
+            def after_request(self, fcurl, url, result):
+                raise ValueError('Broken hook')
+        
+        started = threading.Event()
+        def test_thread():
+            server = BaseHTTPServer.HTTPServer(('', 6110), TestRequestHandler)
+            started.set()
+            server.handle_request()
+            server.server_close()
+        
+        thread = threading.Thread(target=test_thread)
+        thread.start()
+        started.wait()
+        
+        fcurl = friendly_curl.FriendlyCURL(hooks=[BrokenHook(),
+                                                  RecordingHook()])
+        result = fcurl.get_url('http://127.0.0.1:6110/index.html')
+        thread.join()
+        self.assertEqual(self.request_handler.headers['x-traced'], 'yes',
+                         'Hook did not add a header.')
+        self.assertEqual(calls, [
+            ('before', 'http://127.0.0.1:6110/index.html'),
+            ('after', 'http://127.0.0.1:6110/index.html', result)])
+        timings = result.timings
+        self.assertEqual(timings.effective_url,
+                         'http://127.0.0.1:6110/index.html')
+        self.assertEqual(timings.num_connects, 1)
+        self.assertEqual(timings.size_download, 21)
+        self.assert_(0 <= timings.connect <= timings.starttransfer <=
+                     timings.total)
+        
+        # Nothing is listening now.
+        del calls[:]
+        self.assertRaises(pycurl.error, fcurl.get_url,
+                          'http://127.0.0.1:6110/index.html')
+        self.assertEqual(len(calls), 2)
+        self.assert_(isinstance(calls[1][2], pycurl.error))
+        fcurl.close()
+    
     def testSuccessfulGetIRI(self):
         """Test a basic get request with an IRI"""
         class TestRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
@@ -418,12 +555,17 @@ class TestFriendlyCURL(unittest.TestCase):
         
         # Do this here so test_thread sees it after it drops out of
         #  handle_request after curl makes its request.
-        resp, content = self.fcurl.get_url('http://127.0.0.1:6110/index.html',
-                                           follow_location=True)
+        result = self.fcurl.get_url('http://127.0.0.1:6110/index.html',
+                                    follow_location=True, keep_history=True)
+        resp, content = result
         self.assertEqual(resp['status'], 200, 'Unexpected HTTP status.')
         self.assertEqual(resp['content-type'], 'text/html',
                          'Unexpected Content-Type from server.')
-        self.assertEqual(resp['location'], 'http://127.0.0.1:6110/foo.html',
+        self.assertFalse('location' in resp,
+                         'Headers of the redirect returned.')
+        self.assertEqual([hop['status'] for hop in result.history], [302])
+        self.assertEqual(result.history[0]['Location'],
+                         'http://127.0.0.1:6110/foo.html',
                          'Unexpected location from server.')
         self.assertEqual(content.getvalue(), 'This is a test line.\n',
                          'Incorrect content returned by server.')
@@ -433,6 +575,118 @@ class TestFriendlyCURL(unittest.TestCase):
                          'Incorrect path on server.')
         thread.join()
     
+    def testCompressed(self):
+        """Test that compressed responses are decoded as they arrive"""
+        self.accept_encodings = []
+        class TestRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+            test_object = self
+            
+            def do_GET(self):
+                self.test_object.accept_encodings.append(
+                    self.headers.get('accept-encoding'))
+                body = zlib.compress('This is a test line.\n' * 100)
+                self.send_response(200)
+                self.send_header('Content-Encoding', 'deflate')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+        
+        started = threading.Event()
+        def test_thread():
+            server = BaseHTTPServer.HTTPServer(('', 6110), TestRequestHandler)
+            started.set()
+            for i in range(3):
+                server.handle_request()
+            server.server_close()
+        
+        thread = threading.Thread(target=test_thread)
+        thread.start()
+        started.wait()
+        
+        fcurl = friendly_curl.FriendlyCURL(compressed=True)
+        resp, content = fcurl.get_url('http://127.0.0.1:6110/index.html')
+        self.assertEqual(content.getvalue(), 'This is a test line.\n' * 100,
+                         'Body was not decoded.')
+        self.assertEqual(resp['-content-encoding'], 'deflate')
+        self.assert_('content-encoding' not in resp)
+        self.assert_('content-length' not in resp)
+        stream = fcurl.stream_url('http://127.0.0.1:6110/index.html')
+        self.assertEqual(stream.read(), 'This is a test line.\n' * 100,
+                         'Streamed body was not decoded.')
+        self.assertEqual(stream.response['-content-encoding'], 'deflate')
+        # Callers asking for an encoding themselves get what was sent.
+        resp, content = fcurl.get_url('http://127.0.0.1:6110/index.html',
+                                      {'Accept-Encoding': 'deflate'})
+        thread.join()
+        self.assertEqual(resp['content-encoding'], 'deflate')
+        self.assertEqual(zlib.decompress(content.getvalue()),
+                         'This is a test line.\n' * 100)
+        self.assert_('deflate' in self.accept_encodings[0])
+        self.assert_('gzip' in self.accept_encodings[0])
+        self.assertEqual(self.accept_encodings[2], 'deflate')
+    
+    def testCacheEncoded(self):
+        """Test that cache_encoded stores bodies as they were sent"""
+        def gzipped(data):
+            compressor = zlib.compressobj(6, zlib.DEFLATED,
+                                          16 + zlib.MAX_WBITS)
+            return compressor.compress(data) + compressor.flush()
+        def raw_deflated(data):
+            compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+            return compressor.compress(data) + compressor.flush()
+        encoders = {'/gzip': ('gzip', gzipped),
+                    '/deflate': ('deflate', raw_deflated)}
+        class TestRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                encoding, encode = encoders[self.path]
+                body = encode('This is a test line.\n' * 100)
+                self.send_response(200)
+                self.send_header('Cache-Control', 'max-age=60')
+                self.send_header('Content-Encoding', encoding)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+        
+        started = threading.Event()
+        def test_thread():
+            server = BaseHTTPServer.HTTPServer(('', 6110), TestRequestHandler)
+            started.set()
+            server.handle_request()
+            server.handle_request()
+            server.server_close()
+        
+        thread = threading.Thread(target=test_thread)
+        thread.start()
+        started.wait()
+        
+        cache = DiskCache(self.cache_dir)
+        fcurl = friendly_curl.FriendlyCURL(cache=cache, compressed=True,
+                                           cache_encoded=True)
+        # The same headers are passed each time, and must be left alone.
+        headers = {'User-Agent': 'friendly_curl'}
+        for path, (encoding, encode) in sorted(encoders.items()):
+            url = 'http://127.0.0.1:6110' + path
+            for i in range(2):
+                resp, content = fcurl.get_url(url, headers)
+                self.assertEqual(content.getvalue(),
+                                 'This is a test line.\n' * 100,
+                                 'Body was not decoded.')
+                self.assertEqual(resp['-content-encoding'], encoding)
+                self.assert_('content-encoding' not in resp)
+            entry = cache.get(cache.key_for(url))
+            self.assertEqual(entry.response['content-encoding'], encoding)
+            body = entry.open()
+            self.assertEqual(body.read(), encode('This is a test line.\n'
+                                                 * 100),
+                             'Body was not cached as it was sent.')
+            body.close()
+        thread.join()
+        self.assertEqual(headers, {'User-Agent': 'friendly_curl'},
+                         'Request headers were changed.')
+        resp, content = fcurl.get_url('http://127.0.0.1:6110/gzip',
+                                      mmap_cached=True)
+        self.assertEqual(content.getvalue(), 'This is a test line.\n' * 100)
+    
     def testCachedGet(self):
         """Test a basic get request whose result has been cached"""
         self.num_handled = 0
@@ -452,6 +706,7 @@ class TestFriendlyCURL(unittest.TestCase):
                 elif self.test_object.num_handled == 1:
                     self.test_object.request_handler = self
                     self.send_response(304)
+                    self.send_header('Date', 'Tue, 01 Dec 2009 19:59:28 GMT')
                     self.send_header('ETag', 'notreallyanetag')
                     self.end_headers()
                     self.test_object.num_handled += 1
@@ -468,7 +723,7 @@ class TestFriendlyCURL(unittest.TestCase):
         thread.start()
         started.wait()
         
-        self.fcurl.cache_dir = '.'
+        self.fcurl.cache_dir = self.cache_dir
         resp, content = self.fcurl.get_url('http://127.0.0.1:6110/index.html')
         self.assertEqual(resp['status'], 200, 'Unexpected HTTP status.')
         self.assertEqual(resp['content-type'], 'text/html',
@@ -483,8 +738,381 @@ class TestFriendlyCURL(unittest.TestCase):
         self.assertEqual(resp2['status'], 200, 'Unexpected HTTP status.')
         self.assertEqual(content2.getvalue(), 'This is a test line.\n',
                          'Incorrect content returned by server.')
-        self.assertEqual(resp2['date'], 'Tue, 01 Dec 2009 18:59:28 GMT',
-                         'Unexpected Content-Type from server.')
+        self.assertEqual(resp2['date'], 'Tue, 01 Dec 2009 19:59:28 GMT',
+                         'Date not updated from the 304.')
+        thread.join()
+    
+    def testCachedGetLastModified(self):
+        """Test revalidating a cached response that only has Last-Modified"""
+        self.num_handled = 0
+        class TestRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+            test_object = self
+            
+            def do_GET(self):
+                if self.test_object.num_handled == 0:
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/html')
+                    self.send_header('Last-Modified',
+                                     'Tue, 01 Dec 2009 18:59:28 GMT')
+                    self.send_header('X-Revision', '1')
+                    self.end_headers()
+                    self.wfile.write('This is a test line.\n')
+                else:
+                    self.test_object.request_handler = self
+                    self.send_response(304)
+                    self.send_header('X-Revision', '2')
+                    self.end_headers()
+                self.test_object.num_handled += 1
+        
+        started = threading.Event()
+        def test_thread():
+            server = BaseHTTPServer.HTTPServer(('', 6110), TestRequestHandler)
+            started.set()
+            for i in range(4):
+                server.handle_request()
+            server.server_close()
+        
+        thread = threading.Thread(target=test_thread)
+        thread.start()
+        started.wait()
+        
+        self.fcurl.cache_dir = self.cache_dir
+        headers = {'User-Agent': 'friendly_curl'}
+        self.fcurl.get_url('http://127.0.0.1:6110/index.html', headers)
+        for revision in range(2):
+            resp, content = self.fcurl.get_url(
+                'http://127.0.0.1:6110/index.html', headers)
+            self.assertEqual(
+                self.request_handler.headers['if-modified-since'],
+                'Tue, 01 Dec 2009 18:59:28 GMT', 'Request not conditional.')
+            self.assertEqual(resp['status'], 200, 'Unexpected HTTP status.')
+            self.assertEqual(resp['content-type'], 'text/html')
+            self.assertEqual(resp['x-revision'], '2',
+                             'Headers not updated from the 304.')
+            self.assertEqual(content.getvalue(), 'This is a test line.\n',
+                             'Incorrect content returned from cache.')
+        self.assertEqual(self.fcurl.cache.get(self.fcurl.cache.key_for(
+            'http://127.0.0.1:6110/index.html')).response['x-revision'], '2')
+        # Another URL fetched with the same headers isn't conditional, and a
+        # 304 for it anyway isn't stored.
+        resp, content = self.fcurl.get_url('http://127.0.0.1:6110/other.html',
+                                           headers)
+        thread.join()
+        self.assert_('if-modified-since' not in self.request_handler.headers,
+                     'Validators leaked into another request.')
+        self.assertEqual(resp['status'], 304)
+        self.assertEqual(self.fcurl.cache.get(self.fcurl.cache.key_for(
+            'http://127.0.0.1:6110/other.html')), None, '304 was cached.')
+    
+    def testCoalescedGets(self):
+        """Test that concurrent gets for one URL make a single request"""
+        self.num_handled = 0
+        class TestRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+            test_object = self
+            
+            def do_GET(self):
+                # Give the other threads time to pile up.
+                time.sleep(0.5)
+                self.send_response(200)
+                self.send_header('ETag', 'notreallyanetag')
+                self.end_headers()
+                self.wfile.write('This is a test line.\n')
+                self.test_object.num_handled += 1
+        
+        started = threading.Event()
+        def test_thread():
+            server = BaseHTTPServer.HTTPServer(('', 6110), TestRequestHandler)
+            server.timeout = 2
+            started.set()
+            server.handle_request()
+            server.server_close()
+        
+        thread = threading.Thread(target=test_thread)
+        thread.start()
+        started.wait()
+        
+        results = []
+        def get():
+            # Each thread has its own FriendlyCURL and DiskCache object.
+            fcurl = friendly_curl.FriendlyCURL()
+            fcurl.cache_dir = self.cache_dir
+            resp, content = fcurl.get_url('http://127.0.0.1:6110/index.html')
+            results.append((resp['status'], content.getvalue()))
+            fcurl.close()
+        getters = [threading.Thread(target=get) for i in range(4)]
+        for getter in getters:
+            getter.start()
+        for getter in getters:
+            getter.join()
+        thread.join()
+        self.assertEqual(self.num_handled, 1, 'Requests not coalesced.')
+        self.assertEqual(results, [(200, 'This is a test line.\n')] * 4)
+    
+    def testVary(self):
+        """Test caching a variant of a response for each Accept-Language"""
+        self.num_handled = 0
+        class TestRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+            test_object = self
+            
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Cache-Control', 'max-age=60')
+                self.send_header('Vary', 'Accept-Language')
+                self.end_headers()
+                self.wfile.write(self.headers['accept-language'])
+                self.test_object.num_handled += 1
+        
+        started = threading.Event()
+        def test_thread():
+            server = BaseHTTPServer.HTTPServer(('', 6110), TestRequestHandler)
+            started.set()
+            for i in range(2):
+                server.handle_request()
+            server.server_close()
+        
+        thread = threading.Thread(target=test_thread)
+        thread.start()
+        started.wait()
+        
+        self.fcurl.cache_dir = self.cache_dir
+        for language in ['en', 'fr', 'en', 'fr']:
+            resp, content = self.fcurl.get_url(
+                'http://127.0.0.1:6110/index.html?b=2&a=1#top',
+                {'Accept-Language': language})
+            self.assertEqual(content.getvalue(), language,
+                             'Wrong variant returned.')
+        resp, content = self.fcurl.get_url(
+            'http://127.0.0.1:6110/index.html?a=1&b=2',
+            {'Accept-Language': 'en'})
+        self.assertEqual(content.getvalue(), 'en')
+        thread.join()
+        self.assertEqual(self.num_handled, 2, 'Variants not cached.')
+    
+    def testStaleWhileRevalidate(self):
+        """Test that a stale response is served while it is refreshed"""
+        self.num_handled = 0
+        class TestRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+            test_object = self
+            
+            def do_GET(self):
+                self.send_response(200)
+                if self.test_object.num_handled == 0:
+                    self.send_header('Cache-Control',
+                                     'max-age=0, stale-while-revalidate=60')
+                else:
+                    self.send_header('Cache-Control', 'max-age=3600')
+                self.end_headers()
+                self.wfile.write('Response %d.\n' %
+                                 self.test_object.num_handled)
+                self.test_object.num_handled += 1
+        
+        started = threading.Event()
+        def test_thread():
+            server = BaseHTTPServer.HTTPServer(('', 6110), TestRequestHandler)
+            server.timeout = 5
+            started.set()
+            server.handle_request()
+            server.handle_request()
+            server.server_close()
+        
+        thread = threading.Thread(target=test_thread)
+        thread.start()
+        started.wait()
+        
+        self.fcurl.cache_dir = self.cache_dir
+        url = 'http://127.0.0.1:6110/index.html'
+        resp, content = self.fcurl.get_url(url)
+        self.assertEqual(content.getvalue(), 'Response 0.\n')
+        resp, content = self.fcurl.get_url(url)
+        self.assertEqual(content.getvalue(), 'Response 0.\n',
+                         'Stale response not served.')
+        thread.join()
+        self.assertEqual(self.num_handled, 2, 'Response not refreshed.')
+        key = self.fcurl.cache.key_for(url)
+        for i in range(50):
+            if self.fcurl.cache.get(key).is_fresh():
+                break
+            time.sleep(0.1)
+        resp, content = self.fcurl.get_url(url)
+        self.assertEqual(content.getvalue(), 'Response 1.\n',
+                         'Refreshed response not served.')
+    
+    def testStaleIfError(self):
+        """Test that a stale response is served when the server fails"""
+        self.num_handled = 0
+        class TestRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+            test_object = self
+            
+            def do_GET(self):
+                if self.test_object.num_handled == 0:
+                    self.send_response(200)
+                    self.send_header('Cache-Control',
+                                     'max-age=0, stale-if-error=60')
+                    self.end_headers()
+                    self.wfile.write('This is a test line.\n')
+                else:
+                    self.send_error(503)
+                self.test_object.num_handled += 1
+        
+        started = threading.Event()
+        def test_thread():
+            server = BaseHTTPServer.HTTPServer(('', 6110), TestRequestHandler)
+            started.set()
+            server.handle_request()
+            server.handle_request()
+            server.server_close()
+        
+        thread = threading.Thread(target=test_thread)
+        thread.start()
+        started.wait()
+        
+        self.fcurl.cache_dir = self.cache_dir
+        url = 'http://127.0.0.1:6110/index.html'
+        self.fcurl.get_url(url)
+        resp, content = self.fcurl.get_url(url)
+        self.assertEqual(resp['status'], 200, 'Server error not hidden.')
+        self.assertEqual(content.getvalue(), 'This is a test line.\n')
+        thread.join()
+        # The server is gone now.
+        resp, content = self.fcurl.get_url(url)
+        self.assertEqual(resp['status'], 200, 'Network error not hidden.')
+        self.assertEqual(content.getvalue(), 'This is a test line.\n')
+    
+    def testStaleIfErrorWindowCloses(self):
+        """Test that stale-if-error is decided once per fetch"""
+        class TestRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Cache-Control',
+                                 'max-age=0, stale-if-error=60')
+                self.end_headers()
+                self.wfile.write('This is a test line.\n')
+        
+        started = threading.Event()
+        def test_thread():
+            server = BaseHTTPServer.HTTPServer(('', 6110), TestRequestHandler)
+            started.set()
+            server.handle_request()
+            server.server_close()
+        
+        thread = threading.Thread(target=test_thread)
+        thread.start()
+        started.wait()
+        
+        self.fcurl.cache_dir = self.cache_dir
+        url = 'http://127.0.0.1:6110/index.html'
+        self.fcurl.get_url(url)
+        thread.join()
+        # The window closes while the request is failing.
+        serves_stale = self.fcurl.cache.serves_stale
+        calls = []
+        def closing_serves_stale(entry, directive):
+            if directive == 'stale-if-error':
+                calls.append(directive)
+                if len(calls) > 1:
+                    return False
+            return serves_stale(entry, directive)
+        self.fcurl.cache.serves_stale = closing_serves_stale
+        resp, content = self.fcurl.get_url(url)
+        self.assertEqual(resp['status'], 200, 'Network error not hidden.')
+        self.assertEqual(content.getvalue(), 'This is a test line.\n')
+        del self.fcurl.cache.serves_stale
+        self.assertEqual(len(self.fcurl.cache), 1, 'Stale entry replaced.')
+    
+    def testCachedGetFromMemory(self):
+        """Test a cached get request served by the memory tier"""
+        self.num_handled = 0
+        class TestRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+            test_object = self
+            
+            def do_GET(self):
+                if self.test_object.num_handled == 0:
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/html')
+                    self.send_header('ETag', 'notreallyanetag')
+                    self.end_headers()
+                    self.wfile.write('This is a test line.\n')
+                else:
+                    self.send_response(304)
+                    self.send_header('ETag', 'notreallyanetag')
+                    self.end_headers()
+                self.test_object.num_handled += 1
+        
+        started = threading.Event()
+        def test_thread():
+            server = BaseHTTPServer.HTTPServer(('', 6110), TestRequestHandler)
+            started.set()
+            server.handle_request()
+            server.handle_request()
+            server.server_close()
+        
+        thread = threading.Thread(target=test_thread)
+        thread.start()
+        started.wait()
+        
+        self.fcurl.cache = TieredCache(MemoryCache(), DiskCache(self.cache_dir))
+        resp, content = self.fcurl.get_url('http://127.0.0.1:6110/index.html')
+        self.assertEqual(content.getvalue(), 'This is a test line.\n',
+                         'Incorrect content returned by server.')
+        # The memory tier shouldn't need the disk cache's files.
+        shutil.rmtree(os.path.join(self.cache_dir, 'bodies'))
+        resp2, content2 = self.fcurl.get_url('http://127.0.0.1:6110/index.html')
+        self.assertEqual(resp2['status'], 200, 'Unexpected HTTP status.')
+        self.assertEqual(content2.getvalue(), 'This is a test line.\n',
+                         'Incorrect content returned by server.')
+        self.assertEqual(self.fcurl.cache.stats()['memory'],
+                         {'hits': 1, 'misses': 1})
+        thread.join()
+    
+    def testFreshFromCache(self):
+        """Test that a fresh cached response is used without the server"""
+        self.num_handled = 0
+        class TestRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+            test_object = self
+            
+            def do_GET(self):
+                self.send_response(200)
+                if self.test_object.num_handled == 0:
+                    self.send_header('Cache-Control', 'max-age=3600')
+                else:
+                    self.send_header('Cache-Control', 'no-store')
+                self.end_headers()
+                self.wfile.write('Response %d.\n' %
+                                 self.test_object.num_handled)
+                self.test_object.num_handled += 1
+        
+        started = threading.Event()
+        def test_thread():
+            server = BaseHTTPServer.HTTPServer(('', 6110), TestRequestHandler)
+            started.set()
+            server.handle_request()
+            server.handle_request()
+            server.server_close()
+        
+        thread = threading.Thread(target=test_thread)
+        thread.start()
+        started.wait()
+        
+        self.fcurl.cache_dir = self.cache_dir
+        url = 'http://127.0.0.1:6110/index.html'
+        resp, content = self.fcurl.get_url(url)
+        self.assertEqual(content.getvalue(), 'Response 0.\n')
+        resp, content = self.fcurl.get_url(url)
+        self.assertEqual(resp['status'], 200, 'Unexpected HTTP status.')
+        self.assertEqual(content.getvalue(), 'Response 0.\n',
+                         'Fresh response not served from cache.')
+        self.assertEqual(self.num_handled, 1, 'Server was contacted.')
+        resp, content = self.fcurl.get_url(url, mmap_cached=True)
+        self.assertTrue(isinstance(content, MappedBody),
+                        'Cached body not memory-mapped.')
+        self.assertEqual(content.read(), 'Response 0.\n')
+        content.close()
+        # no-cache in the request forces a trip to the server, and no-store
+        # in the response drops the cached copy.
+        resp, content = self.fcurl.get_url(
+            url, headers={'Cache-Control': 'no-cache'})
+        self.assertEqual(content.getvalue(), 'Response 1.\n')
+        self.assertEqual(len(self.fcurl.cache), 0)
         thread.join()
     
     def testGetChangedFromCache(self):
@@ -525,7 +1153,7 @@ class TestFriendlyCURL(unittest.TestCase):
         thread.start()
         started.wait()
         
-        self.fcurl.cache_dir = '.'
+        self.fcurl.cache_dir = self.cache_dir
         resp, content = self.fcurl.get_url('http://127.0.0.1:6110/index.html')
         self.assertEqual(resp['status'], 200, 'Unexpected HTTP status.')
         self.assertEqual(resp['content-type'], 'text/html',
@@ -543,3 +1171,374 @@ class TestFriendlyCURL(unittest.TestCase):
         self.assertEqual(resp2['date'], 'Tue, 01 Dec 2009 20:59:28 GMT',
                          'Unexpected Content-Type from server.')
         thread.join()
+    
+    def testFetchMany(self):
+        """Test performing several requests concurrently"""
+        class TestRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+            test_object = self
+            
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain')
+                self.end_headers()
+                self.wfile.write('Path: %s' % self.path)
+            
+            def do_DELETE(self):
+                self.send_response(204)
+                self.end_headers()
+        
+        started = threading.Event()
+        def test_thread():
+            server = BaseHTTPServer.HTTPServer(('', 6110), TestRequestHandler)
+            started.set()
+            for i in range(6):
+                server.handle_request()
+            server.server_close()
+        
+        thread = threading.Thread(target=test_thread)
+        thread.start()
+        started.wait()
+        
+        requests = ['http://127.0.0.1:6110/%d' % i for i in range(5)]
+        requests.append({'url': 'http://127.0.0.1:6110/gone',
+                         'method': 'DELETE'})
+        results = self.fcurl.fetch_many(requests, max_concurrency=3)
+        self.assertEqual(len(results), 6)
+        for i, (resp, content) in enumerate(results[:5]):
+            self.assertEqual(resp['status'], 200, 'Unexpected HTTP status.')
+            self.assertEqual(content.getvalue(), 'Path: /%d' % i,
+                             'Results returned out of order.')
+        self.assertEqual(results[5][0]['status'], 204)
+        thread.join()
+    
+    def testFetchManyError(self):
+        """Test that a failed request in a batch is returned, not raised"""
+        results = self.fcurl.fetch_many(['http://127.0.0.1:6111/'])
+        self.assert_(isinstance(results[0], pycurl.error))
+    
+    def testFetchManyConcurrency(self):
+        """Test that fewer than one transfer at a time is refused"""
+        for max_concurrency in (0, -1):
+            self.assertRaises(ValueError, self.fcurl.fetch_many,
+                              ['http://127.0.0.1:6111/'], max_concurrency)
+            self.assertRaises(ValueError, self.fcurl.iter_fetch,
+                              ['http://127.0.0.1:6111/'], max_concurrency)
+    
+    def testKeepAlive(self):
+        """Test that keep_alive reuses a connection across requests"""
+        self.clients = []
+        class TestRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+            test_object = self
+            protocol_version = 'HTTP/1.1'
+            
+            def do_GET(self):
+                self.test_object.clients.append(self.client_address)
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html')
+                self.send_header('Content-Length', '21')
+                self.end_headers()
+                self.wfile.write('This is a test line.\n')
+        
+        started = threading.Event()
+        def test_thread():
+            server = BaseHTTPServer.HTTPServer(('', 6110), TestRequestHandler)
+            started.set()
+            while len(self.clients) < 2:
+                server.handle_request()
+            server.server_close()
+        
+        thread = threading.Thread(target=test_thread)
+        thread.start()
+        started.wait()
+        
+        fcurl = friendly_curl.FriendlyCURL(keep_alive=True, max_idle_time=60)
+        resp, content = fcurl.get_url('http://127.0.0.1:6110/index.html')
+        self.assertEqual(resp['status'], 200, 'Unexpected HTTP status.')
+        resp, content = fcurl.get_url('http://127.0.0.1:6110/index.html')
+        self.assertEqual(content.getvalue(), 'This is a test line.\n',
+                         'Incorrect content returned by server.')
+        # Closing the handle closes the connection the server is waiting on.
+        fcurl.close()
+        thread.join()
+        self.assertEqual(self.clients[0], self.clients[1],
+                         'Connection was not reused.')
+    
+    def testShare(self):
+        """Test requests from several threads through the process-wide share"""
+        class TestRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+            test_object = self
+            
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html')
+                self.end_headers()
+                self.wfile.write('This is a test line.\n')
+        
+        started = threading.Event()
+        def test_thread():
+            server = BaseHTTPServer.HTTPServer(('', 6110), TestRequestHandler)
+            started.set()
+            server.handle_request()
+            server.handle_request()
+            server.server_close()
+        
+        thread = threading.Thread(target=test_thread)
+        thread.start()
+        started.wait()
+        
+        results = {}
+        def client_thread(name):
+            fcurl = friendly_curl.FriendlyCURL(share=True)
+            results[name] = (fcurl.share,
+                             fcurl.get_url('http://127.0.0.1:6110/index.html'))
+        clients = [threading.Thread(target=client_thread, args=(name,))
+                   for name in ('a', 'b')]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        thread.join()
+        self.assert_(results['a'][0] is friendly_curl.curl_share())
+        self.assert_(results['b'][0] is friendly_curl.curl_share())
+        for share, (resp, content) in results.values():
+            self.assertEqual(resp['status'], 200, 'Unexpected HTTP status.')
+            self.assertEqual(content.getvalue(), 'This is a test line.\n',
+                             'Incorrect content returned by server.')
+
+    def testShareConnections(self):
+        """Test that connection sharing is only turned on when asked for"""
+        if not hasattr(pycurl, 'LOCK_DATA_CONNECT'):
+            self.assertRaises(ValueError, friendly_curl.curl_share,
+                              connections=True)
+            return
+        share = friendly_curl.curl_share(connections=True)
+        self.assert_(share is not friendly_curl.curl_share())
+        self.assert_(share is not friendly_curl.curl_share(connections=True))
+
+class TestCurlHandlePool(unittest.TestCase):
+    
+    def testReuse(self):
+        """Test that a checked in handle is handed out again"""
+        pool = friendly_curl.CurlHandlePool(max_size=2)
+        with pool.handle() as h1:
+            self.assertEqual(pool.stats(), {'in_use': 1, 'idle': 0,
+                                            'created': 1, 'evicted': 0})
+        with pool.handle() as h2:
+            self.assert_(h1 is h2)
+        self.assertEqual(pool.stats(), {'in_use': 0, 'idle': 1,
+                                        'created': 1, 'evicted': 0})
+    
+    def testMaxSize(self):
+        """Test that checkout waits for a handle when the pool is full"""
+        pool = friendly_curl.CurlHandlePool(max_size=1)
+        h1 = pool.checkout()
+        self.assertRaises(friendly_curl.PoolTimeout, pool.checkout, 0.01)
+        timer = threading.Timer(0.05, pool.checkin, (h1,))
+        timer.start()
+        h2 = pool.checkout(5)
+        self.assert_(h1 is h2)
+        timer.join()
+    
+    def testIdleEviction(self):
+        """Test that handles idle for too long are closed"""
+        pool = friendly_curl.CurlHandlePool(max_size=2, max_idle_time=0)
+        h1 = pool.checkout()
+        pool.checkin(h1)
+        time.sleep(0.01)
+        pool.evict_idle()
+        self.assertEqual(pool.stats(), {'in_use': 0, 'idle': 0,
+                                        'created': 1, 'evicted': 1})
+        h2 = pool.checkout()
+        self.assert_(h1 is not h2)
+        self.assertEqual(pool.stats()['created'], 2)
+
+class TestAsyncFriendlyCURL(unittest.TestCase):
+    
+    def testConcurrentGets(self):
+        """Test several get requests in flight at once on one thread"""
+        self.paths = []
+        class TestRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+            test_object = self
+            
+            def do_GET(self):
+                self.test_object.paths.append(self.path)
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain')
+                self.end_headers()
+                self.wfile.write('Path: %s' % self.path)
+            
+            def do_HEAD(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain')
+                self.end_headers()
+        
+        started = threading.Event()
+        def test_thread():
+            server = BaseHTTPServer.HTTPServer(('', 6110), TestRequestHandler)
+            started.set()
+            for i in range(4):
+                server.handle_request()
+            server.server_close()
+        
+        thread = threading.Thread(target=test_thread)
+        thread.start()
+        started.wait()
+        
+        afcurl = friendly_curl.AsyncFriendlyCURL(max_concurrency=2)
+        futures = [afcurl.get_url('http://127.0.0.1:6110/%d' % i)
+                   for i in range(3)]
+        futures.append(afcurl.head_url('http://127.0.0.1:6110/head'))
+        for i, future in enumerate(futures[:3]):
+            resp, content = afcurl.loop.run_until_complete(future)
+            self.assertEqual(resp['status'], 200, 'Unexpected HTTP status.')
+            self.assertEqual(content.getvalue(), 'Path: /%d' % i,
+                             'Incorrect content returned by server.')
+        resp, content = afcurl.loop.run_until_complete(futures[3])
+        self.assertEqual(resp['content-type'], 'text/plain')
+        self.assertEqual(content.getvalue(), '')
+        afcurl.close()
+        thread.join()
+    
+    def testError(self):
+        """Test that a failed transfer sets the future's exception"""
+        afcurl = friendly_curl.AsyncFriendlyCURL()
+        future = afcurl.get_url('http://127.0.0.1:6111/')
+        self.assertRaises(pycurl.error, afcurl.loop.run_until_complete, future)
+        afcurl.close()
+
+class TestSelectLoop(unittest.TestCase):
+    
+    def testHighFileDescriptor(self):
+        """Test watching a file descriptor above select's FD_SETSIZE"""
+        import resource
+        if resource.getrlimit(resource.RLIMIT_NOFILE)[0] <= 2000:
+            return
+        read_fd, write_fd = os.pipe()
+        high_fd = 2000
+        os.dup2(read_fd, high_fd)
+        loop = friendly_curl.SelectLoop()
+        try:
+            future = loop.create_future()
+            def on_readable():
+                loop.remove_reader(high_fd)
+                future.set_result(os.read(high_fd, 100))
+            loop.add_reader(high_fd, on_readable)
+            loop.call_later(0.01, os.write, write_fd, 'ready')
+            self.assertEqual(loop.run_until_complete(future), 'ready')
+        finally:
+            loop.close()
+            for fd in (read_fd, write_fd, high_fd):
+                os.close(fd)
+
+class TestStreamingResponse(unittest.TestCase):
+    
+    def testStream(self):
+        """Test reading a body while the server is still sending it"""
+        proceed = threading.Event()
+        class TestRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+            test_object = self
+            
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain')
+                self.end_headers()
+                self.wfile.write('first line\r\n')
+                self.wfile.flush()
+                proceed.wait()
+                for i in range(1000):
+                    self.wfile.write('line %d\n' % i)
+        
+        started = threading.Event()
+        def test_thread():
+            server = BaseHTTPServer.HTTPServer(('', 6110), TestRequestHandler)
+            started.set()
+            server.handle_request()
+            server.server_close()
+        
+        thread = threading.Thread(target=test_thread)
+        thread.start()
+        started.wait()
+        
+        fcurl = friendly_curl.FriendlyCURL()
+        stream = fcurl.stream_url('http://127.0.0.1:6110/export',
+                                  max_buffer=64)
+        self.assertEqual(stream.response['status'], 200,
+                         'Unexpected HTTP status.')
+        self.assertEqual(stream.response['content-type'], 'text/plain',
+                         'Unexpected Content-Type from server.')
+        lines = stream.iter_lines()
+        self.assertEqual(lines.next(), 'first line')
+        proceed.set()
+        self.assertEqual(list(lines), ['line %d' % i for i in range(1000)])
+        self.assertEqual(stream.read(), '')
+        thread.join()
+    
+    def testStreamHeadersFirst(self):
+        """Test that streaming returns once the headers arrive"""
+        proceed = threading.Event()
+        class TestRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/redirect':
+                    self.send_response(302)
+                    self.send_header('Location', '/slow')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain')
+                self.end_headers()
+                self.wfile.flush()
+                proceed.wait(2)
+                self.wfile.write('The body.\n')
+        
+        started = threading.Event()
+        def test_thread():
+            server = BaseHTTPServer.HTTPServer(('', 6110), TestRequestHandler)
+            started.set()
+            server.handle_request()
+            server.handle_request()
+            server.server_close()
+        
+        thread = threading.Thread(target=test_thread)
+        thread.start()
+        started.wait()
+        
+        fcurl = friendly_curl.FriendlyCURL()
+        start = time.time()
+        stream = fcurl.stream_url('http://127.0.0.1:6110/redirect')
+        self.assertTrue(time.time() - start < 1,
+                        'Waited for the body before returning.')
+        self.assertEqual(stream.response['status'], 200,
+                         'Returned the headers of the redirect.')
+        self.assertEqual(stream.response['content-type'], 'text/plain')
+        proceed.set()
+        self.assertEqual(stream.read(), 'The body.\n')
+        thread.join()
+    
+    def testRead(self):
+        """Test reading a streamed body in pieces larger than the buffer"""
+        class TestRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+            test_object = self
+            
+            def do_GET(self):
+                self.send_response(200)
+                self.end_headers()
+                self.wfile.write('x' * 100000)
+        
+        started = threading.Event()
+        def test_thread():
+            server = BaseHTTPServer.HTTPServer(('', 6110), TestRequestHandler)
+            started.set()
+            server.handle_request()
+            server.server_close()
+        
+        thread = threading.Thread(target=test_thread)
+        thread.start()
+        started.wait()
+        
+        fcurl = friendly_curl.FriendlyCURL()
+        with fcurl.stream_url('http://127.0.0.1:6110/',
+                              max_buffer=1000) as stream:
+            self.assertEqual(len(stream.read(30000)), 30000)
+            self.assertEqual(len(stream.read()), 70000)
+        thread.join()
@@ -0,0 +1,83 @@
+"""Unit tests for friendly_curl's metrics registry."""
+
+import threading
+import unittest
+
+from friendly_curl.metrics import MetricsRegistry
+from friendly_curl.response import Timings
+
+class TestMetricsRegistry(unittest.TestCase):
+
+    def testCounters(self):
+        registry = MetricsRegistry()
+        registry.inc('hits', {'host': 'a'})
+        registry.inc('hits', {'host': 'a'}, 2)
+        registry.inc('hits', {'host': 'b'})
+        registry.inc('total')
+        self.assertEqual(registry.snapshot(),
+                         {('hits', (('host', 'a'),)): 3,
+                          ('hits', (('host', 'b'),)): 1,
+                          ('total', ()): 1})
+        registry.reset()
+        self.assertEqual(registry.snapshot(), {})
+
+    def testHistogram(self):
+        registry = MetricsRegistry(buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 2):
+            registry.observe('latency', None, value)
+        self.assertEqual(registry.snapshot()[('latency', ())],
+                         {'count': 4, 'sum': 2.65, 'counts': [2, 1, 1]})
+        self.assertEqual(registry.exposition(),
+                         '# TYPE latency histogram\n'
+                         'latency_bucket{le="0.1"} 2\n'
+                         'latency_bucket{le="1"} 3\n'
+                         'latency_bucket{le="+Inf"} 4\n'
+                         'latency_sum 2.65\n'
+                         'latency_count 4\n')
+
+    def testThreads(self):
+        registry = MetricsRegistry()
+        def record():
+            for i in range(100):
+                registry.inc('calls')
+        threads = [threading.Thread(target=record) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        record()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(registry.snapshot(), {('calls', ()): 500})
+        # Metrics from threads that have exited are still counted.
+        self.assertEqual(registry.snapshot(), {('calls', ()): 500})
+
+    def testRecordRequest(self):
+        registry = MetricsRegistry()
+        registry.record_request('GET', 404, Timings(
+            total=0.25, num_connects=1, size_download=10.0, size_upload=0.0,
+            effective_url='http://Example.com:8080/path'))
+        registry.record_request('POST', None, Timings(
+            effective_url='http://example.com:8080/'))
+        registry.record_cache('hit')
+        snapshot = registry.snapshot()
+        host = ('host', 'example.com:8080')
+        self.assertEqual(snapshot[('friendly_curl_requests_total',
+                                   (host, ('method', 'GET'),
+                                    ('status', '4xx')))], 1)
+        self.assertEqual(snapshot[('friendly_curl_requests_total',
+                                   (host, ('method', 'POST'),
+                                    ('status', 'error')))], 1)
+        self.assertEqual(snapshot[('friendly_curl_request_seconds',
+                                   (host, ('method', 'GET')))]['count'], 1)
+        self.assertEqual(snapshot[('friendly_curl_connections_total',
+                                   (host,))], 1)
+        self.assertEqual(snapshot[('friendly_curl_received_bytes_total',
+                                   (host,))], 10)
+        self.assert_(('friendly_curl_sent_bytes_total', (host,))
+                     not in snapshot)
+        self.assertEqual(snapshot[('friendly_curl_cache_total',
+                                   (('result', 'hit'),))], 1)
+        exposition = registry.exposition()
+        self.assert_('# TYPE friendly_curl_requests_total counter\n'
+                     in exposition)
+        self.assert_('friendly_curl_requests_total{host="example.com:8080",'
+                     'method="GET",status="4xx"} 1\n' in exposition)
@@ -0,0 +1,111 @@
+"""Unit tests for friendly_curl's response headers."""
+
+from cStringIO import StringIO
+import pickle
+import unittest
+
+from friendly_curl.response import Headers, HeaderParser, Response, \
+     Timings
+
+class TestHeaders(unittest.TestCase):
+
+    def testCaseInsensitive(self):
+        headers = Headers([('Content-Type', 'text/html'), ('status', 200)])
+        self.assertEqual(headers['content-type'], 'text/html')
+        self.assertEqual(headers['CONTENT-TYPE'], 'text/html')
+        self.assert_('Content-type' in headers)
+        self.assertEqual(sorted(headers.keys()), ['content-type', 'status'])
+        self.assertEqual(headers, {'content-type': 'text/html', 'status': 200})
+        self.assertEqual(dict(headers),
+                         {'content-type': 'text/html', 'status': 200})
+        self.assertEqual(headers.get('missing', 'default'), 'default')
+        self.assertRaises(KeyError, lambda: headers['missing'])
+
+    def testMultipleValues(self):
+        headers = Headers([('Set-Cookie', 'a=1'), ('Date', 'x'),
+                           ('set-cookie', 'b=2')])
+        self.assertEqual(headers['set-cookie'], 'b=2')
+        self.assertEqual(headers.get_all('Set-Cookie'), ['a=1', 'b=2'])
+        self.assertEqual(headers.get_all('Link'), None)
+        headers.add('Set-Cookie', 'c=3')
+        self.assertEqual(headers.get_all('set-cookie'), ['a=1', 'b=2', 'c=3'])
+        headers['Set-Cookie'] = 'd=4'
+        self.assertEqual(headers.get_all('set-cookie'), ['d=4'])
+
+    def testCopyAndPickle(self):
+        headers = Headers([('Link', '<a>'), ('Link', '<b>')])
+        for copy in (headers.copy(),
+                     pickle.loads(pickle.dumps(headers,
+                                               pickle.HIGHEST_PROTOCOL))):
+            self.assertEqual(copy.get_all('link'), ['<a>', '<b>'])
+        copy['link'] = '<c>'
+        self.assertEqual(headers.get_all('link'), ['<a>', '<b>'])
+        self.assertEqual(Headers({'ETag': 'x'})['etag'], 'x')
+
+class TestHeaderParser(unittest.TestCase):
+
+    def parse(self, lines, **kwargs):
+        parser = HeaderParser(**kwargs)
+        for line in lines:
+            parser(line + '\r\n')
+        return parser
+
+    def testParse(self):
+        headers = self.parse(['HTTP/1.1 200 OK',
+                              'Content-Type:text/html',
+                              'X-Note: a: b',
+                              'X-Folded: first',
+                              '\tsecond',
+                              'Status: 404',
+                              '']).headers()
+        self.assertEqual(headers, {'content-type': 'text/html',
+                                   'x-note': 'a: b',
+                                   'x-folded': 'first second',
+                                   'status': 200})
+
+    def testRedirects(self):
+        lines = ['HTTP/1.1 302 Found', 'Location: /next', '',
+                 'HTTP/1.1 100 Continue', '',
+                 'HTTP/1.1 200 OK', 'Content-Type: text/plain', '']
+        parser = self.parse(lines)
+        self.assertEqual(parser.headers(),
+                         {'content-type': 'text/plain', 'status': 200})
+        self.assertEqual(parser.history, [])
+        parser = self.parse(lines, keep_history=True)
+        self.assertEqual(parser.history, [{'location': '/next', 'status': 302},
+                                          {'status': 100}])
+
+    def testComplete(self):
+        parser = HeaderParser()
+        parser('HTTP/1.1 100 Continue\r\n')
+        self.assertEqual(parser.status, 100)
+        parser('\r\n')
+        self.assertTrue(parser.complete)
+        parser('HTTP/1.1 200 OK\r\n')
+        parser('Content-Type: text/plain\r\n')
+        self.assertFalse(parser.complete)
+        parser('\r\n')
+        self.assertTrue(parser.complete)
+        self.assertEqual(parser.status, 200)
+
+class TestResponse(unittest.TestCase):
+
+    def testUnpack(self):
+        body = StringIO('body')
+        response = Response(Headers([('status', 204)]), body)
+        headers, content = response
+        self.assertEqual(headers['status'], 204)
+        self.assert_(content is body)
+        self.assert_(response[1] is body)
+        self.assertEqual(response.status, 204)
+        self.assertEqual(response.history, [])
+        self.assertRaises(AttributeError, setattr, response, 'other', 1)
+
+class TestTimings(unittest.TestCase):
+
+    def testTimings(self):
+        timings = Timings(total=0.5, num_connects=0)
+        self.assertEqual(timings.total, 0.5)
+        self.assertEqual(timings.appconnect, None)
+        self.assertEqual(timings.as_dict()['num_connects'], 0)
+        self.assertRaises(TypeError, Timings, bogus=1)
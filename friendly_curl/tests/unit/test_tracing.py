@@ -0,0 +1,81 @@
+"""Unit tests for friendly_curl's wire tracing."""
+
+from cStringIO import StringIO
+import logging
+import unittest
+
+import pycurl
+
+from friendly_curl.tracing import Trace, Tracer
+
+class TestTrace(unittest.TestCase):
+
+    def testEvents(self):
+        trace = Trace('http://example.com/', 'GET', max_events=3)
+        trace(pycurl.INFOTYPE_TEXT, 'Connected to example.com port 80\n')
+        trace(pycurl.INFOTYPE_HEADER_OUT, 'GET / HTTP/1.1\r\nHost: x\r\n\r\n')
+        trace(pycurl.INFOTYPE_DATA_OUT, 'abc')
+        trace(pycurl.INFOTYPE_HEADER_IN, 'HTTP/1.1 200 OK\r\n')
+        trace(pycurl.INFOTYPE_DATA_IN, 'hello')
+        trace(pycurl.INFOTYPE_HEADER_IN, '\r\n')
+        self.assertEqual([event[1:] for event in trace.events],
+                         [('connect', 'Connected to example.com port 80'),
+                          ('header_out', 'GET / HTTP/1.1\r\nHost: x'),
+                          ('header_in', 'HTTP/1.1 200 OK')])
+        self.assertEqual(trace.dropped, 1)
+        self.assertEqual((trace.bytes_in, trace.bytes_out), (5, 3))
+        text = trace.format()
+        self.assert_(text.startswith('GET http://example.com/ None ('), text)
+        self.assert_('connect    Connected to' in text, text)
+        self.assert_('1 more events dropped' in text, text)
+        self.assert_('5 bytes in, 3 bytes out' in text, text)
+
+class TestTracer(unittest.TestCase):
+
+    def testSampling(self):
+        tracer = Tracer(sample_rate=0)
+        self.assertEqual(tracer.start('http://example.com/', 'GET'), None)
+        self.assert_(tracer.start('http://example.com/', 'GET', True)
+                     is not None)
+        tracer.sample_rate = 1
+        self.assert_(tracer.start('http://example.com/', 'GET') is not None)
+        self.assertEqual(tracer.start('http://example.com/', 'GET', False),
+                         None)
+        self.assertEqual(tracer.start('http://example.com/', 'GET', 0.0),
+                         None)
+
+    def testRingBuffer(self):
+        tracer = Tracer(capacity=2, sample_rate=1)
+        for i in range(3):
+            trace = tracer.start('http://example.com/%d' % i, 'GET')
+            tracer.finish(trace, 200)
+        self.assertEqual([trace.url for trace in tracer.traces()],
+                         ['http://example.com/1', 'http://example.com/2'])
+        out = StringIO()
+        tracer.dump(out)
+        self.assertEqual(out.getvalue(), tracer.dump())
+        self.assert_('GET http://example.com/2 200' in tracer.dump())
+        tracer.clear()
+        self.assertEqual(tracer.traces(), [])
+
+    def testDumpOnError(self):
+        records = []
+        class Handler(logging.Handler):
+            def emit(self, record):
+                records.append(record.getMessage())
+        handler = Handler()
+        logger = logging.getLogger('friendly_curl.tracing')
+        logger.addHandler(handler)
+        try:
+            tracer = Tracer(sample_rate=1, dump_on_error=True)
+            tracer.finish(tracer.start('http://example.com/ok', 'GET'), 200)
+            tracer.finish(tracer.start('http://example.com/down', 'GET'), 503)
+            error = pycurl.error(7, "Couldn't connect")
+            tracer.finish(tracer.start('http://example.com/gone', 'GET'),
+                          None, error=error)
+        finally:
+            logger.removeHandler(handler)
+        self.assertEqual(len(records), 2)
+        self.assert_('GET http://example.com/down 503' in records[0])
+        self.assert_('GET http://example.com/gone failed:' in records[1])
+        self.assert_(tracer.traces()[2].failed)
@@ -0,0 +1,187 @@
+"""Sampled wire tracing for :class:`friendly_curl.FriendlyCURL`."""
+
+from __future__ import with_statement
+
+__all__ = ['Tracer', 'Trace']
+
+import collections
+import logging
+import random
+import time
+try:
+    import threading as _threading
+except ImportError:
+    import dummy_threading as _threading
+
+import pycurl
+
+log = logging.getLogger(__name__)
+
+# What libcurl's informational messages mean for a trace, by prefix.
+_TEXT_KINDS = (('Connected to', 'connect'),
+               ('Re-using existing connection', 'reuse'),
+               ('Issue another request', 'redirect'))
+
+class Trace(object):
+    """The wire events of one traced request, recorded from libcurl's debug
+    callback. Headers are kept as sent and received; bodies are only
+    counted.
+
+    :ivar url: The URL requested.
+    :ivar method: The request method.
+    :ivar started: When the request started, as a timestamp.
+    :ivar events: ``(seconds, kind, data)`` tuples, where ``seconds`` is the\
+    time since the request started and ``kind`` one of ``'connect'``,\
+    ``'reuse'``, ``'redirect'``, ``'info'``, ``'header_out'`` or\
+    ``'header_in'``.
+    :ivar dropped: Events not recorded because there were too many.
+    :ivar bytes_in: Body bytes received.
+    :ivar bytes_out: Body bytes sent.
+    :ivar status: The HTTP status, or ``None`` if the request failed.
+    :ivar error: The ``pycurl.error`` the request failed with, if it did.
+    :ivar timings: The request's :class:`~friendly_curl.response.Timings`."""
+
+    __slots__ = ('url', 'method', 'started', 'events', 'dropped', 'bytes_in',
+                 'bytes_out', 'status', 'error', 'timings', '_max_events')
+
+    def __init__(self, url, method, max_events=200):
+        self.url = url
+        self.method = method
+        self.started = time.time()
+        self.events = []
+        self.dropped = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.status = None
+        self.error = None
+        self.timings = None
+        self._max_events = max_events
+
+    def __call__(self, infotype, data):
+        """Record an event; a ``pycurl.DEBUGFUNCTION``."""
+        if infotype == pycurl.INFOTYPE_DATA_IN:
+            self.bytes_in += len(data)
+            return 0
+        if infotype == pycurl.INFOTYPE_DATA_OUT:
+            self.bytes_out += len(data)
+            return 0
+        if infotype == pycurl.INFOTYPE_TEXT:
+            kind = 'info'
+            for prefix, text_kind in _TEXT_KINDS:
+                if data.startswith(prefix):
+                    kind = text_kind
+                    break
+        elif infotype == pycurl.INFOTYPE_HEADER_IN:
+            kind = 'header_in'
+        elif infotype == pycurl.INFOTYPE_HEADER_OUT:
+            kind = 'header_out'
+        else:
+            # Encrypted TLS data.
+            return 0
+        if len(self.events) < self._max_events:
+            self.events.append((time.time() - self.started, kind,
+                                data.rstrip('\r\n')))
+        else:
+            self.dropped += 1
+        return 0
+
+    @property
+    def failed(self):
+        """Whether the request failed or got a server error."""
+        return self.error is not None or (self.status or 0) >= 500
+
+    def format(self):
+        """Get the trace as text, for logs."""
+        if self.error is not None:
+            outcome = 'failed: %s' % (self.error,)
+        else:
+            outcome = self.status
+        lines = ['%s %s %s (%s)' % (
+            self.method, self.url, outcome,
+            time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(self.started)))]
+        for seconds, kind, data in self.events:
+            data = data.replace('\r\n', '\n').replace('\n', '\n' + ' ' * 24)
+            lines.append('  +%9.6fs %-10s %s' % (seconds, kind, data))
+        if self.dropped:
+            lines.append('  %d more events dropped' % self.dropped)
+        lines.append('  %d bytes in, %d bytes out' % (self.bytes_in,
+                                                      self.bytes_out))
+        return '\n'.join(lines)
+
+    def __repr__(self):
+        return '<Trace %s %s>' % (self.method, self.url)
+
+class Tracer(object):
+    """Records a sample of requests' wire events in a ring buffer holding the
+    most recent :class:`Trace` objects. Requests that aren't sampled cost one
+    random number; only sampled ones turn on libcurl's debug callback.
+
+    Pass one to :class:`~friendly_curl.FriendlyCURL` as ``tracer``. A request
+    can override the sample rate with its ``trace`` argument: ``True`` to
+    always trace it, ``False`` never to, or a rate between 0 and 1.
+
+    :param capacity: How many traces to keep.
+    :type capacity: int
+    :param sample_rate: The fraction of requests to trace.
+    :type sample_rate: float
+    :param dump_on_error: Log the traces of requests that fail or get a\
+    server error, at WARNING level, as they finish.
+    :type dump_on_error: bool
+    :param max_events: The most events to record for each request.
+    :type max_events: int"""
+
+    def __init__(self, capacity=100, sample_rate=0.01, dump_on_error=False,
+                 max_events=200):
+        self.sample_rate = sample_rate
+        self.dump_on_error = dump_on_error
+        self.max_events = max_events
+        self._traces = collections.deque(maxlen=capacity)
+        self._lock = _threading.Lock()
+
+    def start(self, url, method, trace=None):
+        """Decide whether to trace a request, and start its :class:`Trace` if
+        so.
+
+        :param trace: Overrides :attr:`sample_rate`, as described above.
+        :returns: The :class:`Trace` to pass libcurl's events to, or\
+        ``None``."""
+        if trace is None:
+            rate = self.sample_rate
+        elif trace is True or trace is False:
+            rate = float(trace)
+        else:
+            rate = trace
+        if rate <= 0 or (rate < 1 and random.random() >= rate):
+            return None
+        return Trace(url, method, self.max_events)
+
+    def finish(self, trace, status, timings=None, error=None):
+        """Keep a finished :class:`Trace`, logging it if it failed and
+        :attr:`dump_on_error` is set."""
+        trace.status = status
+        trace.timings = timings
+        trace.error = error
+        with self._lock:
+            self._traces.append(trace)
+        if self.dump_on_error and trace.failed:
+            log.warning('Request trace:\n%s', trace.format())
+
+    def traces(self):
+        """Get the traces kept, oldest first."""
+        with self._lock:
+            return list(self._traces)
+
+    def dump(self, out=None):
+        """Get the traces kept as text, oldest first.
+
+        :param out: A file to write them to instead.
+        :type out: ``.write(str)``-able file-like object"""
+        text = ''.join(trace.format() + '\n' for trace in self.traces())
+        if out is None:
+            return text
+        out.write(text)
+
+    def clear(self):
+        """Discard the traces kept."""
+        with self._lock:
+            self._traces.clear()
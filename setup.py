@@ -30,5 +30,7 @@ setup(name='friendly_curl',
       ],
       entry_points="""
       # -*- Entry points: -*-
+      [console_scripts]
+      friendly-curl-cache = friendly_curl.cache:main
       """,
       )